@@ -1,15 +1,13 @@
 ﻿import json
 import os
-from openai import OpenAI
 import jenkinstools
+from llm_gateway import gateway
 
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
-client = OpenAI(api_key=os.getenv("AI_API_KEY"), base_url=os.getenv("AI_API_BASE"))
-
 tools = [
     # 工具1 获取当前热更任务的状态
     {
@@ -49,7 +47,7 @@ tools = [
 
 
 def process_user_input(user_input):
-    response = client.chat.completions.create(
+    response = gateway.chat(
         model=os.getenv("AI_MODEL"),
         messages=[
             {"role": "system", "content": "你是一个Jenkins任务管理助手。你可以帮助用户获取任务状态或执行任务。"},
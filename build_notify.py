@@ -3,10 +3,17 @@ import os
 import re
 import subprocess
 import sys
+import time
+import threading
+import argparse
 import locale
 from datetime import datetime
 from http import HTTPStatus
 from feishu_notifier import FeishuNotifier
+import svn_log
+from llm_gateway import gateway
+import log_summarizer
+import log_compactor
 from dotenv import load_dotenv
 
 # 加载.env文件中的环境变量
@@ -99,6 +106,7 @@ class BuildConfig:
         self.patch_type = os.environ.get('PatchType', '')
         self.workspace = os.environ.get('WORKSPACE', '')
         self.show_ai_assistance = os.environ.get('ShowAIAssistance', '')
+        self.wait_ai_analysis = os.environ.get('WaitAIAnalysis', '')
 
     def update_config(self, workspace=None, show_ai=None):
         if workspace:
@@ -111,63 +119,125 @@ def format_svn_log(log_content):
     格式化SVN日志内容
     
     Args:
-        log_content (str): SVN日志原始内容
+        log_content: svn log --xml 的输出(str 或 bytes)，或已解析的 svn_log.LogEntry 序列
     
     Returns:
-        str: 格式化后的日志内容
+        str: 格式化后的日志内容，每个提交一行 "版本号 提交人 日志"
     """
-    result = []
-    current_revision = None
-    current_author = None
-    current_message_lines = []
-    
-    for line in log_content.split('\n'):
-        line = line.strip()
-        if not line or line.startswith('Changed paths:') or line.startswith('---'):
-            # 如果遇到空行、Changed paths或分隔线，且已经收集了一条完整的提交信息
-            if current_revision and current_author and current_message_lines:
-                message = '\n'.join(current_message_lines)
-                result.append(f"{current_revision} {current_author} {message}")
-                current_message_lines = []
-            continue
-            
-        if line.startswith('r'):
-            # 新的提交记录开始
-            parts = line.split('|')
-            if len(parts) >= 2:
-                current_revision = parts[0].strip()[1:]  # 去掉 'r' 前缀
-                current_author = parts[1].strip()
-                current_message_lines = []
-        else:
-            # 提交信息行
-            current_message_lines.append(line)
-    
-    # 处理最后一条记录
-    if current_revision and current_author and current_message_lines:
-        message = '\n'.join(current_message_lines)
-        result.append(f"{current_revision} {current_author} {message}")
-    
-    return '\n'.join(result)
+    if isinstance(log_content, (str, bytes)):
+        log_content = svn_log.parse_log(log_content)
+    return svn_log.format_simple(log_content)
+
+SVN_PENDING_TEXT = "正在获取SVN日志..."
+SVN_FAILED_TEXT = "获取SVN日志失败"
+AI_PENDING_TEXT = "AI助手正在分析..."
+AI_FAILED_TEXT = "AI助手已阵亡"
+AI_TIMEOUT_TEXT = "AI助手分析超时"
+
+CHUNK_PROMPT = """
+下面是一段SVN提交日志，它只是较长日志中的一部分，最终点评会根据各段的摘要进行。
+请按提交人逐个整理，保留用户名（英文）、版本号、提交日志原文和修改的文件概况，
+并指出日志是否清晰、是否与修改的文件一致、是否多次以相同日志提交、新增的Assets资源是否缺少meta文件。
+不要评选最佳或最差提交人，使用纯文本格式。
+"""
+
+REDUCE_HINT = "\n以下不是原始日志，而是按时间顺序分段整理的提交摘要，请据此完成点评：\n"
+
+def _complete(messages, config, on_delta=None):
+    return gateway.complete(
+        messages=messages,
+        model=config.model_name,
+        base_url=config.endpoint,
+        api_key=config.token,
+        on_delta=on_delta,
+        top_p=0.7,
+        temperature=1.0
+    )
+
+def summarize_log_chunk(chunk, config):
+    """总结一段SVN日志，供最终点评使用，返回的摘要不带缓存标记"""
+    return _complete([
+        {'role': 'system', 'content': SYSTEM_PROMPT + HUMANSETTING},
+        {'role': 'user', 'content': CHUNK_PROMPT + chunk}
+    ], config).content
+
+def judge_log(text, config, summarized=False, on_delta=None):
+    """根据完整日志或分段摘要评选最佳/最差提交人"""
+    prompt = PROMPT + (REDUCE_HINT + text if summarized else text)
+    return _complete([
+        {'role': 'system', 'content': SYSTEM_PROMPT + HUMANSETTING},
+        {'role': 'user', 'content': prompt}
+    ], config, on_delta).marked_content
+
+def compact_log_for_ai(log):
+    """
+    压缩发送给模型的 svn log -v 输出并打印节省的token，环境变量 LOG_COMPACT=false 时不压缩
+
+    Args:
+        log: svn_log.LogEntry 序列，或 svn log -v 的文本输出
+    """
+    if os.getenv("LOG_COMPACT", "true").lower() != "true":
+        return log if isinstance(log, str) else svn_log.format_verbose(log)
+    compacted = log_compactor.compact_log(log)
+    print(f"[压缩] 日志token {compacted.tokens_before} -> {compacted.tokens_after} "
+          f"(减少 {compacted.saved_ratio:.0%})")
+    for item in compacted.missing_meta:
+        print(f"[压缩] 缺少meta配对: {item}")
+    return compacted.text
 
 ### 调用AI助手
-def call_with_stream(content: str, config: BuildConfig):
-    messages = [
-        {'role': 'system',
-            'content': SYSTEM_PROMPT + HUMANSETTING},
-        {'role': 'user', 'content': PROMPT + content}
-    ]
-    from openai import OpenAI
+def call_with_stream(content, config: BuildConfig, on_delta=None):
+    """
+    调用AI助手点评SVN日志
+
+    日志先经过 compact_log_for_ai 压缩，超过 LOG_CHUNK_TOKENS 时再分块并行总结，
+    最后根据摘要点评，见 log_summarizer.summarize_log
+
+    Args:
+        content: svn_log.LogEntry 序列，或 svn log -v 的文本输出
+        on_delta: 指定时以流式调用，每收到新内容回调一次目前为止的完整文本，只作用于最终点评
+    """
     try:
-        client = OpenAI(api_key=config.token, base_url=config.endpoint)
-        completion = client.chat.completions.create(
-            model=config.model_name,
-            messages=messages,
-            top_p=0.7,
-            temperature=1.0
+        content = compact_log_for_ai(content)
+        return log_summarizer.summarize_log(
+            content,
+            lambda chunk: summarize_log_chunk(chunk, config),
+            lambda text, summarized: judge_log(text, config, summarized, on_delta)
         )
-        return completion.choices[0].message.content 
     except Exception as e:
-        print(f"AI助手已阵亡: {e}")
+        print(f"{AI_FAILED_TEXT}: {e}")
+
+
+class CardStreamUpdater:
+    """
+    把AI的流式输出节流后更新到已发送的构建通知卡片
+
+    飞书限制同一条消息每秒最多更新5次，默认每秒最多更新一次，可通过环境变量 FEISHU_UPDATE_INTERVAL 调整
+    """
+
+    def __init__(self, notifier, message_id, card_args, min_interval=None):
+        self.notifier = notifier
+        self.message_id = message_id
+        self.card_args = card_args
+        self.min_interval = min_interval or float(os.getenv("FEISHU_UPDATE_INTERVAL", 1.0))
+        self.last_update = 0.0
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def update(self, text):
+        """流式回调，距离上次更新不足min_interval或已经结束时跳过"""
+        with self._lock:
+            now = time.monotonic()
+            if self.closed or now - self.last_update < self.min_interval:
+                return
+            self.last_update = now
+            self.notifier.update_build_message(self.message_id, *self.card_args, text + " ▌")
+
+    def finish(self, text):
+        """写入最终结果，之后的流式回调不再更新卡片"""
+        with self._lock:
+            self.closed = True
+            return self.notifier.update_build_message(self.message_id, *self.card_args, text)
             
             
 def get_svn_logs(workspace, previous_revision, current_revision, username="username", password="password"):
@@ -182,30 +252,144 @@ def get_svn_logs(workspace, previous_revision, current_revision, username="usern
         password (str): SVN密码
         
     Returns:
-        tuple: (详细日志, 简单日志, 格式化后的日志)
+        tuple: (详细日志, svn_log.LogEntry 列表, 格式化后的日志)
     """
-    svn_command_for_AI = f'svn log -v -r {previous_revision}:{current_revision} {workspace}/DR22 --non-interactive --trust-server-cert'
-    svn_command_simple = f'svn log -r {previous_revision}:{current_revision} {workspace}/DR22 --non-interactive --trust-server-cert'
-    
+    # 只请求一次 svn log -v --xml，详细日志和格式化日志都由同一份记录生成；
+    # XML 固定为 UTF-8 编码，由解析器按声明解码，不再分别猜测编码
     try:
-        SVN_LOG = subprocess.check_output(svn_command_for_AI, shell=True, stderr=subprocess.STDOUT)
-        SVN_SIMPLE_LOG = subprocess.check_output(svn_command_simple, shell=True, stderr=subprocess.STDOUT)
-        
-        try:
-            SVN_LOG = SVN_LOG.decode('utf-8')
-            SVN_SIMPLE_LOG = SVN_SIMPLE_LOG.decode('gbk')
-        except UnicodeDecodeError:
-            SVN_LOG = SVN_LOG.decode('gbk')
-            SVN_SIMPLE_LOG = SVN_SIMPLE_LOG.decode('gbk')
-            
-        formatted_output = format_svn_log(SVN_SIMPLE_LOG)
-        return SVN_LOG, SVN_SIMPLE_LOG, formatted_output
+        entries = list(svn_log.iter_svn_log(f"{workspace}/DR22", f"{previous_revision}:{current_revision}"))
     except subprocess.CalledProcessError as e:
         print(f"执行SVN命令时出错: {e}")
         print(f"命令输出: {e.output}")
         raise
+    return svn_log.format_verbose(entries), entries, format_svn_log(entries)
+
+def read_revisions(workspace):
+    """读取Jenkins前置步骤写入的起止SVN版本号"""
+    with open(os.path.join(workspace, 'previous_revision.txt'), 'r') as f:
+        previous_revision = f.read().strip()
+    with open(os.path.join(workspace, 'current_revision.txt'), 'r') as f:
+        current_revision = f.read().strip()
+    return previous_revision, current_revision
+
+def get_build_status():
+    """根据之前步骤的执行结果返回 (状态, 退出码)"""
+    if os.environ.get('BUILD_EXIT_CODE', '0') != '0':
+        return "失败", os.environ.get('BUILD_EXIT_CODE', '1')
+    return "成功", '0'
+
+def build_hotfix_args(config, previous_revision, current_revision):
+    return f"""
+        是否更新SVN: {config.update_svn}
+        热更类型: {config.hotfix_type}
+        热更渠道: {config.hotfix_channel}
+        热更说明: {config.hotfix_desc}
+        目标服务器: {config.target_server}
+        PatchType: {config.patch_type}
+        更新前SVN版本: {previous_revision}
+        当前SVN版本: {current_revision}
+        """
+
+def fetch_svn_logs(config, previous_revision, current_revision):
+    """获取SVN日志，包括修改的文件，返回 (svn_log.LogEntry 列表, 格式化后的日志)"""
+    _, entries, formatted_output = get_svn_logs(config.workspace, previous_revision, current_revision)
+    return entries, formatted_output
+
+def run_analysis_phase(config, notifier, message_id, status, previous_revision, current_revision, deadline=None):
+    """
+    第二阶段：获取SVN日志并调用AI分析，结果更新到第一阶段发送的卡片上
+
+    message_id为空（第一阶段发送失败）时在结束后重新发送一条完整消息。
+    AI分析超过deadline秒（默认读取环境变量 AI_ANALYSIS_DEADLINE，否则为300）时卡片显示分析超时。
 
-def main(workspace=None, show_ai=None):
+    Returns:
+        bool: 消息是否发送/更新成功
+    """
+    if deadline is None:
+        deadline = float(os.getenv("AI_ANALYSIS_DEADLINE", 300))
+    hotfix_args = build_hotfix_args(config, previous_revision, current_revision)
+    show_ai = config.show_ai_assistance == 'true'
+
+    try:
+        entries, formatted_output = fetch_svn_logs(config, previous_revision, current_revision)
+    except subprocess.CalledProcessError:
+        if message_id:
+            notifier.update_build_message(message_id, config.job_name, config.build_number, status, hotfix_args,
+                                          SVN_FAILED_TEXT, "")
+        return False
+
+    card_args = (config.job_name, config.build_number, status, hotfix_args, formatted_output)
+    if not show_ai:
+        print(formatted_output)
+        if message_id:
+            return notifier.update_build_message(message_id, *card_args, "")
+        return notifier.send_message(*card_args, "")
+
+    if not message_id:
+        finished, finalResult = run_with_deadline(lambda: call_with_stream(entries, config), deadline)
+        if not finished:
+            return notifier.send_message(*card_args, AI_TIMEOUT_TEXT)
+        print(finalResult)
+        return notifier.send_message(*card_args, finalResult or AI_FAILED_TEXT)
+
+    # 日志先更新到卡片上，AI的输出再流式更新到同一张卡片
+    notifier.update_build_message(message_id, *card_args, AI_PENDING_TEXT)
+    updater = CardStreamUpdater(notifier, message_id, card_args)
+    finished, finalResult = run_with_deadline(
+        lambda: call_with_stream(entries, config, on_delta=updater.update), deadline
+    )
+    if not finished:
+        return updater.finish(AI_TIMEOUT_TEXT)
+    print(finalResult)
+    return updater.finish(finalResult or AI_FAILED_TEXT)
+
+def run_with_deadline(func, deadline):
+    """
+    在后台线程中执行func，最多等待deadline秒
+
+    Returns:
+        tuple: (是否在deadline内完成, func的返回值)，超时时后台线程继续运行，结果被丢弃
+    """
+    result = {}
+    worker = threading.Thread(target=lambda: result.update(value=func()), daemon=True)
+    worker.start()
+    worker.join(deadline)
+    if worker.is_alive():
+        print(f"AI分析超过 {deadline:.0f} 秒未完成")
+        return False, None
+    return True, result.get("value")
+
+def start_analysis_process(config, message_id):
+    """
+    在后台启动独立进程执行第二阶段，当前进程可以直接退出，不阻塞Jenkins
+
+    Jenkins结束构建时会杀掉构建派生的进程，通过 BUILD_ID/JENKINS_NODE_COOKIE=dontKillMe 避免
+    """
+    args = [sys.executable, os.path.abspath(__file__), '--phase2', message_id, '--workspace', config.workspace]
+    if config.show_ai_assistance == 'true':
+        args.append('--show-ai')
+    env = dict(os.environ, BUILD_ID='dontKillMe', JENKINS_NODE_COOKIE='dontKillMe')
+    log_file = open(os.path.join(config.workspace, 'build_notify_phase2.log'), 'ab')
+    kwargs = {}
+    if sys.platform == 'win32':
+        kwargs['creationflags'] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs['start_new_session'] = True
+    subprocess.Popen(args, env=env, stdout=log_file, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL, **kwargs)
+    log_file.close()
+    print(f"AI分析在后台进行，日志: {log_file.name}")
+
+def main(workspace=None, show_ai=None, wait=None, phase2_message_id=None):
+    """
+    发送构建通知，分两个阶段:
+        1. 知道构建状态和版本范围后立即发送卡片
+        2. 获取SVN日志、调用AI分析，结果更新到同一张卡片
+
+    Args:
+        wait (bool): 是否等待第二阶段完成后再退出，默认读取Jenkins参数 WaitAIAnalysis，
+            否则第二阶段在后台进程中进行
+        phase2_message_id (str): 后台进程使用，只执行第二阶段并更新该消息
+    """
     config = BuildConfig()
     config.update_config(workspace, show_ai)
     
@@ -224,70 +408,42 @@ def main(workspace=None, show_ai=None):
     print(f"ShowAIAssistance: {config.show_ai_assistance}")
 
     # 读取SVN版本号
-    with open(os.path.join(config.workspace, 'previous_revision.txt'), 'r') as f:
-        PREVIOUS_REVISION = f.read().strip()
-    with open(os.path.join(config.workspace, 'current_revision.txt'), 'r') as f:
-        CURRENT_REVISION = f.read().strip()
+    PREVIOUS_REVISION, CURRENT_REVISION = read_revisions(config.workspace)
 
     # 检查之前步骤的执行结果
-    if os.environ.get('BUILD_EXIT_CODE', '0') != '0':
-        STATUS = "失败"
-        BUILD_EXIT_CODE = os.environ.get('BUILD_EXIT_CODE', '1')
-    else:
-        STATUS = "成功"
-        BUILD_EXIT_CODE = '0'
-
-    # 获取SVN日志，包括修改的文件
-    svn_command_for_AI = f'svn log -v -r {PREVIOUS_REVISION}:{CURRENT_REVISION} {config.workspace}/DR22 --non-interactive --trust-server-cert'
-    svn_command_simple = f'svn log -r {PREVIOUS_REVISION}:{CURRENT_REVISION} {config.workspace}/DR22 --non-interactive --trust-server-cert'
-    try:
-        SVN_LOG = subprocess.check_output(svn_command_for_AI, shell=True, stderr=subprocess.STDOUT)
-        SVN_SIMPLE_LOG = subprocess.check_output(svn_command_simple, shell=True, stderr=subprocess.STDOUT)
-        try:
-            SVN_LOG = SVN_LOG.decode('utf-8')
-            SVN_SIMPLE_LOG = SVN_SIMPLE_LOG.decode('utf-8')
-        except UnicodeDecodeError:
-            SVN_LOG = SVN_LOG.decode('gbk')
-            SVN_SIMPLE_LOG = SVN_SIMPLE_LOG.decode('gbk')
-
-        formatted_output = format_svn_log(SVN_SIMPLE_LOG)
-        if config.show_ai_assistance != 'true':
-            finalResult = ""
-        else:
-            finalResult = call_with_stream(SVN_LOG, config)
-    except subprocess.CalledProcessError as e:
-        print(f"执行SVN命令时出错: {e}")
-        print(f"命令输出: {e.output}")
-        sys.exit(1)
+    STATUS, BUILD_EXIT_CODE = get_build_status()
 
-    hotfix_args = f"""
-        是否更新SVN: {config.update_svn}
-        热更类型: {config.hotfix_type}
-        热更渠道: {config.hotfix_channel}
-        热更说明: {config.hotfix_desc}
-        目标服务器: {config.target_server}
-        PatchType: {config.patch_type}
-        更新前SVN版本: {PREVIOUS_REVISION}
-        当前SVN版本: {CURRENT_REVISION}
-        """
-    
-    print(finalResult)
-    
     # 初始化飞书通知器
     notifier = FeishuNotifier(
         app_id=os.getenv("FEISHU_APP_ID"),
         app_secret=os.getenv("FEISHU_APP_SECRET")
     )
-    
-    # 发送飞书消息
-    success = notifier.send_message(
-        config.job_name,
-        config.build_number,
-        STATUS,
-        hotfix_args,
-        formatted_output,
-        finalResult
+
+    if phase2_message_id:
+        run_analysis_phase(config, notifier, phase2_message_id, STATUS, PREVIOUS_REVISION, CURRENT_REVISION)
+        notifier.flush()
+        print(f"飞书连接统计: {notifier.transport_stats()}")
+        return
+
+    if wait is None:
+        wait = config.wait_ai_analysis == 'true'
+
+    # 第一阶段：立即发送构建结果
+    hotfix_args = build_hotfix_args(config, PREVIOUS_REVISION, CURRENT_REVISION)
+    success, message_id = notifier.send_build_message(
+        config.job_name, config.build_number, STATUS, hotfix_args, SVN_PENDING_TEXT,
+        AI_PENDING_TEXT if config.show_ai_assistance == 'true' else ""
     )
+
+    # 第二阶段：第一阶段发送失败时必须在当前进程重新发送，否则按需后台执行
+    if wait or not message_id:
+        success = run_analysis_phase(config, notifier, message_id, STATUS,
+                                     PREVIOUS_REVISION, CURRENT_REVISION)
+    else:
+        start_analysis_process(config, message_id)
+    # 通知写入发件箱后即视为成功，飞书暂时不可用时留在发件箱中继续重试，不让构建失败
+    notifier.flush()
+    print(f"飞书连接统计: {notifier.transport_stats()}")
     
     if not success:
         sys.exit(1)
@@ -296,6 +452,12 @@ def main(workspace=None, show_ai=None):
     sys.exit(int(BUILD_EXIT_CODE))
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='构建结果飞书通知')
+    parser.add_argument('--workspace', default=None, help='工作目录，默认读取环境变量 WORKSPACE')
+    parser.add_argument('--show-ai', action='store_true', help='显示AI点评')
+    parser.add_argument('--wait', action='store_true', help='等待AI分析完成后再退出')
+    parser.add_argument('--phase2', default=None, metavar='MESSAGE_ID', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    main(args.workspace, True if args.show_ai else None, True if args.wait else None, args.phase2)
     #main('E:\\DR22Android_22',True)
-    #main('C:\\hanjiajianghu2',True)
\ No newline at end of file
+    #main('C:\\hanjiajianghu2',True)
@@ -0,0 +1,177 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+DEFAULT_CARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cards")
+DEFAULT_RENDER_CACHE_SIZE = 256
+# 卡片定义中字符串里的变量，与 string.Template 相同的 ${名称} 写法
+_PLACEHOLDER = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}')
+
+
+def _format_text(value):
+    if value is None:
+        raise TypeError("文本变量不能为None")
+    return str(value)
+
+
+def _format_time(value):
+    """datetime 或时间戳，格式化为本地时间"""
+    if isinstance(value, (int, float)):
+        value = datetime.fromtimestamp(value)
+    if not isinstance(value, datetime):
+        raise TypeError(f"时间变量需要 datetime 或时间戳，实际为 {type(value).__name__}")
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_at(value):
+    """@的人：open_id 列表，或者 "all" 表示所有人"""
+    if value == "all":
+        return "<at id=all>所有人</at>"
+    if isinstance(value, str):
+        value = [value]
+    ids = list(value)
+    if not ids:
+        raise ValueError("@的人不能为空")
+    return " ".join(f"<at id={open_id}></at>" for open_id in ids)
+
+
+# 变量类型: 把调用方传入的值转为卡片中的文本
+VARIABLE_TYPES = {
+    "text": _format_text,
+    "time": _format_time,
+    "at": _format_at,
+}
+
+
+class CardTemplate:
+    """
+    预编译的卡片模板
+
+    加载时把卡片定义序列化一次，按变量位置切分为若干段UTF-8字节，
+    渲染时只需要把转义后的变量值与这些片段拼接起来，不再构建和序列化整个嵌套字典。
+    变量只能出现在字符串中。
+
+    Args:
+        name (str): 模板名称
+        definition (dict): {"variables": {变量名: 类型}, "card": 卡片内容}
+    """
+
+    def __init__(self, name, definition):
+        self.name = name
+        self.variables: Dict[str, str] = dict(definition.get("variables", {}))
+        for variable, kind in self.variables.items():
+            if kind not in VARIABLE_TYPES:
+                raise ValueError(f"卡片模板 {name} 的变量 {variable} 类型未知: {kind}")
+        text = json.dumps(definition["card"], ensure_ascii=False, separators=(',', ':'))
+        parts = _PLACEHOLDER.split(text)
+        # split 的结果中偶数位置为固定内容，奇数位置为变量名
+        self.segments: List[bytes] = [part.encode('utf-8') for part in parts[0::2]]
+        self.slots: List[str] = parts[1::2]
+        undeclared = set(self.slots) - set(self.variables)
+        if undeclared:
+            raise ValueError(f"卡片模板 {name} 使用了未声明的变量: {', '.join(sorted(undeclared))}")
+
+    def format_variables(self, variables) -> Tuple[str, ...]:
+        """按类型把变量转为文本，返回按声明顺序排列的元组，可以作为渲染缓存的键"""
+        missing = set(self.variables) - set(variables)
+        unknown = set(variables) - set(self.variables)
+        if missing or unknown:
+            raise ValueError(f"卡片模板 {self.name} 的变量不匹配，缺少: {sorted(missing)}，多余: {sorted(unknown)}")
+        return tuple(VARIABLE_TYPES[kind](variables[variable]) for variable, kind in self.variables.items())
+
+    def render_formatted(self, values: Tuple[str, ...]) -> bytes:
+        """用 format_variables 的结果渲染卡片JSON"""
+        # 变量位于JSON字符串内部，只需要转义，不需要引号
+        escaped = {name: json.dumps(value, ensure_ascii=False)[1:-1].encode('utf-8')
+                   for name, value in zip(self.variables, values)}
+        chunks = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            chunks.append(escaped[slot])
+            chunks.append(segment)
+        return b''.join(chunks)
+
+
+class CardTemplateRegistry:
+    """
+    卡片模板注册表
+
+    首次使用时加载目录中的所有 *.json 卡片定义并预编译，之后不再读取文件。
+    相同变量的渲染结果保存在LRU缓存中，报警风暴时重复的卡片直接返回缓存的字节。
+    配置可通过环境变量覆盖:
+        CARD_TEMPLATE_DIR: 卡片定义目录，默认为 cards
+        CARD_RENDER_CACHE_SIZE: 渲染缓存的条数，默认256
+
+    Args:
+        directory (str): 卡片定义目录
+        cache_size (int): 渲染缓存的条数
+    """
+
+    def __init__(self, directory=None, cache_size=None):
+        self.directory = directory or os.getenv("CARD_TEMPLATE_DIR") or DEFAULT_CARD_DIR
+        if cache_size is None:
+            cache_size = int(os.getenv("CARD_RENDER_CACHE_SIZE", DEFAULT_RENDER_CACHE_SIZE))
+        self._templates = None
+        self._lock = threading.Lock()
+        self._render_cached = lru_cache(maxsize=cache_size)(self._render)
+
+    def templates(self) -> Dict[str, CardTemplate]:
+        with self._lock:
+            if self._templates is None:
+                templates = {}
+                for file_name in sorted(os.listdir(self.directory)):
+                    if file_name.endswith('.json'):
+                        with open(os.path.join(self.directory, file_name), 'r', encoding='utf-8') as f:
+                            name = file_name[:-len('.json')]
+                            templates[name] = CardTemplate(name, json.load(f))
+                self._templates = templates
+            return self._templates
+
+    def get(self, name) -> CardTemplate:
+        try:
+            return self.templates()[name]
+        except KeyError:
+            raise KeyError(f"卡片模板不存在: {name}") from None
+
+    def register(self, name, definition):
+        """注册代码中定义的卡片模板，同名时覆盖"""
+        template = CardTemplate(name, definition)
+        templates = self.templates()
+        with self._lock:
+            templates[name] = template
+            self._render_cached.cache_clear()
+
+    def _render(self, name, values):
+        return self.get(name).render_formatted(values)
+
+    def render(self, template_name, **variables) -> bytes:
+        """渲染卡片，返回UTF-8编码的卡片JSON"""
+        return self._render_cached(template_name, self.get(template_name).format_variables(variables))
+
+    def render_str(self, template_name, **variables) -> str:
+        """与 render 相同，返回字符串，用于需要str的接口"""
+        return self.render(template_name, **variables).decode('utf-8')
+
+    def cache_info(self):
+        return self._render_cached.cache_info()
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> CardTemplateRegistry:
+    """进程内共用的卡片模板注册表"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CardTemplateRegistry()
+        return _registry
+
+
+def render(template_name, **variables) -> bytes:
+    """用进程内共用的注册表渲染卡片"""
+    return get_registry().render(template_name, **variables)
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+from datetime import date
+from typing import Optional
+
+DEFAULT_SHARD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".svn_review_shards")
+
+
+class DayShardStore:
+    """
+    按天保存的SVN日志分片，用于每日/每周报告复用之前已经处理过的日期
+
+    每个仓库一个目录，其中:
+        {日期}.json: 当天的日志、压缩后的日志和AI总结
+        revisions.json: {日期: 当天0点时的最新版本号}
+
+    只有已经结束的日期才会保存，结束后的提交记录不再变化。
+
+    Args:
+        svn_url (str): 仓库地址或工作副本路径
+        root (str): 保存目录，默认读取环境变量 SVN_REVIEW_SHARD_DIR
+    """
+
+    def __init__(self, svn_url, root=None):
+        root = root or os.getenv("SVN_REVIEW_SHARD_DIR") or DEFAULT_SHARD_DIR
+        digest = hashlib.sha256(svn_url.encode('utf-8')).hexdigest()[:16]
+        self.directory = os.path.join(root, digest)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self.directory, name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name, data):
+        """先写临时文件再替换，进程中途退出也不会留下损坏的分片"""
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def load(self, day: date) -> Optional[dict]:
+        """读取某天的分片，没有时返回None"""
+        return self._read(f"{day.isoformat()}.json")
+
+    def save(self, day: date, shard: dict):
+        self._write(f"{day.isoformat()}.json", shard)
+
+    def get_revision(self, day: date) -> Optional[int]:
+        """某天0点时的最新版本号，没有记录时返回None"""
+        return (self._read("revisions.json") or {}).get(day.isoformat())
+
+    def set_revision(self, day: date, revision: int):
+        revisions = self._read("revisions.json") or {}
+        revisions[day.isoformat()] = int(revision)
+        self._write("revisions.json", revisions)
@@ -1,142 +1,464 @@
+import asyncio
 import json
+import httpx
 import requests
+import sqlite3
+import uuid
 from datetime import datetime
 import lark_oapi as lark
-from lark_oapi.api.im.v1 import *
 import os
 from dotenv import load_dotenv
+import feishu_outbox
+from feishu_token import get_token_manager
+from feishu_transport import AsyncFeishuTransport, get_transport
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
-class FeishuNotifier:
-    def __init__(self, app_id = os.getenv("FEISHU_APP_ID"), app_secret = os.getenv("FEISHU_APP_SECRET")):
+# token无效或已过期时飞书返回的错误码
+INVALID_TOKEN_CODES = (99991661, 99991663, 99991668)
+DEFAULT_BROADCAST_CONCURRENCY = 5
+
+class _FeishuNotifierBase:
+    """同步和异步通知器共用的部分：token、消息内容的构建和响应的解析，两者只有发送方式不同"""
+
+    def __init__(self, app_id, app_secret):
         self.app_id = app_id
         self.app_secret = app_secret
         self.base_url = "https://open.feishu.cn/open-apis"
-        # 初始化 lark client
-        self.client = lark.Client.builder() \
-            .app_id(app_id) \
-            .app_secret(app_secret) \
-            .log_level(lark.LogLevel.DEBUG) \
-            .build()
-        
+        self.token_manager = get_token_manager(app_id, app_secret, self.base_url)
+
     def get_tenant_access_token(self):
-        """获取飞书tenant access token"""
-        url = f"{self.base_url}/auth/v3/tenant_access_token/internal"
-        
-        headers = {
-            "Content-Type": "application/json; charset=utf-8"
-        }
-        
-        payload = {
-            "app_id": self.app_id,
-            "app_secret": self.app_secret
-        }
-        
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        
-        if response.status_code == 200:
+        """
+        获取飞书tenant access token，返回 (token, 剩余有效秒数)
+
+        token由 feishu_token.TenantTokenManager 缓存并在到期前自动刷新，不会每次都请求接口
+        """
+        return self.token_manager.get_token(), self.token_manager.expires_in()
+
+    @staticmethod
+    def _response_code(response):
+        try:
+            return response.json().get("code")
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _parse_response(response):
+        """
+        解析飞书接口的响应，requests 和 httpx 的响应都适用
+
+        Returns:
+            tuple: (是否成功, 成功时为响应中的data，失败时为错误信息)
+        """
+        if response.status_code >= 400:
+            return False, f"HTTP {response.status_code}\n{response.text}"
+        try:
             result = response.json()
-            if result.get("code") == 0:
-                return result.get("tenant_access_token"), result.get("expire")
-            else:
-                raise Exception(f"Error: {result.get('msg')}")
-        else:
-            raise Exception(f"HTTP request failed with status code: {response.status_code}")
-            
-    def send_message(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
-        """发送飞书消息"""
-        token, expire_time = self.get_tenant_access_token()
-        print(f"Tenant Access Token: {token}")
-        print(f"Expires in: {expire_time} seconds")
-        
-        url = f"{self.base_url}/im/v1/messages?receive_id_type=chat_id"
-        
-        payload = {
+        except ValueError:
+            return False, response.text
+        if result.get("code", 0) != 0:
+            return False, (f"code: {result.get('code')}, msg: {result.get('msg')}, "
+                           f"log_id: {response.headers.get('X-Tt-Logid')}")
+        return True, result.get("data") or {}
+
+    def _build_message_content(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
+        """构建构建通知卡片的消息内容"""
+        return json.dumps({
+            "type": "template",
+            "data": {
+                "template_id": "AAqHQEn1zcQbq",
+                "template_variable": {
+                    "title": f"[{job_name}] #{build_number} {status}",
+                    "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "hotfix_args": hotfix_args,
+                    "hotfix_content": formatted_output,
+                    "ai_judge": final_result
+                }
+            }
+        })
+
+    def _build_payload(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
+        return {
             "receive_id": os.getenv("FEISHU_BUILD_NOTIFY_CHAT_ID"),
             "msg_type": "interactive",
-            "content": json.dumps({
-                "type": "template",
+            "content": self._build_message_content(job_name, build_number, status, hotfix_args,
+                                                   formatted_output, final_result)
+        }
+
+    @staticmethod
+    def simple_card(title, content):
+        """简单卡片的内容，可以传给 send_card_message 或 broadcast"""
+        return {"type": "template",
                 "data": {
-                    "template_id": "AAqHQEn1zcQbq",
+                    "template_id": "AAqC36rf8W5iW",
                     "template_variable": {
-                        "title": f"[{job_name}] #{build_number} {status}",
-                        "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                        "hotfix_args": hotfix_args,
-                        "hotfix_content": formatted_output,
-                        "ai_judge": final_result
+                        "title": title,
+                        "content": content,
                     }
-                }
-            })
-        }
-        
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json; charset=utf-8"
+                }}
+
+    @staticmethod
+    def parse_chat_ids(value):
+        """解析逗号分隔的群ID，例如环境变量中配置的多个群，去掉空白和重复的群"""
+        return list(dict.fromkeys(chat_id.strip() for chat_id in (value or '').split(',') if chat_id.strip()))
+
+    @staticmethod
+    def _chat_payload(chat_id, msg_type, content):
+        return {
+            "receive_id": chat_id,
+            "msg_type": msg_type,
+            "content": json.dumps(content)
         }
-        
-        try:
-            response = requests.post(url, headers=headers, data=json.dumps(payload))
-            response.raise_for_status()
-            return True
-        except requests.RequestException as e:
-            print(f"发送消息失败: {e}")
-            print(response.text)
-            return False 
-        
-    def send_card_message(self, chat_id, card_content):
-        """发送卡片消息"""
-        request: CreateMessageRequest = CreateMessageRequest.builder() \
-            .receive_id_type("chat_id") \
-            .request_body(CreateMessageRequestBody.builder()
-                          .receive_id(chat_id)
-                          .msg_type("interactive")
-                          .content(json.dumps(card_content))
-                          .build()) \
-            .build()
-
-        response: CreateMessageResponse = self.client.im.v1.message.create(request)
-
-        if not response.success():
-            error_msg = f"发送消息失败, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
+
+    @staticmethod
+    def _chat_result(success, result):
+        if not success:
+            error_msg = f"发送消息失败, {result}"
             lark.logger.error(error_msg)
             return False, error_msg
 
-        lark.logger.info(lark.JSON.marshal(response.data, indent=4))
+        lark.logger.info(lark.JSON.marshal(result, indent=4))
         return True, "消息发送成功"
+
+
+class FeishuNotifier(_FeishuNotifierBase):
+    """
+    飞书消息通知
+
+    默认发送和更新消息都先写入 feishu_outbox 发件箱并立即返回，由后台线程按限流发送，
+    飞书暂时不可用时不会让调用方失败；设置环境变量 FEISHU_OUTBOX=false 或 use_outbox=False 时直接发送。
+    通过发件箱发送的消息，返回的消息ID是发件箱中的幂等键，同样可以传给 update_build_message。
+    同时发给多个群时使用 broadcast 或 send_simple_card_to_chats。
+    """
+
+    def __init__(self, app_id = os.getenv("FEISHU_APP_ID"), app_secret = os.getenv("FEISHU_APP_SECRET"),
+                 use_outbox=None):
+        super().__init__(app_id, app_secret)
+        # 所有请求都通过进程内共用的长连接发送，不再为每个实例创建 lark client
+        self.transport = get_transport()
+        if use_outbox is None:
+            use_outbox = os.getenv("FEISHU_OUTBOX", "true").lower() != 'false'
+        self.outbox = None
+        if use_outbox:
+            try:
+                self.outbox = feishu_outbox.get_outbox()
+                feishu_outbox.get_dispatcher().register(app_id, self.outbox_call)
+            except sqlite3.Error as e:
+                print(f"打开飞书发件箱失败，直接发送消息: {e}")
+                self.outbox = None
+
+    def call(self, method, path, payload, params=None, transport=None):
+        """
+        带token调用飞书接口并返回响应，token被判定无效时强制刷新后重试一次
+
+        Args:
+            transport (FeishuTransport): 发送请求的连接，默认为 self.transport
+
+        Raises:
+            requests.RequestException: 网络错误
+        """
+        transport = transport or self.transport
+        for attempt in range(2):
+            token, _ = self.get_tenant_access_token()
+            response = transport.request(method, f"{self.base_url}{path}", token=token,
+                                         json=payload, params=params)
+            if attempt == 0 and self._response_code(response) in INVALID_TOKEN_CODES:
+                self.token_manager.refresh(force=True)
+                continue
+            return response
+
+    def outbox_call(self, method, path, payload, params=None):
+        """
+        发件箱调度器使用的发送函数
+
+        使用不自动重试的连接，429和5xx直接返回给调度器，由发件箱按 Retry-After 安排下次发送，
+        不会在调度线程中等待而阻塞其他消息
+        """
+        return self.call(method, path, payload, params, transport=get_transport(max_retries=0))
+
+    def transport_stats(self):
+        """直接发送和发件箱发送的连接复用情况"""
+        stats = {"direct": self.transport.stats()}
+        if self.outbox:
+            stats["outbox"] = get_transport(max_retries=0).stats()
+        return stats
+
+    def _request(self, method, path, payload, params=None):
+        """
+        直接调用飞书接口
+
+        Returns:
+            tuple: (是否成功, 成功时为响应中的data，失败时为错误信息)
+        """
+        try:
+            return self._parse_response(self.call(method, path, payload, params))
+        except requests.RequestException as e:
+            return False, str(e)
+
+    def _enqueue(self, enqueue):
+        """写入发件箱并返回幂等键，发件箱不可用时返回None，由调用方直接发送"""
+        if not self.outbox:
+            return None
+        try:
+            return enqueue()
+        except sqlite3.Error as e:
+            print(f"写入飞书发件箱失败，直接发送消息: {e}")
+            return None
+
+    def flush(self, timeout=None):
+        """
+        等待当前进程写入发件箱的消息发送完成
+
+        Returns:
+            bool: 是否全部完成，未完成的消息之后仍会继续发送
+        """
+        if not self.outbox:
+            return True
+        return feishu_outbox.get_dispatcher().flush(timeout)
+
+    def send_build_message(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
+        """
+        发送构建通知卡片
+
+        Returns:
+            tuple: (是否成功, 消息ID)，消息ID用于之后 update_build_message 更新卡片
+        """
+        payload = self._build_payload(job_name, build_number, status, hotfix_args, formatted_output, final_result)
+        success, result = self._create_message(payload, key=self._build_key(job_name, build_number))
+        if not success:
+            print(f"发送消息失败: {result}")
+            return False, None
+        return True, result.get("message_id")
+
+    @staticmethod
+    def _build_key(job_name, build_number):
+        """
+        构建通知在发件箱中的幂等键
+
+        任务名和构建号可能为空，重建的Jenkins任务也会从1开始编号，因此加上 BUILD_TAG/BUILD_URL 和随机部分，
+        每次构建都是新的键
+        """
+        build = os.getenv("BUILD_TAG") or os.getenv("BUILD_URL") or f"{job_name}:{build_number}"
+        return f"build:{build}:{uuid.uuid4().hex}"
+
+    def send_message(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
+        """发送飞书消息"""
+        success, _ = self.send_build_message(job_name, build_number, status, hotfix_args,
+                                             formatted_output, final_result)
+        return success
+
+    def update_build_message(self, message_id, job_name, build_number, status, hotfix_args, formatted_output,
+                             final_result):
+        """
+        更新已发送的构建通知卡片，飞书限制同一条消息每秒最多更新5次
+
+        Returns:
+            bool: 是否更新成功
+        """
+        payload = {
+            "content": self._build_message_content(job_name, build_number, status, hotfix_args,
+                                                   formatted_output, final_result)
+        }
+        if self._enqueue(lambda: self.outbox.enqueue_update(self.app_id, message_id, payload)):
+            return True
+        success, result = self._request('PATCH', f"/im/v1/messages/{message_id}", payload)
+        if not success:
+            print(f"更新消息失败: {result}")
+        return success
+
+    def _create_message(self, payload, key=None):
+        """
+        发送消息，payload 为 im/v1/messages 的请求体，key 为发件箱中的幂等键
+
+        自动加上 uuid，传输层因超时或5xx重试时飞书会按 uuid 去重，不会重复发送
+        """
+        key = self._enqueue(lambda: self.outbox.enqueue_message(self.app_id, payload, key))
+        if key:
+            return True, {"message_id": key}
+        payload = {"uuid": str(uuid.uuid4()), **payload}
+        return self._request('POST', "/im/v1/messages", payload, params={"receive_id_type": "chat_id"})
+
+    def send_card_message(self, chat_id, card_content):
+        """发送卡片消息"""
+        return self._chat_result(*self._create_message(self._chat_payload(chat_id, "interactive", card_content)))
     
     def send_simple_card_message(self, chat_id,title,content):
         """发送简单卡片消息"""
-        json = { "type": "template",
-                "data": {
-                    "template_id": "AAqC36rf8W5iW",
-                    "template_variable": {
-                        "title": title,
-                        "content": content,
-                    }
-
-                }}
-        return self.send_card_message(chat_id, json)
-    
+        return self.send_card_message(chat_id, self.simple_card(title, content))
 
     def send_text_message(self, chat_id, text_content):
         """发送普通文本消息"""
-        request: CreateMessageRequest = CreateMessageRequest.builder() \
-            .receive_id_type("chat_id") \
-            .request_body(CreateMessageRequestBody.builder()
-                          .receive_id(chat_id)
-                          .msg_type("text")
-                          .content(json.dumps({"text": text_content}))
-                          .build()) \
-            .build()
-
-        response: CreateMessageResponse = self.client.im.v1.message.create(request)
-
-        if not response.success():
-            error_msg = f"发送消息失败, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}"
-            lark.logger.error(error_msg)
-            return False, error_msg
+        return self._chat_result(*self._create_message(self._chat_payload(chat_id, "text", {"text": text_content})))
+
+    def broadcast(self, chat_ids, card):
+        """
+        把同一张卡片发送到多个群，重复的群只发送一次
+
+        启用发件箱时每个群写入一条消息，由后台线程按每个群的限流发送；
+        否则由 AsyncFeishuNotifier 并发发送。后者使用 asyncio.run，不能在正在运行的事件循环中调用，
+        异步代码中请直接使用 AsyncFeishuNotifier.broadcast。
+
+        Returns:
+            dict: {群ID: (是否成功, 信息)}，顺序与chat_ids一致
+
+        Raises:
+            RuntimeError: 未启用发件箱且在正在运行的事件循环中调用
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        if self.outbox:
+            return {chat_id: self.send_card_message(chat_id, card) for chat_id in chat_ids}
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("FeishuNotifier.broadcast 不能在事件循环中调用，请使用 AsyncFeishuNotifier.broadcast")
+
+        async def run():
+            async with AsyncFeishuNotifier(self.app_id, self.app_secret) as notifier:
+                return await notifier.broadcast(chat_ids, card)
+
+        return asyncio.run(run())
+
+    def send_simple_card_to_chats(self, chat_ids, title, content):
+        """
+        发送简单卡片到一个或多个群，多个群时使用 broadcast，发送失败的群输出错误信息
+
+        Args:
+            chat_ids (list): 群ID列表，可以用 parse_chat_ids 从逗号分隔的配置中解析
+
+        Returns:
+            dict: {群ID: (是否成功, 信息)}
+        """
+        if not chat_ids:
+            print("没有配置要发送的群")
+            return {}
+        if len(chat_ids) == 1:
+            results = {chat_ids[0]: self.send_simple_card_message(chat_ids[0], title, content)}
+        else:
+            results = self.broadcast(chat_ids, self.simple_card(title, content))
+        for chat_id, (success, message) in results.items():
+            if not success:
+                print(f"发送到 {chat_id} 失败: {message}")
+        return results
+
+
+class AsyncFeishuNotifier(_FeishuNotifierBase):
+    """
+    基于 httpx.AsyncClient 的异步飞书通知器，方法与 FeishuNotifier 相同，直接发送不经过发件箱
+
+    用法:
+        async with AsyncFeishuNotifier() as notifier:
+            results = await notifier.broadcast(chat_ids, card)
+
+    Args:
+        max_concurrency (int): broadcast 同时发送的请求数，默认读取环境变量 FEISHU_BROADCAST_CONCURRENCY
+    """
+
+    def __init__(self, app_id = os.getenv("FEISHU_APP_ID"), app_secret = os.getenv("FEISHU_APP_SECRET"),
+                 max_concurrency=None, transport=None):
+        super().__init__(app_id, app_secret)
+        self.transport = transport or AsyncFeishuTransport()
+        self.max_concurrency = max_concurrency or int(os.getenv("FEISHU_BROADCAST_CONCURRENCY",
+                                                                DEFAULT_BROADCAST_CONCURRENCY))
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    async def _token(self, force=False):
+        """token有效时直接返回，需要请求接口时放到线程池中，不阻塞事件循环"""
+        token = None if force else self.token_manager.cached_token()
+        if token:
+            return token
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.token_manager.refresh, force)
+
+    async def call(self, method, path, payload, params=None):
+        """与 FeishuNotifier.call 相同，返回 httpx.Response"""
+        token = await self._token()
+        for attempt in range(2):
+            response = await self.transport.request(method, f"{self.base_url}{path}", token=token,
+                                                    json=payload, params=params)
+            if attempt == 0 and self._response_code(response) in INVALID_TOKEN_CODES:
+                token = await self._token(force=True)
+                continue
+            return response
+
+    async def _request(self, method, path, payload, params=None):
+        try:
+            return self._parse_response(await self.call(method, path, payload, params))
+        except httpx.HTTPError as e:
+            return False, str(e)
+
+    async def _create_message(self, payload):
+        payload = {"uuid": str(uuid.uuid4()), **payload}
+        return await self._request('POST', "/im/v1/messages", payload, params={"receive_id_type": "chat_id"})
+
+    async def send_build_message(self, job_name, build_number, status, hotfix_args, formatted_output,
+                                 final_result):
+        """发送构建通知卡片，返回 (是否成功, 消息ID)"""
+        payload = self._build_payload(job_name, build_number, status, hotfix_args, formatted_output, final_result)
+        success, result = await self._create_message(payload)
+        if not success:
+            print(f"发送消息失败: {result}")
+            return False, None
+        return True, result.get("message_id")
+
+    async def send_message(self, job_name, build_number, status, hotfix_args, formatted_output, final_result):
+        """发送飞书消息"""
+        success, _ = await self.send_build_message(job_name, build_number, status, hotfix_args,
+                                                   formatted_output, final_result)
+        return success
+
+    async def update_build_message(self, message_id, job_name, build_number, status, hotfix_args,
+                                   formatted_output, final_result):
+        """更新已发送的构建通知卡片"""
+        payload = {
+            "content": self._build_message_content(job_name, build_number, status, hotfix_args,
+                                                   formatted_output, final_result)
+        }
+        success, result = await self._request('PATCH', f"/im/v1/messages/{message_id}", payload)
+        if not success:
+            print(f"更新消息失败: {result}")
+        return success
+
+    async def send_card_message(self, chat_id, card_content):
+        """发送卡片消息"""
+        return self._chat_result(*await self._create_message(self._chat_payload(chat_id, "interactive",
+                                                                                card_content)))
+
+    async def send_simple_card_message(self, chat_id, title, content):
+        """发送简单卡片消息"""
+        return await self.send_card_message(chat_id, self.simple_card(title, content))
+
+    async def send_text_message(self, chat_id, text_content):
+        """发送普通文本消息"""
+        return self._chat_result(*await self._create_message(self._chat_payload(chat_id, "text",
+                                                                                {"text": text_content})))
+
+    async def broadcast(self, chat_ids, card):
+        """
+        把同一张卡片并发发送到多个群，同时进行的请求数不超过 max_concurrency，重复的群只发送一次
+
+        Returns:
+            dict: {群ID: (是否成功, 信息)}，顺序与chat_ids一致
+        """
+        chat_ids = list(dict.fromkeys(chat_ids))
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def send(chat_id):
+            async with semaphore:
+                try:
+                    return await self.send_card_message(chat_id, card)
+                except Exception as e:
+                    return False, f"发送消息失败, {e}"
 
-        lark.logger.info(lark.JSON.marshal(response.data, indent=4))
-        return True, "消息发送成功" 
\ No newline at end of file
+        results = await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+        return dict(zip(chat_ids, results))
@@ -0,0 +1,518 @@
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from feishu_transport import RETRY_STATUSES
+from rate_limit import TokenBucket, backoff_delay
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+DEFAULT_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".feishu_outbox.sqlite3")
+# 飞书发送消息接口每个应用50次/秒，同一个群所有机器人共享5次/秒
+DEFAULT_APP_RATE = 50
+DEFAULT_CHAT_RATE = 5
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_FLUSH_TIMEOUT = 60
+DEFAULT_RETENTION_DAYS = 7
+# 调度租约的有效期，持有租约的进程异常退出后其他进程最多等待这么久接手
+LEASE_SECONDS = 60
+POLL_INTERVAL = 0.5
+# 飞书在响应体中返回的限流错误码
+RATE_LIMIT_CODES = (99991400,)
+# 更新卡片时用于引用发件箱中消息的占位符，发送时替换为飞书返回的消息ID
+MESSAGE_ID_PLACEHOLDER = "{message_id}"
+DONE_STATUSES = ('sent', 'failed', 'superseded')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    app_id TEXT NOT NULL,
+    chat_id TEXT NOT NULL DEFAULT '',
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    params TEXT,
+    payload TEXT NOT NULL,
+    target TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    message_id TEXT,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_due ON messages (status, app_id, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_messages_target ON messages (target, status);
+CREATE TABLE IF NOT EXISTS leases (
+    app_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+"""
+
+
+class IdempotencyConflict(sqlite3.IntegrityError):
+    """相同的幂等键已经用于内容不同的请求"""
+
+
+class FeishuOutbox:
+    """
+    飞书消息发件箱
+
+    调用方只把请求写入本地SQLite数据库并立即返回，由 OutboxDispatcher 在后台按限流发送，
+    飞书暂时不可用时消息留在数据库中，之后的进程会继续发送，不会丢失。
+    同一台机器上的多个进程共用一个数据库，数据库路径可通过环境变量 FEISHU_OUTBOX_DB 指定。
+
+    每条消息有唯一的幂等键，相同的键重复写入只保留第一条；发送消息时由幂等键生成飞书的 uuid，
+    请求超时后重发也不会在群里出现两条相同的消息。
+
+    Args:
+        path (str): 数据库文件路径
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("FEISHU_OUTBOX_DB") or DEFAULT_DB
+        self.enqueued = []  # 当前进程写入的幂等键，退出前等待它们发送完成
+        self._lock = threading.Lock()
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            # WAL模式下写入不阻塞读取，多个任务同时写入也只需要几毫秒
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self, write=True):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            # 写事务一开始就加锁，避免多个进程读后写时互相等待
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _insert(self, conn, key, app_id, chat_id, method, path, payload, params=None, target=None):
+        """
+        写入一条请求，相同幂等键的相同请求只保留第一条
+
+        Raises:
+            IdempotencyConflict: 幂等键已被内容不同的请求使用，例如不同的构建用了相同的键
+        """
+        now = time.time()
+        payload = json.dumps(payload, ensure_ascii=False)
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO messages (idempotency_key, app_id, chat_id, method, path, params, payload, target,"
+            " next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, app_id, chat_id or '', method, path, json.dumps(params) if params else None,
+             payload, target, now, now, now)
+        )
+        if cursor.rowcount == 0:
+            existing = conn.execute("SELECT app_id, method, path, payload FROM messages WHERE idempotency_key = ?",
+                                    (key,)).fetchone()
+            if tuple(existing) != (app_id, method, path, payload):
+                raise IdempotencyConflict(f"幂等键 {key} 已用于内容不同的请求")
+        with self._lock:
+            self.enqueued.append(key)
+        return key
+
+    def enqueue_message(self, app_id, payload, key=None):
+        """
+        写入一条发送消息请求，返回幂等键
+
+        Args:
+            app_id (str): 发送消息的应用
+            payload (dict): im/v1/messages 的请求体，receive_id 为群ID
+            key (str): 幂等键，默认随机生成
+        """
+        key = key or uuid.uuid4().hex
+        payload = {**payload, "uuid": str(uuid.uuid5(uuid.NAMESPACE_URL, key))}
+        with self._transaction() as conn:
+            return self._insert(conn, key, app_id, payload.get("receive_id"), 'POST', "/im/v1/messages", payload,
+                                params={"receive_id_type": "chat_id"})
+
+    def enqueue_update(self, app_id, target, payload, key=None):
+        """
+        写入一条更新卡片请求，返回幂等键
+
+        同一张卡片还没发送或正在发送的旧更新直接作废，只发送最新的内容，
+        正在发送的旧更新失败后也不再重试，避免旧内容覆盖新内容
+
+        Args:
+            target (str): 飞书消息ID，或者 enqueue_message 返回的幂等键（该消息发送后再更新）
+            payload (dict): 更新消息的请求体
+        """
+        key = key or uuid.uuid4().hex
+        with self._transaction() as conn:
+            ref = conn.execute("SELECT chat_id FROM messages WHERE idempotency_key = ?", (target,)).fetchone()
+            path = f"/im/v1/messages/{MESSAGE_ID_PLACEHOLDER if ref else target}"
+            conn.execute(
+                "UPDATE messages SET status = 'superseded', updated_at = ?"
+                " WHERE target = ? AND status IN ('pending', 'sending') AND method = 'PATCH'",
+                (time.time(), target)
+            )
+            return self._insert(conn, key, app_id, ref["chat_id"] if ref else '', 'PATCH', path, payload,
+                                target=target)
+
+    def get(self, key):
+        """按幂等键读取消息，不存在时返回None"""
+        with self._transaction(write=False) as conn:
+            row = conn.execute("SELECT * FROM messages WHERE idempotency_key = ?", (key,)).fetchone()
+            return dict(row) if row else None
+
+    def counts(self, keys=None):
+        """各状态的消息数，keys 非空时只统计这些消息"""
+        with self._transaction(write=False) as conn:
+            if keys is None:
+                rows = conn.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall()
+            else:
+                keys = list(keys)
+                rows = []
+                # SQLite 对参数个数有限制，分批查询
+                for start in range(0, len(keys), 500):
+                    batch = keys[start:start + 500]
+                    rows += conn.execute(
+                        f"SELECT status, COUNT(*) FROM messages WHERE idempotency_key IN"
+                        f" ({','.join('?' * len(batch))}) GROUP BY status", batch
+                    ).fetchall()
+        counts = {}
+        for status, count in rows:
+            counts[status] = counts.get(status, 0) + count
+        return counts
+
+    def due(self, app_ids, limit=100):
+        """到了发送时间的消息，按写入顺序排列"""
+        if not app_ids:
+            return []
+        with self._transaction(write=False) as conn:
+            return [dict(row) for row in conn.execute(
+                f"SELECT * FROM messages WHERE status = 'pending' AND next_attempt_at <= ?"
+                f" AND app_id IN ({','.join('?' * len(app_ids))}) ORDER BY id LIMIT ?",
+                (time.time(), *app_ids, limit)
+            ).fetchall()]
+
+    def claim(self, row_id):
+        """把消息标记为发送中，返回是否成功"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE messages SET status = 'sending', updated_at = ? WHERE id = ? AND status = 'pending'",
+                (time.time(), row_id)
+            )
+            return cursor.rowcount == 1
+
+    def mark_sent(self, row_id, feishu_message_id=None):
+        self._update(row_id, status='sent', message_id=feishu_message_id, last_error=None)
+
+    def mark_retry(self, row_id, attempts, next_attempt_at, error):
+        """放回待发送队列，发送期间已被新的更新作废时保持作废"""
+        self._update(row_id, status='pending', attempts=attempts, next_attempt_at=next_attempt_at,
+                     last_error=error, expected='sending')
+
+    def mark_failed(self, row_id, error, attempts=None):
+        fields = {"status": 'failed', "last_error": error}
+        if attempts is not None:
+            fields["attempts"] = attempts
+        self._update(row_id, **fields)
+
+    def _update(self, row_id, expected=None, **fields):
+        """expected 非空时只更新处于该状态的消息"""
+        fields["updated_at"] = time.time()
+        condition = "id = ?" if expected is None else "id = ? AND status = ?"
+        params = (row_id,) if expected is None else (row_id, expected)
+        with self._transaction() as conn:
+            conn.execute(
+                f"UPDATE messages SET {', '.join(f'{name} = ?' for name in fields)} WHERE {condition}",
+                (*fields.values(), *params)
+            )
+
+    def acquire_lease(self, app_id, owner, duration=LEASE_SECONDS):
+        """
+        获取或续期某个应用的调度租约，同一时间只有一个进程发送该应用的消息，限流才对所有进程生效
+
+        Returns:
+            bool: 是否持有租约
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT owner, lease_until FROM leases WHERE app_id = ?", (app_id,)).fetchone()
+            if row and row["owner"] != owner and row["lease_until"] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (app_id, owner, lease_until) VALUES (?, ?, ?)",
+                         (app_id, owner, now + duration))
+            if not row or row["owner"] != owner:
+                # 新接手时，之前的持有者发送到一半的消息重新发送，飞书按 uuid 去重
+                conn.execute("UPDATE messages SET status = 'pending', updated_at = ?"
+                             " WHERE app_id = ? AND status = 'sending'", (now, app_id))
+            return True
+
+    def release_lease(self, app_id, owner):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM leases WHERE app_id = ? AND owner = ?", (app_id, owner))
+
+    def purge(self, retention_days=None):
+        """删除超过保留天数的已完成消息，默认读取环境变量 FEISHU_OUTBOX_RETENTION_DAYS"""
+        if retention_days is None:
+            retention_days = float(os.getenv("FEISHU_OUTBOX_RETENTION_DAYS", DEFAULT_RETENTION_DAYS))
+        with self._transaction() as conn:
+            conn.execute(
+                f"DELETE FROM messages WHERE status IN ({','.join('?' * len(DONE_STATUSES))}) AND updated_at < ?",
+                (*DONE_STATUSES, time.time() - retention_days * 86400)
+            )
+
+
+class OutboxDispatcher:
+    """
+    在后台线程中发送发件箱中的消息
+
+    每个应用一个令牌桶、每个群一个令牌桶，多个任务同时写入的大量消息按速率平滑发送；
+    429、5xx 和网络错误按 Retry-After 或指数退避重试，超过最大次数后标记为失败。
+    配置可通过环境变量覆盖:
+        FEISHU_APP_RATE: 每个应用每秒发送数，默认50
+        FEISHU_CHAT_RATE: 每个群每秒发送数，默认5
+        FEISHU_OUTBOX_MAX_ATTEMPTS: 最多发送次数，默认8
+
+    Args:
+        outbox (FeishuOutbox): 发件箱
+    """
+
+    def __init__(self, outbox, app_rate=None, chat_rate=None, max_attempts=None):
+        self.outbox = outbox
+        self.app_rate = app_rate or float(os.getenv("FEISHU_APP_RATE", DEFAULT_APP_RATE))
+        self.chat_rate = chat_rate or float(os.getenv("FEISHU_CHAT_RATE", DEFAULT_CHAT_RATE))
+        self.max_attempts = max_attempts or int(os.getenv("FEISHU_OUTBOX_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.senders = {}
+        self._buckets = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, app_id, send):
+        """
+        登记应用的发送函数并启动后台线程
+
+        Args:
+            send: send(method, path, payload, params) -> requests.Response，负责带上该应用的token
+        """
+        with self._lock:
+            self.senders[app_id] = send
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="feishu-outbox", daemon=True)
+                self._thread.start()
+
+    def _bucket(self, key, rate):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, max(1.0, rate))
+        return bucket
+
+    def _run(self):
+        try:
+            self.outbox.purge()
+        except sqlite3.Error as e:
+            print(f"清理飞书发件箱失败: {e}")
+        while not self._stop.is_set():
+            try:
+                wait = self.run_once()
+            except sqlite3.Error as e:
+                print(f"读取飞书发件箱失败: {e}")
+                wait = POLL_INTERVAL
+            except Exception as e:
+                # 后台线程退出后消息不再发送，任何意外错误都只记录下来
+                print(f"发送飞书发件箱中的消息出错: {e}")
+                wait = POLL_INTERVAL
+            self._stop.wait(wait)
+        for app_id in list(self.senders):
+            self.outbox.release_lease(app_id, self.owner)
+
+    def run_once(self):
+        """发送一轮到期的消息，返回距离下一轮的等待秒数"""
+        apps = [app_id for app_id in list(self.senders) if self.outbox.acquire_lease(app_id, self.owner)]
+        wait = POLL_INTERVAL
+        for row in self.outbox.due(apps):
+            try:
+                path = self._resolve_path(row)
+            except ValueError as e:
+                self._fail(row, e)
+                continue
+            if path is None:
+                continue
+            if row["chat_id"]:
+                chat_wait = self._bucket(('chat', row["chat_id"]), self.chat_rate).try_acquire()
+                if chat_wait > 0:
+                    wait = min(wait, chat_wait)
+                    continue
+            app_wait = self._bucket(('app', row["app_id"]), self.app_rate).try_acquire()
+            if app_wait > 0:
+                return min(wait, app_wait)
+            if self.outbox.claim(row["id"]):
+                try:
+                    self._send(row, path)
+                except sqlite3.Error:
+                    raise
+                except Exception as e:
+                    # 数据损坏等无法处理的消息标记为失败，不影响后面的消息
+                    self._fail(row, e)
+                wait = 0
+        return wait
+
+    def _fail(self, row, error):
+        print(f"飞书发件箱中的消息 {row['idempotency_key']} 无法发送: {error}")
+        self.outbox.mark_failed(row["id"], str(error))
+
+    def _resolve_path(self, row):
+        """
+        替换更新请求中引用的消息ID
+
+        Returns:
+            str: 请求路径，要更新的消息还没发送时返回None
+
+        Raises:
+            ValueError: 要更新的消息不存在、发送失败或者没有返回消息ID
+        """
+        path = row["path"]
+        if MESSAGE_ID_PLACEHOLDER not in path:
+            return path
+        ref = self.outbox.get(row["target"])
+        if ref is None:
+            raise ValueError(f"要更新的消息不存在: {row['target']}")
+        if ref["status"] == 'failed':
+            raise ValueError(f"要更新的消息发送失败: {ref['last_error']}")
+        if ref["status"] != 'sent':
+            return None  # 等要更新的消息先发出去
+        if not ref["message_id"]:
+            raise ValueError(f"要更新的消息没有飞书消息ID: {row['target']}")
+        return path.replace(MESSAGE_ID_PLACEHOLDER, ref["message_id"])
+
+    def _send(self, row, path):
+        attempts = row["attempts"] + 1
+        params = json.loads(row["params"]) if row["params"] else None
+        payload = json.loads(row["payload"])
+        retry_after = None
+        try:
+            response = self.senders[row["app_id"]](row["method"], path, payload, params)
+        except Exception as e:
+            # 网络错误和获取token失败都按临时错误重试
+            error = str(e)
+        else:
+            try:
+                result = response.json()
+            except ValueError:
+                result = {}
+            code = result.get("code", 0 if response.ok else None)
+            if response.ok and code == 0:
+                self.outbox.mark_sent(row["id"], (result.get("data") or {}).get("message_id"))
+                return
+            error = f"HTTP {response.status_code}, code: {code}, msg: {result.get('msg')}"
+            if response.status_code not in RETRY_STATUSES and code not in RATE_LIMIT_CODES:
+                print(f"飞书消息发送失败，不再重试: {error}")
+                self.outbox.mark_failed(row["id"], error, attempts)
+                return
+            retry_after = _retry_after(response)
+        if attempts >= self.max_attempts:
+            print(f"飞书消息发送{attempts}次仍失败: {error}")
+            self.outbox.mark_failed(row["id"], error, attempts)
+            return
+        delay = max(retry_after or 0, backoff_delay(attempts - 1))
+        self.outbox.mark_retry(row["id"], attempts, time.time() + delay, error)
+
+    def flush(self, timeout=None):
+        """
+        等待当前进程写入的消息发送完成
+
+        Args:
+            timeout (float): 最长等待秒数，默认读取环境变量 FEISHU_OUTBOX_FLUSH_TIMEOUT
+
+        Returns:
+            bool: 是否全部完成，未完成的消息留在发件箱中由之后的进程继续发送
+        """
+        if timeout is None:
+            timeout = float(os.getenv("FEISHU_OUTBOX_FLUSH_TIMEOUT", DEFAULT_FLUSH_TIMEOUT))
+        with self.outbox._lock:
+            keys = list(self.outbox.enqueued)
+        deadline = time.monotonic() + timeout
+        while True:
+            counts = self.outbox.counts(keys)
+            remaining = sum(count for status, count in counts.items() if status not in DONE_STATUSES)
+            if not remaining:
+                return True
+            if time.monotonic() >= deadline:
+                print(f"飞书发件箱中还有{remaining}条消息未发送，将由之后的任务继续发送")
+                return False
+            time.sleep(0.1)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=10)
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+_outbox = None
+_dispatcher = None
+_lock = threading.Lock()
+
+
+def get_outbox() -> FeishuOutbox:
+    """进程内共用的发件箱"""
+    global _outbox
+    with _lock:
+        if _outbox is None:
+            _outbox = FeishuOutbox()
+        return _outbox
+
+
+def get_dispatcher() -> OutboxDispatcher:
+    """进程内共用的调度器，进程退出前等待本进程写入的消息发送完成"""
+    global _dispatcher
+    outbox = get_outbox()
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = OutboxDispatcher(outbox)
+            atexit.register(_shutdown, _dispatcher)
+        return _dispatcher
+
+
+def _shutdown(dispatcher):
+    try:
+        dispatcher.flush()
+    finally:
+        dispatcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='持续发送飞书发件箱中的消息')
+    parser.add_argument('--status', action='store_true', help='只输出各状态的消息数')
+    args = parser.parse_args()
+    if args.status:
+        print(get_outbox().counts())
+    else:
+        from feishu_notifier import FeishuNotifier
+        dispatcher = get_dispatcher()
+        dispatcher.register(os.getenv("FEISHU_APP_ID"), FeishuNotifier(use_outbox=False).outbox_call)
+        while True:
+            time.sleep(3600)
@@ -0,0 +1,175 @@
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from feishu_transport import get_transport
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+BASE_URL = "https://open.feishu.cn/open-apis"
+DEFAULT_CACHE_FILE = os.path.join(tempfile.gettempdir(), "feishu_tenant_token.json")
+# 飞书在剩余有效期不足30分钟时才会签发新token，提前量需要小于30分钟
+DEFAULT_REFRESH_MARGIN = 600
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """跨进程的排他文件锁，Windows使用msvcrt，其他系统使用fcntl"""
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class TenantTokenManager:
+    """
+    飞书 tenant_access_token 管理
+
+    token在内存中缓存，到期前 refresh_margin 秒由后台定时器提前刷新；
+    多个线程同时刷新时只会请求一次；同一台机器上的多个进程通过加锁的本地文件共享token。
+    配置可通过环境变量覆盖:
+        FEISHU_TOKEN_REFRESH_MARGIN: 提前刷新的秒数，默认600
+        FEISHU_TOKEN_CACHE_FILE: 本地缓存文件，默认在系统临时目录下
+    """
+
+    def __init__(self, app_id, app_secret, base_url=BASE_URL, refresh_margin=None, cache_file=None):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.base_url = base_url
+        self.refresh_margin = refresh_margin if refresh_margin is not None else \
+            float(os.getenv("FEISHU_TOKEN_REFRESH_MARGIN", DEFAULT_REFRESH_MARGIN))
+        self.cache_file = cache_file or os.getenv("FEISHU_TOKEN_CACHE_FILE") or DEFAULT_CACHE_FILE
+        self.token = None
+        self.expires_at = 0.0
+        self.fetches = 0  # 实际请求飞书接口的次数
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _valid(self, expires_at):
+        return time.time() < expires_at - self.refresh_margin
+
+    def get_token(self):
+        """返回有效的token，需要时刷新"""
+        return self.cached_token() or self.refresh()
+
+    def cached_token(self):
+        """内存中的token仍然有效时返回它，否则返回None，不会请求接口"""
+        if self.token and self._valid(self.expires_at):
+            return self.token
+        return None
+
+    def expires_in(self):
+        """当前token剩余的有效秒数"""
+        return max(0, int(self.expires_at - time.time()))
+
+    def refresh(self, force=False):
+        """
+        刷新token并返回
+
+        Args:
+            force (bool): 为True时不使用内存和本地文件中的token，直接请求新token，用于token被服务端判定无效时
+        """
+        stale_token = self.token
+        with self._lock:
+            # 等锁期间其他线程可能已经刷新过
+            if not force and self.token and self._valid(self.expires_at):
+                return self.token
+            if force and self.token != stale_token:
+                return self.token
+            with _file_lock(self.cache_file + '.lock'):
+                cached = None if force else self._read_cache()
+                if cached and self._valid(cached["expires_at"]) and cached["token"] != stale_token:
+                    token, expires_at = cached["token"], cached["expires_at"]
+                else:
+                    token, expires_at = self._fetch()
+                    self._write_cache(token, expires_at)
+            self.token, self.expires_at = token, expires_at
+            self._schedule()
+            return token
+
+    def _fetch(self):
+        response = get_transport().request(
+            'POST', f"{self.base_url}/auth/v3/tenant_access_token/internal",
+            json={"app_id": self.app_id, "app_secret": self.app_secret}
+        )
+        if response.status_code != 200:
+            raise Exception(f"HTTP request failed with status code: {response.status_code}")
+        result = response.json()
+        if result.get("code") != 0:
+            raise Exception(f"Error: {result.get('msg')}")
+        self.fetches += 1
+        return result["tenant_access_token"], time.time() + result.get("expire", 7200)
+
+    def _read_cache(self):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get(self.app_id)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_cache(self, token, expires_at):
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            data = {}
+        data[self.app_id] = {"token": token, "expires_at": expires_at}
+        tmp_path = f"{self.cache_file}.tmp"
+        # token是凭据，只允许当前用户读写
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.cache_file)
+
+    def _schedule(self):
+        """在进入提前刷新窗口时后台刷新，定时器是守护线程，不会阻止进程退出"""
+        if self._timer:
+            self._timer.cancel()
+        delay = max(1.0, self.expires_at - self.refresh_margin - time.time())
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"后台刷新飞书token失败: {e}")
+
+    def close(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(app_id, app_secret, base_url=BASE_URL):
+    """同一进程内每个应用共用一个 TenantTokenManager"""
+    with _managers_lock:
+        manager = _managers.get(app_id)
+        if manager is None or manager.app_secret != app_secret:
+            manager = TenantTokenManager(app_id, app_secret, base_url)
+            _managers[app_id] = manager
+        return manager
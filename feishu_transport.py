@@ -0,0 +1,204 @@
+import asyncio
+import os
+import threading
+
+import httpx
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+BASE_URL = "https://open.feishu.cn/open-apis"
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_BACKOFF = 0.5
+# 飞书限流返回429，服务端偶发错误返回5xx，这些状态都值得重试
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class _TransportOptions:
+    """同步和异步连接共用的连接池、超时和重试配置"""
+
+    def __init__(self, base_url=BASE_URL, pool_size=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None):
+        self.base_url = base_url
+        self.pool_size = pool_size or int(os.getenv("FEISHU_POOL_SIZE", DEFAULT_POOL_SIZE))
+        self.timeout = (
+            connect_timeout or float(os.getenv("FEISHU_CONNECT_TIMEOUT", DEFAULT_CONNECT_TIMEOUT)),
+            read_timeout or float(os.getenv("FEISHU_READ_TIMEOUT", DEFAULT_READ_TIMEOUT)),
+        )
+        if max_retries is None:
+            max_retries = int(os.getenv("FEISHU_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        if backoff_factor is None:
+            backoff_factor = float(os.getenv("FEISHU_RETRY_BACKOFF", DEFAULT_RETRY_BACKOFF))
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+
+    def url(self, path):
+        """path 为完整地址时原样返回，否则拼接在 base_url 之后"""
+        if path.startswith(('http://', 'https://')):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    @staticmethod
+    def headers(token=None, headers=None, files=False):
+        """files 为True时上传文件，Content-Type 由 requests 按 multipart 生成"""
+        headers = {**({} if files else {"Content-Type": "application/json; charset=utf-8"}), **(headers or {})}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+        return headers
+
+    def _count(self, retries):
+        with self._lock:
+            self._requests += 1
+            self._retries += retries
+
+
+class FeishuTransport(_TransportOptions):
+    """
+    进程内共用的飞书HTTP连接
+
+    所有请求通过同一个 requests.Session 发送，连接保持长连接并放入连接池复用，
+    避免每次请求都重新进行TCP和TLS握手。429和5xx响应按 Retry-After 或指数退避自动重试。
+    配置可通过环境变量覆盖:
+        FEISHU_POOL_SIZE: 连接池大小，默认10
+        FEISHU_CONNECT_TIMEOUT / FEISHU_READ_TIMEOUT: 连接和读取超时秒数，默认5和30
+        FEISHU_MAX_RETRIES: 最多重试次数，默认3
+        FEISHU_RETRY_BACKOFF: 没有 Retry-After 时的退避系数，默认0.5
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        retry = Retry(
+            total=self.max_retries,
+            status_forcelist=RETRY_STATUSES,
+            # 发送消息是POST，更新卡片是PATCH，默认配置不会重试它们
+            allowed_methods=frozenset(['GET', 'POST', 'PATCH', 'PUT', 'DELETE']),
+            respect_retry_after_header=True,
+            backoff_factor=self.backoff_factor,
+            # 重试用完后返回最后一次的响应，由调用方按状态码处理
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+    def request(self, method, path, token=None, **kwargs) -> requests.Response:
+        """
+        发送请求并返回响应，不检查状态码
+
+        Args:
+            method (str): GET / POST / PATCH 等
+            path (str): 相对于 base_url 的路径或完整地址
+            token (str): tenant_access_token，非空时加入 Authorization 头
+            kwargs: 传给 requests 的其他参数，如 json、params、files，未指定 timeout 时使用默认超时
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        headers = self.headers(token, kwargs.pop('headers', None), files='files' in kwargs)
+        response = self.session.request(method, self.url(path), headers=headers, **kwargs)
+        retries = getattr(response.raw, 'retries', None)
+        self._count(len(retries.history) if retries else 0)
+        return response
+
+    def stats(self):
+        """
+        连接复用情况
+
+        Returns:
+            dict: requests 为调用 request 的次数，retries 为其中自动重试的次数，
+                  connections 为新建的连接数，reused 为复用已有连接发出的请求数
+        """
+        connections = sent = 0
+        for pool_key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(pool_key)
+            if pool is not None:
+                connections += pool.num_connections
+                sent += pool.num_requests
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "retries": self._retries,
+                "connections": connections,
+                "reused": max(0, sent - connections),
+            }
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncFeishuTransport(_TransportOptions):
+    """
+    基于 httpx.AsyncClient 的异步飞书连接，配置与 FeishuTransport 相同
+
+    httpx 不会按状态码重试，429和5xx以及连接错误在这里按 Retry-After 或指数退避重试。
+    AsyncClient 绑定创建它的事件循环，每个事件循环使用各自的实例，用完后调用 aclose。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+            timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+        )
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            try:
+                return float(response.headers.get("Retry-After"))
+            except (TypeError, ValueError):
+                pass
+        return self.backoff_factor * (2 ** attempt)
+
+    async def request(self, method, path, token=None, **kwargs) -> httpx.Response:
+        """与 FeishuTransport.request 相同，返回 httpx.Response"""
+        headers = self.headers(token, kwargs.pop('headers', None), files='files' in kwargs)
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.request(method, self.url(path), headers=headers, **kwargs)
+            except httpx.TransportError:
+                if attempt >= self.max_retries:
+                    self._count(attempt)
+                    raise
+                delay = self._delay(attempt)
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    self._count(attempt)
+                    return response
+                delay = self._delay(attempt, response)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        """requests 为调用 request 的次数，retries 为其中自动重试的次数"""
+        with self._lock:
+            return {"requests": self._requests, "retries": self._retries}
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+_transports = {}
+_transport_lock = threading.Lock()
+
+
+def get_transport(max_retries=None) -> FeishuTransport:
+    """
+    同一进程内所有飞书请求共用一个 FeishuTransport
+
+    Args:
+        max_retries (int): 为None时使用默认重试配置；发件箱自己负责重试和退避，使用 max_retries=0 的独立连接池
+    """
+    with _transport_lock:
+        if max_retries not in _transports:
+            _transports[max_retries] = FeishuTransport(max_retries=max_retries)
+        return _transports[max_retries]
@@ -1,124 +1,128 @@
-﻿import time
+﻿import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Union
 
 import lark_oapi as lark
-from lark_oapi.api.im.v1 import *
+from dotenv import load_dotenv
+from lark_oapi.api.im.v1 import P2ImMessageReceiveV1
 
-from client import client
+import card_templates
+from feishu_notifier import INVALID_TOKEN_CODES
+from feishu_token import get_token_manager
+from feishu_transport import BASE_URL, get_transport
+
+# 加载.env文件中的环境变量
+load_dotenv()
 
 user_open_ids = ["ou_a79a0f82add14976e3943f4deb17c3fa", "ou_33c76a4cbeb76bd66608706edb32508e"]
 
 
-# 获取会话历史消息
-def list_chat_history(chat_id: str) -> None:
-    request = ListMessageRequest.builder() \
-        .container_id_type("chat") \
-        .container_id(chat_id) \
-        .build()
+@dataclass
+class Alert:
+    """一次报警的内容，渲染到 cards/alert.json 卡片中，所有字段都由报警来源提供"""
+    event_id: str
+    project: str
+    title: str
+    description: str
+    time: datetime
+    # 值班人的 open_id 列表，"all" 表示所有人
+    primary_on_duty: Union[str, List[str]]
+    secondary_on_duty: Union[str, List[str]]
+    # 报警截图的本地路径
+    image_path: str
+
+
+# 已发送的报警，卡片回调时按事件ID取回报警内容重新渲染卡片
+_sent_alerts: Dict[str, Alert] = {}
+_sent_alerts_lock = threading.Lock()
+MAX_SENT_ALERTS = 1000
+
+
+# 调用飞书接口，所有请求通过进程内共用的长连接发送，token由 feishu_token 缓存
+def _call(method: str, path: str, **kwargs) -> Dict:
+    token_manager = get_token_manager(os.getenv("FEISHU_APP_ID"), os.getenv("FEISHU_APP_SECRET"), BASE_URL)
+    for attempt in range(2):
+        response = get_transport().request(method, path, token=token_manager.get_token(), **kwargs)
+        try:
+            result = response.json()
+        except ValueError:
+            result = {"code": None, "msg": f"HTTP {response.status_code} {response.text}"}
+        code = result.get("code")
+        if attempt == 0 and code in INVALID_TOKEN_CODES:
+            token_manager.refresh(force=True)
+            continue
+        if code != 0:
+            raise Exception(
+                f"{method} {path} failed, code: {code}, msg: {result.get('msg')}, log_id: {response.headers.get('X-Tt-Logid')}")
+        return result.get("data") or {}
 
-    response = client.im.v1.message.list(request)
 
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.message.list failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
+# 发送消息，uuid 使连接层重试时飞书不会重复发送
+def _create_message(chat_id: str, msg_type: str, content: str) -> Dict:
+    return _call('POST', "/im/v1/messages", params={"receive_id_type": "chat_id"},
+                 json={"receive_id": chat_id, "msg_type": msg_type, "content": content, "uuid": str(uuid.uuid4())})
 
-    f = open(f"./chat_history.txt", "w")
-    for i in response.data.items:
-        sender_id = i.sender.id
-        create_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(i.create_time) / 1000))
-        content = i.body.content
 
-        msg = f"chatter({sender_id}) at {create_time} send: {content}"
-        f.write(msg + "\n")
+# 获取会话历史消息
+def list_chat_history(chat_id: str) -> None:
+    data = _call('GET', "/im/v1/messages", params={"container_id_type": "chat", "container_id": chat_id})
+
+    with open(f"./chat_history.txt", "w") as f:
+        for i in data.get("items", []):
+            sender_id = i["sender"]["id"]
+            create_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(i["create_time"]) / 1000))
+            content = i["body"]["content"]
 
-    f.close()
+            msg = f"chatter({sender_id}) at {create_time} send: {content}"
+            f.write(msg + "\n")
 
 
 # 创建报警群并拉人入群
 def create_alert_chat() -> str:
-    request = CreateChatRequest.builder() \
-        .user_id_type("open_id") \
-        .request_body(CreateChatRequestBody.builder()
-                      .name("P0: 线上事故处理")
-                      .description("线上紧急事故处理")
-                      .user_id_list(user_open_ids)
-                      .build()) \
-        .build()
-
-    response = client.im.v1.chat.create(request)
-
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.chat.create failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
-
-    return response.data.chat_id
+    data = _call('POST', "/im/v1/chats", params={"user_id_type": "open_id"}, json={
+        "name": "P0: 线上事故处理",
+        "description": "线上紧急事故处理",
+        "user_id_list": user_open_ids,
+    })
+    return data["chat_id"]
 
 
 # 发送报警消息
-def send_alert_message(chat_id: str) -> None:
-    request = CreateMessageRequest.builder() \
-        .receive_id_type("chat_id") \
-        .request_body(CreateMessageRequestBody.builder()
-                      .receive_id(chat_id)
-                      .msg_type("interactive")
-                      .content(_build_card("跟进处理"))
-                      .build()) \
-        .build()
-
-    response = client.im.v1.chat.create(request)
-
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.chat.create failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
+def send_alert_message(chat_id: str, alert: Alert) -> None:
+    with _sent_alerts_lock:
+        if len(_sent_alerts) >= MAX_SENT_ALERTS:
+            _sent_alerts.pop(next(iter(_sent_alerts)))
+        _sent_alerts[alert.event_id] = alert
 
+    _create_message(chat_id, "interactive", _build_card(alert, "跟进处理"))
 
-# 上传图片
-def _upload_image() -> str:
-    file = open("alert.png", "rb")
-    request = CreateImageRequest.builder() \
-        .request_body(CreateImageRequestBody.builder()
-                      .image_type("message")
-                      .image(file)
-                      .build()) \
-        .build()
 
-    response = client.im.v1.image.create(request)
+# 上传图片，同一个文件没有改动时只上传一次
+def _upload_image(path: str = "alert.png") -> str:
+    return _upload_image_cached(path, os.path.getmtime(path))
 
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.image.create failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
 
-    return response.data.image_key
+@lru_cache(maxsize=128)
+def _upload_image_cached(path: str, mtime: float) -> str:
+    with open(path, "rb") as file:
+        data = _call('POST', "/im/v1/images", data={"image_type": "message"},
+                     files={"image": (os.path.basename(path), file)})
+    return data["image_key"]
 
 
 # 获取会话信息
-def get_chat_info(chat_id: str) -> GetChatResponseBody:
-    request = GetChatRequest.builder() \
-        .chat_id(chat_id) \
-        .build()
-
-    response = client.im.v1.chat.get(request)
-
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.chat.get failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
-
-    return response.data
+def get_chat_info(chat_id: str) -> Dict:
+    return _call('GET', f"/im/v1/chats/{chat_id}")
 
 
 # 更新会话名称
 def update_chat_name(chat_id: str, chat_name: str):
-    request: UpdateChatRequest = UpdateChatRequest.builder() \
-        .chat_id(chat_id) \
-        .request_body(UpdateChatRequestBody.builder()
-                      .name(chat_name)
-                      .build()) \
-        .build()
-
-    response: UpdateChatResponse = client.im.v1.chat.update(request)
-
-    if not response.success():
-        raise Exception(
-            f"client.im.v1.chat.update failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
+    _call('PUT', f"/im/v1/chats/{chat_id}", json={"name": chat_name})
 
 
 # 处理消息回调
@@ -126,24 +130,11 @@ def do_p2_im_message_receive_v1(data: P2ImMessageReceiveV1) -> None:
     msg = data.event.message
     print(f"receive message: {msg.content}")
     if "/solve" in msg.content:
-        request = CreateMessageRequest.builder() \
-            .receive_id_type("chat_id") \
-            .request_body(CreateMessageRequestBody.builder()
-                          .receive_id(msg.chat_id)
-                          .msg_type("text")
-                          .content("{\"text\":\"问题已解决，辛苦了!\"}")
-                          .build()) \
-            .build()
-
-        response = client.im.v1.chat.create(request)
-
-        if not response.success():
-            raise Exception(
-                f"client.im.v1.chat.create failed, code: {response.code}, msg: {response.msg}, log_id: {response.get_log_id()}")
+        _create_message(msg.chat_id, "text", "{\"text\":\"问题已解决，辛苦了!\"}")
 
         # 获取会话信息
         chat_info = get_chat_info(msg.chat_id)
-        name = chat_info.name
+        name = chat_info["name"]
         if name.startswith("[跟进中]"):
             name = "[已解决]" + name[5:]
         elif not name.startswith("[已解决]"):
@@ -158,159 +149,34 @@ def do_interactive_card(data: lark.Card) -> Any:
     if data.action.value.get("key") == "follow":
         # 获取会话信息
         chat_info = get_chat_info(data.open_chat_id)
-        name = chat_info.name
+        name = chat_info["name"]
         if not name.startswith("[跟进中]") and not name.startswith("[已解决]"):
             name = "[跟进中] " + name
 
         # 更新会话名称
         update_chat_name(data.open_chat_id, name)
 
-        return _build_card("跟进中")
-
-
-# 构建卡片
-def _build_card(button_name: str) -> str:
-    image_key = _upload_image()
-    card = {
-        "config": {
-            "wide_screen_mode": True
-        },
-        "header": {
-            "template": "red",
-            "title": {
-                "tag": "plain_text",
-                "content": "1 级报警 - 数据平台"
-            }
-        },
-        "elements": [
-            {
-                "tag": "div",
-                "fields": [
-                    {
-                        "is_short": True,
-                        "text": {
-                            "tag": "lark_md",
-                            "content": "**🕐 时间：**\n2021-02-23 20:17:51"
-                        }
-                    },
-                    {
-                        "is_short": True,
-                        "text": {
-                            "tag": "lark_md",
-                            "content": "**🔢 事件 ID：**\n336720"
-                        }
-                    },
-                    {
-                        "is_short": True,
-                        "text": {
-                            "tag": "lark_md",
-                            "content": "**📋 项目：**\nQA 7"
-                        }
-                    },
-                    {
-                        "is_short": True,
-                        "text": {
-                            "tag": "lark_md",
-                            "content": "**👤 一级值班：**\n<at id=all>所有人</at>"
-                        }
-                    },
-                    {
-                        "is_short": True,
-                        "text": {
-                            "tag": "lark_md",
-                            "content": "**👤 二级值班：**\n<at id=all>所有人</at>"
-                        }
-                    },
-                ]
-            },
-            {
-                "tag": "img",
-                "img_key": image_key,
-                "alt": {
-                    "tag": "plain_text",
-                    "content": " "
-                },
-                "title": {
-                    "tag": "lark_md",
-                    "content": "支付方式 支付成功率低于 50%："
-                }
-            },
-            {
-                "tag": "note",
-                "elements": [
-                    {
-                        "tag": "plain_text",
-                        "content": "🔴 支付失败数  🔵 支付成功数"
-                    }
-                ]
-            },
-            {
-                "tag": "action",
-                "actions": [
-                    {
-                        "tag": "button",
-                        "text": {
-                            "tag": "plain_text",
-                            "content": button_name
-                        },
-                        "type": "primary",
-                        "value": {
-                            "key": "follow"
-                        },
-                    },
-                    {
-                        "tag": "select_static",
-                        "placeholder": {
-                            "tag": "plain_text",
-                            "content": "暂时屏蔽"
-                        },
-                        "options": [
-                            {
-                                "text": {
-                                    "tag": "plain_text",
-                                    "content": "屏蔽10分钟"
-                                },
-                                "value": "1"
-                            },
-                            {
-                                "text": {
-                                    "tag": "plain_text",
-                                    "content": "屏蔽30分钟"
-                                },
-                                "value": "2"
-                            },
-                            {
-                                "text": {
-                                    "tag": "plain_text",
-                                    "content": "屏蔽1小时"
-                                },
-                                "value": "3"
-                            },
-                            {
-                                "text": {
-                                    "tag": "plain_text",
-                                    "content": "屏蔽24小时"
-                                },
-                                "value": "4"
-                            },
-                        ],
-                        "value": {
-                            "key": "value"
-                        }
-                    }
-                ]
-            },
-            {
-                "tag": "hr"
-            },
-            {
-                "tag": "div",
-                "text": {
-                    "tag": "lark_md",
-                    "content": "🙋🏼 [我要反馈误报](https://open.feishu.cn/) | 📝 [录入报警处理过程](https://open.feishu.cn/)"
-                }
-            }
-        ]
-    }
-
-    return lark.JSON.marshal(card)
\ No newline at end of file
+        event_id = str(data.action.value.get("event_id", ""))
+        with _sent_alerts_lock:
+            alert = _sent_alerts.get(event_id)
+        if alert is None:
+            # 报警由其他进程发送或已被淘汰，没有报警内容时不更新卡片，避免用虚构的内容覆盖原卡片
+            print(f"找不到报警 {event_id}，不更新卡片")
+            return None
+        return _build_card(alert, "跟进中")
+
+
+# 构建卡片，卡片定义在 cards/alert.json 中，只替换报警相关的变量
+def _build_card(alert: Alert, button_name: str) -> str:
+    return card_templates.get_registry().render_str(
+        "alert",
+        title=alert.title,
+        time=alert.time,
+        event_id=alert.event_id,
+        project=alert.project,
+        primary_on_duty=alert.primary_on_duty,
+        secondary_on_duty=alert.secondary_on_duty,
+        image_key=_upload_image(alert.image_path),
+        description=alert.description,
+        button_label=button_name,
+    )
@@ -0,0 +1,78 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+from svn_cache import SvnCache
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache")
+DEFAULT_MAX_MB = 64
+DEFAULT_TTL_HOURS = 72
+
+
+def make_key(model, messages, params):
+    """由模型、提示词和采样参数生成缓存键"""
+    payload = json.dumps({"model": model, "messages": messages, "params": params}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(SvnCache):
+    """
+    模型回答的本地磁盘缓存
+
+    复用 SvnCache 的按大小LRU淘汰，另外在缓存项中记录生成时间，超过ttl秒视为未命中并删除该缓存项。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024,
+                 ttl=DEFAULT_TTL_HOURS * 3600):
+        super().__init__(cache_dir, max_bytes)
+        self.ttl = ttl
+
+    def get_response(self, key):
+        """返回 (回答内容, 生成时间戳)，未命中或已过期返回None"""
+        data = self.get(key)
+        if data is None:
+            return None
+        entry = json.loads(data.decode('utf-8'))
+        if self.ttl and time.time() - entry["created"] > self.ttl:
+            # 过期的回答不会再被使用，读到时直接删除，不必等容量超限时才淘汰
+            self.delete(key)
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            return None
+        return entry["content"], entry["created"]
+
+    def put_response(self, key, content):
+        entry = {"created": time.time(), "content": content}
+        self.put(key, json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    获取全局缓存实例，可通过环境变量配置:
+        LLM_CACHE_DIR: 缓存目录
+        LLM_CACHE_MAX_MB: 缓存容量上限(MB)
+        LLM_CACHE_TTL_HOURS: 缓存有效期(小时)
+        LLM_CACHE_DISABLED: 设置为 true 时关闭缓存
+    """
+    global _default_cache
+    if os.getenv("LLM_CACHE_DISABLED", "").lower() == "true":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(
+                cache_dir=os.getenv("LLM_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024,
+                ttl=float(os.getenv("LLM_CACHE_TTL_HOURS", DEFAULT_TTL_HOURS)) * 3600
+            )
+        return _default_cache
@@ -0,0 +1,248 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Optional
+
+import httpx
+import openai
+from openai import OpenAI
+from dotenv import load_dotenv
+
+from rate_limit import retry_with_backoff
+import llm_cache
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+# 可以重试的临时错误
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：ASCII约4个字符一个token，中文等非ASCII字符按一个字符一个token计算"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return math.ceil((len(text) - non_ascii) / 4) + non_ascii
+
+
+def _estimated_usage(messages, parts):
+    """流式响应没有返回用量时，按提示词和已收到的内容估算token数"""
+    return SimpleNamespace(
+        prompt_tokens=sum(estimate_tokens(str(m.get("content") or "")) for m in messages),
+        completion_tokens=estimate_tokens(''.join(parts)),
+    )
+
+
+@dataclass
+class ChatResult:
+    """complete 的返回结果"""
+    content: str
+    cached: bool = False  # 是否来自缓存
+    created: Optional[float] = None  # 缓存结果的生成时间戳
+
+    @property
+    def marked_content(self):
+        """回答内容，来自缓存时在末尾注明生成时间"""
+        if not self.cached:
+            return self.content
+        created = datetime.fromtimestamp(self.created).strftime("%Y-%m-%d %H:%M:%S")
+        return f"{self.content}\n\n(缓存结果，生成于 {created})"
+
+
+class LLMGateway:
+    """
+    所有模型调用的统一入口
+
+    每个 (base_url, api_key) 复用一个带连接池的 OpenAI 客户端，调用时设置连接/读取超时，
+    临时错误按带抖动的指数退避重试，并记录每次调用的耗时、token用量和失败次数。
+    配置可通过环境变量覆盖:
+        LLM_CONNECT_TIMEOUT: 连接超时秒数，默认10
+        LLM_READ_TIMEOUT: 读取超时秒数，默认180
+        LLM_MAX_RETRIES: 最大重试次数，默认3
+        LLM_POOL_SIZE: 每个地址的最大连接数，默认10
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None, pool_size=None):
+        self.connect_timeout = connect_timeout or float(os.getenv("LLM_CONNECT_TIMEOUT", 10))
+        self.read_timeout = read_timeout or float(os.getenv("LLM_READ_TIMEOUT", 180))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 3))
+        self.pool_size = pool_size or int(os.getenv("LLM_POOL_SIZE", 10))
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.attempts = 0
+        self.total_latency = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def get_client(self, base_url=None, api_key=None):
+        """获取复用的客户端，未指定时使用环境变量 AI_API_BASE / AI_API_KEY"""
+        base_url = base_url or os.getenv("AI_API_BASE")
+        api_key = api_key or os.getenv("AI_API_KEY")
+        with self._lock:
+            client = self._clients.get((base_url, api_key))
+            if client is None:
+                http_client = httpx.Client(
+                    limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                    timeout=self._timeout(),
+                )
+                # 重试由网关统一处理，关闭SDK自带的重试
+                client = OpenAI(base_url=base_url, api_key=api_key, http_client=http_client, max_retries=0)
+                self._clients[(base_url, api_key)] = client
+            return client
+
+    def _timeout(self, read_timeout=None):
+        return httpx.Timeout(read_timeout or self.read_timeout, connect=self.connect_timeout)
+
+    def chat(self, messages, model=None, base_url=None, api_key=None, read_timeout=None, rate_limiter=None, **params):
+        """
+        调用 chat.completions.create 并返回完整响应
+
+        Args:
+            messages (list): 对话消息
+            model (str): 模型名，默认读取环境变量 AI_MODEL
+            read_timeout (float): 本次调用的读取超时，默认使用网关配置
+            rate_limiter (RateLimiter): 每次尝试前按预计token数限流
+            params: 透传给 chat.completions.create 的其他参数，如 temperature、tools
+        """
+        client = self.get_client(base_url, api_key)
+        model = model or os.getenv("AI_MODEL")
+        estimated = sum(estimate_tokens(str(m.get("content") or "")) for m in messages) + params.get("max_tokens", 0)
+
+        def create():
+            with self._lock:
+                self.attempts += 1
+            if rate_limiter:
+                rate_limiter.acquire(estimated)
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                timeout=self._timeout(read_timeout),
+                **params
+            )
+
+        start = time.perf_counter()
+        try:
+            response = retry_with_backoff(create, retries=self.max_retries, retry_on=RETRYABLE_ERRORS)
+        except Exception:
+            self._record(model, time.perf_counter() - start, None, failed=True)
+            raise
+        self._record(model, time.perf_counter() - start, getattr(response, "usage", None), failed=False)
+        return response
+
+    def stream(self, messages, on_delta, model=None, base_url=None, api_key=None, read_timeout=None,
+               rate_limiter=None, **params):
+        """
+        以 stream=True 调用模型，每收到新内容就以目前为止的完整文本回调 on_delta，返回完整文本
+
+        只在收到第一个token之前的错误会重试，之后中断则抛出异常。
+        请求最后一个分块附带token用量，服务端不支持、没有返回用量时按文本估算
+        """
+        client = self.get_client(base_url, api_key)
+        model = model or os.getenv("AI_MODEL")
+        estimated = sum(estimate_tokens(str(m.get("content") or "")) for m in messages) + params.get("max_tokens", 0)
+
+        def create():
+            with self._lock:
+                self.attempts += 1
+            if rate_limiter:
+                rate_limiter.acquire(estimated)
+            return client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=self._timeout(read_timeout),
+                **params
+            )
+
+        start = time.perf_counter()
+        first_token_latency = None
+        parts = []
+        usage = None
+        try:
+            response = retry_with_backoff(create, retries=self.max_retries, retry_on=RETRYABLE_ERRORS)
+            for chunk in response:
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if first_token_latency is None:
+                    first_token_latency = time.perf_counter() - start
+                    print(f"[LLM] {model} 首个token耗时 {first_token_latency:.2f}s")
+                parts.append(chunk.choices[0].delta.content)
+                on_delta(''.join(parts))
+        except Exception:
+            self._record(model, time.perf_counter() - start, usage or _estimated_usage(messages, parts), failed=True)
+            raise
+        self._record(model, time.perf_counter() - start, usage or _estimated_usage(messages, parts), failed=False)
+        return ''.join(parts)
+
+    def complete(self, messages, model=None, base_url=None, api_key=None, read_timeout=None, rate_limiter=None,
+                 use_cache=True, bypass_cache=None, on_delta=None, **params):
+        """
+        调用模型并返回 ChatResult，相同的模型、提示词和采样参数优先使用本地缓存的回答
+
+        Args:
+            use_cache (bool): 是否读写缓存
+            bypass_cache (bool): 为True时不读缓存，重新生成并覆盖缓存，默认读取环境变量 LLM_CACHE_BYPASS
+            on_delta: 指定时以流式调用，每收到新内容回调一次目前为止的完整文本；命中缓存时回调一次完整回答
+            其余参数同 chat
+        """
+        model = model or os.getenv("AI_MODEL")
+        if bypass_cache is None:
+            bypass_cache = os.getenv("LLM_CACHE_BYPASS", "").lower() == "true"
+        cache = llm_cache.get_default_cache() if use_cache else None
+        key = llm_cache.make_key(model, messages, params)
+
+        if cache is not None and not bypass_cache:
+            hit = cache.get_response(key)
+            if hit is not None:
+                print(f"[LLM] {model} 命中缓存")
+                result = ChatResult(content=hit[0], cached=True, created=hit[1])
+                if on_delta:
+                    on_delta(result.marked_content)
+                return result
+
+        if on_delta:
+            content = self.stream(messages, on_delta, model=model, base_url=base_url, api_key=api_key,
+                                  read_timeout=read_timeout, rate_limiter=rate_limiter, **params)
+        else:
+            response = self.chat(messages, model=model, base_url=base_url, api_key=api_key,
+                                 read_timeout=read_timeout, rate_limiter=rate_limiter, **params)
+            content = response.choices[0].message.content
+        if cache is not None and content:
+            cache.put_response(key, content)
+        return ChatResult(content=content)
+
+    def _record(self, model, latency, usage, failed):
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            if failed:
+                self.failures += 1
+        status = "失败" if failed else "成功"
+        print(f"[LLM] {model} {status} 耗时 {latency:.2f}s token {prompt_tokens}/{completion_tokens}")
+
+    def stats(self):
+        """调用统计"""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "attempts": self.attempts,
+                "avg_latency": self.total_latency / self.calls if self.calls else 0.0,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+            }
+
+
+# 进程内共享的网关实例
+gateway = LLMGateway()
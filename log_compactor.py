@@ -0,0 +1,158 @@
+import posixpath
+import re
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, List, Union
+
+import svn_log
+from llm_gateway import estimate_tokens
+from log_summarizer import split_log_entries
+from svn_log import SEPARATOR, ChangedPath, LogEntry
+
+# 保留完整路径的代码文件后缀，其余视为资源文件按目录合并
+CODE_EXTENSIONS = {
+    '.lua', '.cs', '.py', '.shader', '.cginc', '.hlsl', '.compute', '.proto',
+    '.java', '.js', '.ts', '.c', '.cpp', '.h', '.m', '.mm',
+}
+
+# 文本日志中的改动路径 "   M /trunk/DR22/Assets/a.png" 或 "   A /trunk/b.lua (from /trunk/a.lua:100)"
+CHANGE_RE = re.compile(r'^\s+([AMDR]) (/.+?)(?: \(from (.+):(\d+)\))?\s*$')
+
+
+@dataclass
+class CompactedLog:
+    """compact_log 的结果"""
+    text: str
+    tokens_before: int
+    tokens_after: int
+    missing_meta: List[str] = field(default_factory=list)  # "r版本号 路径" 形式的缺少meta记录
+
+    @property
+    def saved_ratio(self):
+        return 1 - self.tokens_after / self.tokens_before if self.tokens_before else 0.0
+
+
+def is_code_path(path):
+    return posixpath.splitext(path)[1].lower() in CODE_EXTENSIONS
+
+
+def _parse_text_entry(entry):
+    """从文本日志的一条记录拆出 (版本头, 改动路径, 日志内容)，没有 Changed paths 的记录路径为空"""
+    lines = entry.split('\n')
+    header = lines[0]
+    changes = []
+    i = 1
+    if i < len(lines) and lines[i].startswith('Changed paths:'):
+        i += 1
+        while i < len(lines):
+            match = CHANGE_RE.match(lines[i])
+            if not match:
+                break
+            changes.append(ChangedPath(match.group(1), match.group(2), copyfrom_path=match.group(3),
+                                       copyfrom_rev=match.group(4)))
+            i += 1
+    message = '\n'.join(lines[i:]).strip('\n')
+    return header, changes, message
+
+
+def _pair_meta(changes):
+    """把资源和同一版本中动作相同的.meta合并为一项，返回 ([(改动路径, 是否含meta), ...], 缺少配对的路径)"""
+    actions = {change.path: change.action for change in changes}
+    paired = []
+    missing = []
+    for change in changes:
+        action, path = change.action, change.path
+        if path.endswith('.meta'):
+            asset = path[:-len('.meta')]
+            if asset in actions:
+                continue
+            if action in 'ADR' and '/Assets/' in path:
+                missing.append(f"{path} (没有对应的资源)")
+            paired.append((change, False))
+            continue
+        has_meta = actions.get(path + '.meta') == action or (action == 'R' and path + '.meta' in actions)
+        if not has_meta and action in 'ADR' and '/Assets/' in path:
+            missing.append(f"{path} (缺少.meta)")
+        paired.append((change, has_meta))
+    return paired, missing
+
+
+def _strip(path, prefix):
+    """去掉公共前缀，路径本身就是前缀时返回空字符串"""
+    if prefix and path == prefix:
+        return ''
+    return path[len(prefix):] if prefix and path.startswith(prefix + '/') else path
+
+
+def _render_changes(changes, prefix):
+    lines = []
+    groups = OrderedDict()
+    for change, has_meta in changes:
+        if is_code_path(change.path):
+            suffix = " (含meta)" if has_meta else ""
+            lines.append(f"   {change.action} {_strip(change.path, prefix)}{suffix}")
+        else:
+            groups.setdefault((change.action, posixpath.dirname(change.path)), []).append((change, has_meta))
+    for (action, directory), items in groups.items():
+        if len(items) == 1:
+            change, has_meta = items[0]
+            suffix = " (含meta)" if has_meta else ""
+            lines.append(f"   {action} {_strip(change.path, prefix)}{suffix}")
+        else:
+            metas = sum(1 for _, has_meta in items if has_meta)
+            detail = f"，其中{metas}个含meta" if metas else ""
+            lines.append(f"   {action} {_strip(directory, prefix)}/ ({len(items)}个文件{detail})")
+    return lines
+
+
+def compact_log(log: Union[str, Iterable[LogEntry]]) -> CompactedLog:
+    """
+    压缩 svn log -v 的输出以减少发送给模型的token
+
+        1. 所有路径的公共前缀只在开头说明一次
+        2. 资源和同一版本的.meta合并为一项
+        3. 非代码文件按 (动作, 所在目录) 合并为数量，代码文件保留完整路径
+        4. 新增、删除的Assets资源缺少.meta时在该版本下单独列出
+
+    版本之间仍用分隔线隔开，可以继续交给 log_summarizer 分块，公共前缀的说明放在第一条记录中，
+    分块后随第一块一起发送
+
+    Args:
+        log: svn_log.LogEntry 序列，或只保存了文本的 svn log -v 输出（如按天保存的分片）
+    """
+    if isinstance(log, str):
+        original = log
+        parsed = [_parse_text_entry(entry) for entry in split_log_entries(log)]
+    else:
+        entries = list(log)
+        original = svn_log.format_verbose(entries)
+        parsed = [(svn_log.format_header(entry), entry.changed_paths, entry.message) for entry in entries]
+    paths = [change.path for _, changes, _ in parsed for change in changes]
+    prefix = posixpath.dirname(posixpath.commonpath(paths)) if len(paths) > 1 else ''
+    if prefix == '/':
+        prefix = ''
+
+    blocks = []
+    missing_meta = []
+    for header, changes, message in parsed:
+        lines = [header]
+        if changes:
+            paired, missing = _pair_meta(changes)
+            lines.append("Changed paths:")
+            lines.extend(_render_changes(paired, prefix))
+            if missing:
+                lines.append("缺少meta配对:")
+                lines.extend(f"   {_strip(path, prefix)}" for path in missing)
+                revision = header.split(' ', 1)[0]
+                missing_meta.extend(f"{revision} {path}" for path in missing)
+        if message:
+            lines.extend(['', message])
+        blocks.append('\n'.join(lines))
+
+    text = ''
+    if blocks:
+        if prefix:
+            blocks[0] = f"以下路径省略公共前缀 {prefix}\n{blocks[0]}"
+        text = SEPARATOR + '\n' + ('\n' + SEPARATOR + '\n').join(blocks) + '\n' + SEPARATOR + '\n'
+    return CompactedLog(text=text, tokens_before=estimate_tokens(original), tokens_after=estimate_tokens(text),
+                        missing_meta=missing_meta)
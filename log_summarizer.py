@@ -0,0 +1,95 @@
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from llm_gateway import estimate_tokens
+
+DEFAULT_CHUNK_TOKENS = 8000
+DEFAULT_MAX_WORKERS = 4
+
+# svn log 每条记录之间的分隔线
+SEPARATOR_RE = re.compile(r'^-{20,}\s*$', re.MULTILINE)
+
+
+def split_log_entries(log_text: str) -> List[str]:
+    """按分隔线把 svn log 输出拆成每个版本一条记录，去掉空记录"""
+    return [entry.strip('\n') for entry in SEPARATOR_RE.split(log_text) if entry.strip()]
+
+
+def chunk_entries(entries: List[str], token_budget: int) -> List[str]:
+    """
+    按版本边界把记录装入不超过token_budget的分块
+
+    单条记录超出预算时单独成块并按行截断，保证每块都能放进一次模型调用
+    """
+    chunks = []
+    current = []
+    used = 0
+    for entry in entries:
+        tokens = estimate_tokens(entry)
+        if tokens > token_budget:
+            kept = []
+            kept_tokens = 0
+            for line in entry.split('\n'):
+                line_tokens = estimate_tokens(line + '\n')
+                if kept_tokens + line_tokens > token_budget:
+                    break
+                kept.append(line)
+                kept_tokens += line_tokens
+            entry = '\n'.join(kept + ["...[记录过长，已截断]"])
+            tokens = token_budget
+        if current and used + tokens > token_budget:
+            chunks.append('\n\n'.join(current))
+            current = []
+            used = 0
+        current.append(entry)
+        used += tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def summarize_log(log_text: str, map_fn: Callable[[str], str], reduce_fn: Callable[[str, bool], str],
+                  chunk_tokens: Optional[int] = None, max_workers: Optional[int] = None) -> str:
+    """
+    分层总结较长的SVN日志
+
+    日志不超过chunk_tokens时直接交给reduce_fn；否则按版本拆块，用map_fn并行总结每一块，
+    总结合并后仍然超出时继续分块总结，最后交给reduce_fn得出结论。每个阶段的耗时会打印出来。
+
+    Args:
+        log_text: svn log 原始输出
+        map_fn: 总结一块日志，返回摘要
+        reduce_fn: 根据完整日志或各块摘要给出最终点评，第二个参数表示传入的是否为摘要
+        chunk_tokens: 每块的token上限，默认读取环境变量 LOG_CHUNK_TOKENS
+        max_workers: 并行总结的块数，默认读取环境变量 LOG_SUMMARY_WORKERS
+    """
+    if chunk_tokens is None:
+        chunk_tokens = int(os.getenv("LOG_CHUNK_TOKENS", DEFAULT_CHUNK_TOKENS))
+    if max_workers is None:
+        max_workers = int(os.getenv("LOG_SUMMARY_WORKERS", DEFAULT_MAX_WORKERS))
+
+    text = log_text
+    entries = split_log_entries(log_text)
+    stage = 0
+    while estimate_tokens(text) > chunk_tokens and len(entries) > 1:
+        stage += 1
+        entry_count = len(entries)
+        chunks = chunk_entries(entries, chunk_tokens)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(chunks)))) as executor:
+            summaries = list(executor.map(map_fn, chunks))
+        print(f"[总结] 第{stage}轮: {entry_count} 条记录分为 {len(chunks)} 块，"
+              f"耗时 {time.perf_counter() - start:.2f}s")
+        entries = [summary for summary in summaries if summary]
+        text = '\n\n'.join(entries)
+        # 已经只剩一块，或者每条记录都单独成块无法再合并时停止
+        if len(chunks) == 1 or len(chunks) == entry_count:
+            break
+
+    start = time.perf_counter()
+    result = reduce_fn(text, stage > 0)
+    print(f"[总结] 最终点评耗时 {time.perf_counter() - start:.2f}s")
+    return result
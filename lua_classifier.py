@@ -0,0 +1,146 @@
+import threading
+
+from parse_lua import LuaASTParser
+
+COSMETIC = "cosmetic"  # 只改动空白、换行或注释
+DATA = "data"  # 只改动字面量常量或纯数据表（字符串表、配置表等）
+LOGIC = "logic"  # 其他改动
+
+# 级别从低到高，一个提交的级别取其中所有文件的最高级别
+LEVELS = [COSMETIC, DATA, LOGIC]
+
+LITERAL_TYPES = {'string', 'number', 'true', 'false', 'nil'}
+# 纯数据表中允许出现的节点类型
+DATA_TABLE_TYPES = LITERAL_TYPES | {
+    'table_constructor', 'field', 'comment', 'string_start', 'string_content', 'string_end', 'escape_sequence',
+}
+
+_local = threading.local()
+
+
+def _get_parser():
+    # tree-sitter 的 Parser 不能跨线程共用，每个线程一个
+    if not hasattr(_local, 'parser'):
+        _local.parser = LuaASTParser().parser
+    return _local.parser
+
+
+def _is_data_table(node):
+    """表构造器中只有字面量、嵌套的数据表，以及作为键名的标识符"""
+    stack = list(node.named_children)
+    while stack:
+        child = stack.pop()
+        if child.type == 'identifier':
+            parent = child.parent
+            if parent is None or parent.type != 'field' or parent.child_by_field_name('name') != child:
+                return False
+            continue
+        if child.type == 'unary_expression':
+            # 负数常量
+            operand = child.named_children
+            if len(operand) != 1 or operand[0].type != 'number':
+                return False
+            continue
+        if child.type not in DATA_TABLE_TYPES:
+            return False
+        stack.extend(child.named_children)
+    return True
+
+
+def _is_value_position(node):
+    """
+    节点是否是赋值语句右侧的值、表字段的值，或文件顶层 return 的值（配置文件写法 return { ... }）
+
+    条件判断、函数参数、运算中的字面量不算数据，改动它们会改变逻辑
+    """
+    parent = node.parent
+    if parent is not None and parent.type == 'unary_expression':
+        # 负数常量取整个 -1 的位置
+        node, parent = parent, parent.parent
+    if parent is None:
+        return False
+    if parent.type == 'field':
+        return parent.child_by_field_name('value') == node
+    if parent.type == 'expression_list':
+        owner = parent.parent
+        if owner is None:
+            return False
+        if owner.type == 'assignment_statement':
+            return True
+        return owner.type == 'return_statement' and owner.parent is not None and owner.parent.type == 'chunk'
+    return False
+
+
+def _tokens(root, source, mask_data):
+    """
+    去掉注释后的叶子节点序列，空白和换行不在语法树中，自然被忽略
+
+    mask_data为True时，作为值的字面量和纯数据表只保留类型，用于判断是否只有数据改动
+    """
+    tokens = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node.type == 'comment':
+            continue
+        if mask_data and node.type in LITERAL_TYPES and _is_value_position(node):
+            tokens.append(node.type)
+        elif mask_data and node.type == 'table_constructor' and _is_value_position(node) and _is_data_table(node):
+            tokens.append('<data_table>')
+        elif node.type == 'string' or node.child_count == 0:
+            tokens.append((node.type, source[node.start_byte:node.end_byte]))
+        else:
+            stack.extend(reversed(node.children))
+    return tokens
+
+
+def classify_source(old_source, new_source):
+    """
+    比较同一个文件改动前后的语法树，返回 COSMETIC / DATA / LOGIC
+
+    任意一方为空（新增、删除或获取失败）或存在语法错误时按逻辑改动处理
+    """
+    if not old_source or not new_source:
+        return LOGIC
+    old_bytes = old_source.encode('utf-8') if isinstance(old_source, str) else old_source
+    new_bytes = new_source.encode('utf-8') if isinstance(new_source, str) else new_source
+    parser = _get_parser()
+    old_root = parser.parse(old_bytes).root_node
+    new_root = parser.parse(new_bytes).root_node
+    if old_root.has_error or new_root.has_error:
+        return LOGIC
+    if _tokens(old_root, old_bytes, False) == _tokens(new_root, new_bytes, False):
+        return COSMETIC
+    if _tokens(old_root, old_bytes, True) == _tokens(new_root, new_bytes, True):
+        return DATA
+    return LOGIC
+
+
+def classify_files(old_contents, new_contents, paths):
+    """按文件分类并返回提交的整体级别和每个文件的级别"""
+    labels = {path: classify_source(old_contents.get(path), new_contents.get(path)) for path in paths}
+    if not labels:
+        return LOGIC, labels
+    return max(labels.values(), key=LEVELS.index), labels
+
+
+class ClassifierStats:
+    """预分类统计，记录各级别的提交数和节省的模型调用次数"""
+
+    def __init__(self):
+        self.counts = {level: 0 for level in LEVELS}
+        self.llm_calls_saved = 0
+        self._lock = threading.Lock()
+
+    def record(self, level, skipped_llm):
+        with self._lock:
+            self.counts[level] += 1
+            if skipped_llm:
+                self.llm_calls_saved += 1
+
+    def summary(self):
+        with self._lock:
+            return {**self.counts, "total": sum(self.counts.values()), "llm_calls_saved": self.llm_calls_saved}
+
+
+stats = ClassifierStats()
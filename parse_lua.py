@@ -33,6 +33,16 @@ class LuaASTParser:
         tree = self.parser.parse(self.source_code)
         return self._extract_functions(tree.root_node)
 
+    def parse_source(self, source_code, file_path: Optional[str] = None) -> List[CodeChunk]:
+        """解析内存中的 Lua 源码（如 svn cat 的输出）并返回函数代码块列表"""
+        self.file_path = file_path
+        if isinstance(source_code, str):
+            source_code = source_code.encode('utf-8')
+        self.source_code = source_code
+
+        tree = self.parser.parse(self.source_code)
+        return self._extract_functions(tree.root_node)
+
     def parse_directory(self, directory_path: str) -> Dict[str, List[CodeChunk]]:
         """递归解析目录下的所有 Lua 文件"""
         result = {}
@@ -82,6 +92,9 @@ class LuaASTParser:
             if name_node:
                 if name_node.type == 'identifier':
                     return self._get_node_text(name_node)
+                elif name_node.type in ('dot_index_expression', 'method_index_expression'):
+                    # 模块写法 function M.foo() / function M.sub.foo() / function M:bar()，保留原写法作为函数名
+                    return self._get_node_text(name_node)
                 elif name_node.type == 'variable':
                     # 处理 table.method 形式的函数名
                     table_node = name_node.child_by_field_name('table')
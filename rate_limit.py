@@ -0,0 +1,89 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶
+
+    Args:
+        rate (float): 每秒补充的令牌数
+        capacity (float): 桶容量，即允许的最大突发量
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount=1):
+        """尝试取走令牌，成功返回0，否则返回还需等待的秒数"""
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0
+            return (amount - self.tokens) / self.rate
+
+    def acquire(self, amount=1):
+        """阻塞直到取得令牌，超过容量的请求按容量计算，避免永远等待"""
+        while True:
+            wait = self.try_acquire(amount)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+class RateLimiter:
+    """
+    同时限制每分钟请求数(RPM)和每分钟token数(TPM)，对应模型服务商的两种限流
+
+    Args:
+        requests_per_minute (int): 每分钟请求数，0表示不限制
+        tokens_per_minute (int): 每分钟token数，0表示不限制
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.request_bucket = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+
+    def acquire(self, tokens=0):
+        """发起请求前调用，tokens为本次请求预计消耗的token数"""
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and tokens:
+            self.token_bucket.acquire(tokens)
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """第attempt次重试前的等待时间：指数退避加随机抖动"""
+    return min(max_delay, base_delay * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+
+def retry_with_backoff(func, retries=3, base_delay=1.0, max_delay=30.0, retry_on=(Exception,)):
+    """
+    调用func，遇到retry_on中的异常时按指数退避重试，重试用尽后抛出最后一次的异常
+
+    Args:
+        func: 无参数的可调用对象
+        retries (int): 最大重试次数
+        retry_on (tuple): 需要重试的异常类型
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except retry_on as e:
+            if attempt >= retries:
+                raise
+            delay = backoff_delay(attempt, base_delay, max_delay)
+            print(f"调用失败: {e}，{delay:.1f}秒后第{attempt + 1}次重试")
+            time.sleep(delay)
@@ -0,0 +1,137 @@
+import bisect
+import os
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from parse_lua import CodeChunk, LuaASTParser
+from svn_diff import FileDiff
+from llm_gateway import estimate_tokens
+
+DEFAULT_CONTEXT_LINES = 5
+DEFAULT_TOKEN_BUDGET = 6000
+
+
+class FunctionIndex:
+    """单个文件中函数行号区间的索引，用于查找与改动行重叠的函数"""
+
+    def __init__(self, chunks: List[CodeChunk]):
+        self.chunks = sorted(chunks, key=lambda chunk: chunk.start_line)
+        self.starts = [chunk.start_line for chunk in self.chunks]
+
+    def overlapping(self, start: int, end: int) -> List[CodeChunk]:
+        """返回与 [start, end] 行重叠的函数，按行号排序"""
+        result = []
+        # 顶层函数之间互不重叠，从最后一个起始行不大于end的函数向前查找即可
+        i = bisect.bisect_right(self.starts, end) - 1
+        while i >= 0 and self.chunks[i].end_line >= start:
+            result.append(self.chunks[i])
+            i -= 1
+        return list(reversed(result))
+
+
+@dataclass
+class ContextSpan:
+    """需要放入提示词的一段代码"""
+    start_line: int
+    end_line: int
+    functions: List[str]  # 该段包含的函数名，顶层代码为空
+
+
+def _merge_spans(spans: List[ContextSpan]) -> List[ContextSpan]:
+    merged = []
+    for span in sorted(spans, key=lambda s: (s.start_line, s.end_line)):
+        if merged and span.start_line <= merged[-1].end_line + 1:
+            last = merged[-1]
+            last.end_line = max(last.end_line, span.end_line)
+            last.functions.extend(name for name in span.functions if name not in last.functions)
+        else:
+            merged.append(ContextSpan(span.start_line, span.end_line, list(span.functions)))
+    return merged
+
+
+def find_spans(file_diff: FileDiff, index: FunctionIndex, line_count: int, context_lines: int) -> List[ContextSpan]:
+    """把改动块的新文件行号范围映射为所在函数加上前后若干行"""
+    spans = []
+    for hunk in file_diff.hunks:
+        start, end = hunk.new_range
+        # 纯删除的改动块没有新行，取删除位置所在的行
+        end = max(start, end)
+        functions = index.overlapping(start, end)
+        if functions:
+            start = min(start, functions[0].start_line)
+            end = max(end, functions[-1].end_line)
+        spans.append(ContextSpan(
+            start_line=max(1, start - context_lines),
+            end_line=min(line_count, end + context_lines),
+            functions=[chunk.function_name for chunk in functions]
+        ))
+    return _merge_spans(spans)
+
+
+def _render_span(path: str, lines: List[str], span: ContextSpan) -> str:
+    title = f"-- {path} 第{span.start_line}-{span.end_line}行"
+    if span.functions:
+        title += f" ({', '.join(span.functions)})"
+    return '\n'.join([title] + lines[span.start_line - 1:span.end_line])
+
+
+def build_review_context(file_diffs: Iterable[FileDiff], file_contents: Dict[str, str],
+                         context_lines: Optional[int] = None, token_budget: Optional[int] = None) -> str:
+    """
+    根据diff构建只包含改动函数的审查上下文，替代把整个文件发送给模型
+
+    Args:
+        file_diffs: 解析好的lua文件diff
+        file_contents: {文件路径: 该版本的文件内容}
+        context_lines: 函数前后额外保留的行数，默认读取环境变量 REVIEW_CONTEXT_LINES
+        token_budget: 上下文token上限，默认读取环境变量 REVIEW_TOKEN_BUDGET
+
+    超出预算时的截断规则（结果只取决于输入）：
+        1. 先去掉函数前后的额外行
+        2. 仍然超出时按文件在diff中的顺序、文件内按行号顺序依次放入，
+           放不下的那一段按行截断，其后的代码段只列出位置
+    """
+    if context_lines is None:
+        context_lines = int(os.getenv("REVIEW_CONTEXT_LINES", DEFAULT_CONTEXT_LINES))
+    if token_budget is None:
+        token_budget = int(os.getenv("REVIEW_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+
+    parser = LuaASTParser()
+    files = []
+    for file_diff in file_diffs:
+        content = file_contents.get(file_diff.path)
+        if content is None or not file_diff.hunks:
+            continue
+        lines = content.split('\n')
+        index = FunctionIndex(parser.parse_source(content, file_diff.path))
+        files.append((file_diff, lines, index))
+
+    for extra_lines in (context_lines, 0):
+        segments = []
+        for file_diff, lines, index in files:
+            for span in find_spans(file_diff, index, len(lines), extra_lines):
+                segments.append((file_diff.path, span, _render_span(file_diff.path, lines, span)))
+        if sum(estimate_tokens(text) for _, _, text in segments) <= token_budget:
+            return '\n\n'.join(text for _, _, text in segments)
+
+    result = []
+    used = 0
+    for path, span, text in segments:
+        if used >= token_budget:
+            result.append(f"-- 省略: {path} 第{span.start_line}-{span.end_line}行")
+            continue
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            kept = []
+            for line in text.split('\n'):
+                line_tokens = estimate_tokens(line + '\n')
+                if used + line_tokens > token_budget:
+                    break
+                kept.append(line)
+                used += line_tokens
+            text = '\n'.join(kept + ["-- ...[超出token预算，已截断]"])
+            used = token_budget
+        else:
+            used += tokens
+        result.append(text)
+    return '\n\n'.join(result)
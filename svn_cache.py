@@ -0,0 +1,274 @@
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".svn_cache")
+DEFAULT_MAX_MB = 512
+
+# 只有固定的数字版本号（或数字版本范围）才是不可变的，HEAD、日期等不缓存
+_IMMUTABLE_REVISION = re.compile(r'^r?\d+(:r?\d+)?$')
+
+
+class SvnCache:
+    """
+    SVN输出的本地磁盘缓存
+
+    已提交的版本内容不会再变化，因此缓存项永不失效，只按总大小做LRU淘汰。
+    每个缓存项是一个以键的sha256命名的文件，文件的修改时间即最近访问时间。
+    打开时遍历一次目录得到总大小，之后写入和删除时增量更新，只有超过容量时才再遍历目录淘汰，
+    淘汰时顺便按实际大小校正（其他进程共用同一目录时增量统计会有偏差）。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._scan())
+
+    def _entry_path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def get(self, key):
+        """读取缓存，未命中返回None"""
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        # 更新修改时间，作为LRU的访问时间
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def delete(self, key):
+        """删除缓存项，不存在时忽略"""
+        path = self._entry_path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            self._size -= size
+
+    def put(self, key, data):
+        """写入缓存，并在超过容量时淘汰最久未访问的缓存项"""
+        if len(data) > self.max_bytes:
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免并发读到写了一半的内容
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            self._replace(tmp_path, path, len(data))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+
+    def open(self, key):
+        """以二进制流打开缓存项，未命中返回None，用于逐行读取大输出"""
+        path = self._entry_path(key)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return f
+
+    def put_file(self, key, src_path):
+        """把已经写好的文件移动为缓存项，src_path需要与缓存目录在同一文件系统"""
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            os.remove(src_path)
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._replace(src_path, path, size)
+        self._evict()
+
+    def _replace(self, src_path, path, size):
+        """移动文件为缓存项并更新总大小，覆盖已有缓存项时减去旧文件的大小"""
+        try:
+            old_size = os.path.getsize(path)
+        except FileNotFoundError:
+            old_size = 0
+        os.replace(src_path, path)
+        with self._lock:
+            self._size += size - old_size
+
+    def _scan(self):
+        """遍历缓存目录，返回 [(修改时间, 大小, 路径), ...]"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.startswith('tmp'):
+                    # 正在写入的临时文件
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            if self._size <= self.max_bytes:
+                return
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                self.evictions += 1
+            self._size = total
+
+    def stats(self):
+        """返回命中/未命中统计"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """
+    获取全局缓存实例，可通过环境变量配置:
+        SVN_CACHE_DIR: 缓存目录
+        SVN_CACHE_MAX_MB: 缓存容量上限(MB)
+        SVN_CACHE_DISABLED: 设置为 true 时关闭缓存
+    """
+    global _default_cache
+    if os.getenv("SVN_CACHE_DISABLED", "").lower() == "true":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SvnCache(
+                cache_dir=os.getenv("SVN_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                max_bytes=int(os.getenv("SVN_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+            )
+        return _default_cache
+
+
+def make_key(repo_url, revision, path, operation):
+    """
+    生成缓存键，版本号不是固定数字时返回None表示不可缓存
+
+    Args:
+        repo_url (str): 仓库地址或工作副本路径
+        revision (str): 版本号，如 r123、123 或 100:120
+        path (str): 仓库内的文件路径，没有则为空
+        operation (str): 操作，如 diff、log -v、cat
+    """
+    revision = str(revision).strip()
+    if not _IMMUTABLE_REVISION.match(revision):
+        return None
+    return "\n".join([str(repo_url).rstrip('/\\'), revision, path or "", operation])
+
+
+def get(key):
+    """从全局缓存读取，键为None或缓存关闭时返回None"""
+    cache = get_default_cache()
+    if key is None or cache is None:
+        return None
+    return cache.get(key)
+
+
+def put(key, data):
+    """写入全局缓存，键为None或缓存关闭时忽略"""
+    cache = get_default_cache()
+    if key is None or cache is None:
+        return
+    cache.put(key, data)
+
+
+def open_cached(key):
+    """以二进制流打开全局缓存项，键为None、未命中或缓存关闭时返回None"""
+    cache = get_default_cache()
+    if key is None or cache is None:
+        return None
+    return cache.open(key)
+
+
+def stream_output(cmd, cache_key, check=False, **kwargs):
+    """
+    逐行产出命令的原始输出(bytes)，命中缓存时直接从缓存文件读取，
+    未命中时边读子进程管道边写入临时文件，命令成功结束后放入缓存，全程不把输出整体读入内存
+
+    check为True时命令失败会在输出结束后抛出 CalledProcessError
+    """
+    cached = open_cached(cache_key)
+    if cached is not None:
+        with cached:
+            yield from cached
+        return
+
+    cache = get_default_cache() if cache_key is not None else None
+    tmp = tempfile.NamedTemporaryFile(dir=cache.cache_dir, delete=False) if cache else None
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, **kwargs)
+    completed = False
+    try:
+        for line in process.stdout:
+            if tmp:
+                tmp.write(line)
+            yield line
+        returncode = process.wait()
+        completed = returncode == 0
+        if check and not completed:
+            raise subprocess.CalledProcessError(returncode, cmd)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if tmp:
+            tmp.close()
+            if completed:
+                cache.put_file(cache_key, tmp.name)
+            else:
+                os.remove(tmp.name)
+
+
+def stats():
+    """全局缓存的命中统计"""
+    cache = get_default_cache()
+    return cache.stats() if cache else {"hits": 0, "misses": 0, "evictions": 0}
@@ -0,0 +1,162 @@
+import asyncio
+import locale
+import os
+import shlex
+import subprocess
+import time
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+import svn_cache
+
+# 加载.env文件中的环境变量
+load_dotenv()
+
+# 每次调用都会加上的参数，不需要交互，并信任服务器证书
+DEFAULT_FLAGS = ['--non-interactive', '--trust-server-cert']
+DEFAULT_MAX_PARALLEL = 8
+
+
+def fallback_encoding():
+    """输出不是UTF-8时使用的编码，默认读取环境变量 SVN_OUTPUT_ENCODING，否则为系统编码（中文Windows为GBK）"""
+    encoding = os.getenv("SVN_OUTPUT_ENCODING") or locale.getpreferredencoding(False)
+    return 'gbk' if encoding.lower() in ('ascii', 'ansi_x3.4-1968') else encoding
+
+
+def detect_encoding(data: bytes) -> str:
+    """按原始字节判断编码：能按UTF-8严格解码时为UTF-8，否则为 fallback_encoding"""
+    try:
+        data.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return fallback_encoding()
+
+
+def decode(data: bytes) -> str:
+    """只判断一次编码并解码，无法解码的字节替换为 U+FFFD"""
+    return data.decode(detect_encoding(data), errors='replace')
+
+
+def command(subcommand: str, *args, extra_args=None) -> List[str]:
+    """
+    生成 svn 命令的参数列表，不经过shell，路径中有空格也不需要加引号
+
+    Args:
+        subcommand: 如 log、diff、cat、info
+        args: 其余参数
+        extra_args (str): 附加参数，如认证信息，默认读取环境变量 USER_INFO
+    """
+    if extra_args is None:
+        extra_args = os.getenv("USER_INFO", "")
+    extra = shlex.split(extra_args, posix=os.name != 'nt')
+    flags = [flag for flag in DEFAULT_FLAGS if flag not in extra]
+    return ['svn', subcommand, *[str(arg) for arg in args], *flags, *extra]
+
+
+def _error(args, returncode, stdout, stderr, quiet=False):
+    """生成 CalledProcessError，quiet 为True时表示调用方预期可能失败（如文件不存在），不输出错误信息"""
+    error = subprocess.CalledProcessError(returncode, args, stdout, stderr)
+    if not quiet:
+        # 错误信息中的中文路径同样需要正确解码
+        print(f"执行SVN命令失败: {' '.join(args)}\n{decode(stderr or b'').strip()}")
+    return error
+
+
+def run(args: Sequence[str], cache_key: Optional[str] = None, quiet=False) -> bytes:
+    """
+    执行命令并返回原始输出(bytes)，cache_key 非空时读写 svn_cache，失败时抛出 CalledProcessError
+
+    Args:
+        quiet (bool): 失败是预期情况时为True，不输出错误信息，由调用方处理异常
+    """
+    cached = svn_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise _error(args, result.returncode, result.stdout, result.stderr, quiet)
+    svn_cache.put(cache_key, result.stdout)
+    return result.stdout
+
+
+def run_text(args: Sequence[str], cache_key: Optional[str] = None, quiet=False) -> str:
+    """与 run 相同，返回解码后的文本"""
+    return decode(run(args, cache_key, quiet))
+
+
+def stream(args: Sequence[str], cache_key: Optional[str] = None) -> Iterator[bytes]:
+    """逐行产出命令的原始输出，不把整个输出读入内存，失败时在输出结束后抛出 CalledProcessError"""
+    return svn_cache.stream_output(list(args), cache_key, check=True)
+
+
+def iter_lines(args: Sequence[str], cache_key: Optional[str] = None) -> Iterator[str]:
+    """
+    逐行产出解码后的文本
+
+    先按UTF-8严格解码，遇到第一行无法解码的内容时改用 fallback_encoding，之后的行都按该编码解码，
+    不会对同一行反复尝试
+    """
+    encoding = 'utf-8'
+    for line in stream(args, cache_key):
+        if encoding == 'utf-8':
+            try:
+                yield line.decode('utf-8')
+                continue
+            except UnicodeDecodeError:
+                encoding = fallback_encoding()
+        yield line.decode(encoding, errors='replace')
+
+
+async def _run_async(args, cache_key, semaphore, quiet=False, timings=None, index=None):
+    start = time.perf_counter()
+    try:
+        cached = svn_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            # 从进程启动开始计时，不包括等待信号量的时间
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise _error(list(args), process.returncode, stdout, stderr, quiet)
+        svn_cache.put(cache_key, stdout)
+        return stdout
+    finally:
+        if timings is not None:
+            timings[index] = time.perf_counter() - start
+
+
+def run_many(commands: Iterable[Tuple[Sequence[str], Optional[str]]], max_parallel: Optional[int] = None,
+             return_exceptions=False, timings: Optional[list] = None) -> list:
+    """
+    通过 asyncio 子进程池并发执行多条互不依赖的命令，结果顺序与commands一致
+
+    Args:
+        commands: [(参数列表, 缓存键), ...]
+        max_parallel (int): 同时运行的进程数，默认读取环境变量 SVN_MAX_PARALLEL
+        return_exceptions (bool): 为True时失败的命令以异常对象作为结果并且不输出错误信息，由调用方处理，
+                                  否则抛出第一个异常
+        timings (list): 非空时清空后按commands的顺序写入每条命令的耗时秒数
+    """
+    commands = list(commands)
+    if not commands:
+        return []
+    if max_parallel is None:
+        max_parallel = int(os.getenv("SVN_MAX_PARALLEL", DEFAULT_MAX_PARALLEL))
+
+    if timings is not None:
+        timings[:] = [0.0] * len(commands)
+
+    async def main():
+        semaphore = asyncio.Semaphore(max_parallel)
+        return await asyncio.gather(
+            *(_run_async(args, cache_key, semaphore, return_exceptions, timings, i)
+              for i, (args, cache_key) in enumerate(commands)),
+            return_exceptions=return_exceptions
+        )
+
+    return asyncio.run(main())
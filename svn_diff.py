@@ -0,0 +1,146 @@
+import re
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+_HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+_PROPERTY_ACTIONS = ('Added: ', 'Modified: ', 'Deleted: ', 'Name: ')
+
+
+@dataclass
+class Hunk:
+    """unified diff 中的一个改动块"""
+    old_start: int  # 旧文件起始行号
+    old_count: int  # 旧文件行数
+    new_start: int  # 新文件起始行号
+    new_count: int  # 新文件行数
+    header: str  # @@ 行原文
+    lines: List[str] = field(default_factory=list)  # 改动块内容，包含前缀 ' '、'+'、'-'
+
+    @property
+    def old_range(self) -> Tuple[int, int]:
+        """旧文件中的行号范围 (起始, 结束)，纯新增时结束行小于起始行"""
+        return self.old_start, self.old_start + self.old_count - 1
+
+    @property
+    def new_range(self) -> Tuple[int, int]:
+        """新文件中的行号范围 (起始, 结束)，纯删除时结束行小于起始行"""
+        return self.new_start, self.new_start + self.new_count - 1
+
+
+@dataclass
+class PropertyChange:
+    """SVN属性改动"""
+    action: str  # Added / Modified / Deleted
+    name: str  # 属性名，如 svn:mime-type
+    lines: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FileDiff:
+    """单个文件的diff"""
+    path: str  # Index 行中的文件路径
+    hunks: List[Hunk] = field(default_factory=list)
+    property_changes: List[PropertyChange] = field(default_factory=list)
+    is_binary: bool = False  # svn无法显示的二进制文件
+    truncated_bytes: int = 0  # 超出字节上限被丢弃的字节数
+    lines: List[str] = field(default_factory=list)  # Index 行之后的原始行，用于还原文本
+
+    @property
+    def is_lua(self) -> bool:
+        return self.path.endswith('.lua')
+
+    @property
+    def new_ranges(self) -> List[Tuple[int, int]]:
+        return [hunk.new_range for hunk in self.hunks]
+
+    @property
+    def old_ranges(self) -> List[Tuple[int, int]]:
+        return [hunk.old_range for hunk in self.hunks]
+
+    def render(self) -> str:
+        """还原为发送给模型的文本格式"""
+        text = '\n'.join([f"Changes in {self.path}:\n"] + self.lines)
+        if self.truncated_bytes:
+            text += f"\n... [diff已截断，省略 {self.truncated_bytes} 字节]"
+        return text
+
+
+def parse_diff(lines: Iterable[str], max_file_bytes: Optional[int] = None) -> Iterator[FileDiff]:
+    """
+    逐行解析svn diff输出，每解析完一个文件就产出一个 FileDiff
+
+    Args:
+        lines: 可迭代的文本行，可以直接是子进程的输出流
+        max_file_bytes: 单个文件保留的字节上限，超出部分只计数不保存
+    """
+    current: Optional[FileDiff] = None
+    hunk: Optional[Hunk] = None
+    prop: Optional[PropertyChange] = None
+    old_left = new_left = 0
+    in_properties = False
+    kept_bytes = 0
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+
+        if line.startswith('Index: ') or (line.startswith('Property changes on: ')
+                                          and (current is None or line[21:] != current.path)):
+            # 新文件开始；没有Index行的目录属性改动也作为单独的文件
+            if current is not None:
+                yield current
+            is_index = line.startswith('Index: ')
+            current = FileDiff(path=line[7:] if is_index else line[21:])
+            hunk = prop = None
+            old_left = new_left = 0
+            in_properties = not is_index
+            kept_bytes = 0
+            if is_index:
+                continue
+        elif current is None:
+            continue
+
+        size = len(line.encode('utf-8')) + 1
+        if max_file_bytes and kept_bytes + size > max_file_bytes:
+            current.truncated_bytes += size
+            continue
+        kept_bytes += size
+        current.lines.append(line)
+
+        if hunk is not None and (old_left > 0 or new_left > 0 or line.startswith('\\')):
+            # 改动块内容，根据行数判断何时结束
+            hunk.lines.append(line)
+            if line.startswith('-'):
+                old_left -= 1
+            elif line.startswith('+'):
+                new_left -= 1
+            elif not line.startswith('\\'):
+                old_left -= 1
+                new_left -= 1
+            continue
+
+        match = _HUNK_HEADER.match(line)
+        if match and not in_properties:
+            old_left = int(match.group(2)) if match.group(2) is not None else 1
+            new_left = int(match.group(4)) if match.group(4) is not None else 1
+            hunk = Hunk(
+                old_start=int(match.group(1)),
+                old_count=old_left,
+                new_start=int(match.group(3)),
+                new_count=new_left,
+                header=line
+            )
+            current.hunks.append(hunk)
+        elif line.startswith('Property changes on: '):
+            in_properties = True
+            hunk = None
+        elif in_properties and line.startswith(_PROPERTY_ACTIONS):
+            action, _, name = line.partition(': ')
+            prop = PropertyChange(action=action, name=name)
+            current.property_changes.append(prop)
+        elif in_properties and prop is not None and not line.startswith('___'):
+            prop.lines.append(line)
+        elif line.startswith('Cannot display: '):
+            current.is_binary = True
+
+    if current is not None:
+        yield current
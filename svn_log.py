@@ -0,0 +1,157 @@
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, List, Optional
+
+import svn_cache
+import svn_client
+
+SEPARATOR = '-' * 72
+
+
+@dataclass
+class ChangedPath:
+    """svn log -v 中的一条改动路径"""
+    action: str  # A / M / D / R
+    path: str
+    kind: str = ''  # file / dir，旧版本服务器可能为空
+    copyfrom_path: Optional[str] = None
+    copyfrom_rev: Optional[str] = None
+
+    def to_dict(self):
+        return {"action": self.action, "path": self.path}
+
+
+@dataclass
+class LogEntry:
+    """一个提交的日志记录"""
+    revision: str
+    author: str
+    date: str  # 本地时间，格式与 svn log 文本输出一致，如 "2023-12-20 10:00:00 +0800"
+    message: str
+    changed_paths: List[ChangedPath] = field(default_factory=list)
+
+    def to_dict(self):
+        return {
+            "revision": self.revision,
+            "author": self.author,
+            "date": self.date,
+            "changed_paths": [path.to_dict() for path in self.changed_paths],
+            "message": self.message,
+        }
+
+
+def _format_date(value):
+    """把XML中的UTC时间 2023-12-20T02:00:00.000000Z 转为本地时间"""
+    if not value:
+        return ''
+    try:
+        date = datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc).astimezone()
+    except ValueError:
+        return value
+    return date.strftime('%Y-%m-%d %H:%M:%S %z')
+
+
+def _entry_from_element(element):
+    changed_paths = [
+        ChangedPath(
+            action=path.get('action', ''),
+            path=path.text or '',
+            kind=path.get('kind', ''),
+            copyfrom_path=path.get('copyfrom-path'),
+            copyfrom_rev=path.get('copyfrom-rev'),
+        )
+        for path in element.iterfind('paths/path')
+    ]
+    return LogEntry(
+        revision=element.get('revision', ''),
+        # 匿名提交没有author节点
+        author=element.findtext('author', ''),
+        date=_format_date(element.findtext('date', '')),
+        message=(element.findtext('msg') or '').strip(),
+        changed_paths=changed_paths,
+    )
+
+
+def iter_log_entries(chunks: Iterable[bytes]) -> Iterator[LogEntry]:
+    """
+    增量解析 svn log --xml 的输出，每解析完一个 logentry 就产出一条记录并释放对应节点，
+    内存占用与版本数量无关
+
+    Args:
+        chunks: 原始输出的字节块，例如 svn_cache.stream_output 逐行产出的内容
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    root = None
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = element
+                continue
+            if element.tag == 'logentry':
+                yield _entry_from_element(element)
+                # 解析完的记录从根节点上移除，否则整棵树会留在内存中
+                root.clear()
+    parser.close()
+
+
+def parse_log(xml_content) -> List[LogEntry]:
+    """解析完整的 svn log --xml 输出(str 或 bytes)"""
+    if isinstance(xml_content, str):
+        xml_content = xml_content.encode('utf-8')
+    return list(iter_log_entries([xml_content]))
+
+
+def iter_svn_log(target, revision_range, verbose=True, extra_args=None):
+    """
+    执行 svn log --xml 并逐条产出 LogEntry，数字版本范围的结果会写入 svn_cache
+
+    设置了 SVN_MIRROR_DIR 时改为从本地镜像读取，见 svn_mirror.get_mirror
+
+    Args:
+        target (str): 工作副本路径或仓库URL
+        revision_range (str): -r 参数，如 "100:200" 或 "{2024-01-01}:{2024-01-08}"
+        verbose (bool): 是否包含改动路径
+        extra_args (str): 附加参数，如认证信息，默认读取环境变量 USER_INFO
+    """
+    # svn_mirror 依赖本模块的数据类，在这里导入避免循环引用
+    import svn_mirror
+    mirror = svn_mirror.get_mirror(target, extra_args)
+    if mirror is not None:
+        yield from mirror.iter_log(revision_range, verbose)
+        return
+
+    flags = ['-v', '--xml'] if verbose else ['--xml']
+    args = svn_client.command('log', *flags, '-r', revision_range, target, extra_args=extra_args)
+    cache_key = svn_cache.make_key(target, revision_range, "", f"log {' '.join(flags)}")
+    yield from iter_log_entries(svn_client.stream(args, cache_key))
+
+
+def format_simple(entries: Iterable[LogEntry]) -> str:
+    """每个提交一行: "版本号 提交人 日志" """
+    return '\n'.join(f"{entry.revision} {entry.author} {entry.message}" for entry in entries)
+
+
+def format_header(entry: LogEntry) -> str:
+    """svn log 文本输出中每个提交的第一行: "r版本号 | 提交人 | 时间 | 日志行数" """
+    line_count = len(entry.message.split('\n')) if entry.message else 0
+    return f"r{entry.revision} | {entry.author} | {entry.date} | {line_count} line{'s' if line_count != 1 else ''}"
+
+
+def format_verbose(entries: Iterable[LogEntry]) -> str:
+    """还原 svn log -v 的文本格式，作为发送给模型的输入"""
+    blocks = []
+    for entry in entries:
+        lines = [format_header(entry)]
+        if entry.changed_paths:
+            lines.append("Changed paths:")
+            for path in entry.changed_paths:
+                source = f" (from {path.copyfrom_path}:{path.copyfrom_rev})" if path.copyfrom_path else ''
+                lines.append(f"   {path.action} {path.path}{source}")
+        lines.extend(['', entry.message])
+        blocks.append('\n'.join(lines))
+    if not blocks:
+        return ''
+    return SEPARATOR + '\n' + ('\n' + SEPARATOR + '\n').join(blocks) + '\n' + SEPARATOR + '\n'
@@ -0,0 +1,303 @@
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+
+import svn_cache
+import svn_client
+from svn_log import ChangedPath, LogEntry
+
+# svnlook diff 中每个文件的标题行，其后紧跟一行 "====="
+_DIFF_HEADER = re.compile(r'^(Modified|Added|Deleted|Copied): (.+?)(?: \(from rev \d+, .+\))?$')
+# 版本范围中的一端: 数字、HEAD 或 {日期}
+_DATE_SPEC = re.compile(r'^\{(.+)\}$')
+
+
+class SvnMirror:
+    """
+    远程仓库的本地镜像
+
+    用 svnsync 增量同步到本地仓库，日志、改动路径、diff 和文件内容都通过 svnlook 直接读取本地仓库，
+    不再经过网络。需要的版本还没有同步时自动执行一次 svnsync sync。
+
+    Args:
+        mirror_dir (str): 本地镜像仓库目录，不存在时自动创建
+        source_url (str): 远程仓库地址
+        sync_args (list): 传给 svnsync 的额外参数，如 --source-username
+    """
+
+    def __init__(self, mirror_dir, source_url, sync_args=None):
+        self.mirror_dir = os.path.abspath(mirror_dir)
+        self.source_url = source_url
+        self.sync_args = list(sync_args or [])
+        self.url = Path(self.mirror_dir).as_uri()
+        self._youngest = None
+        self._lock = threading.Lock()
+
+    def ensure(self):
+        """创建镜像仓库并初始化同步，已存在时不做任何事"""
+        if os.path.exists(os.path.join(self.mirror_dir, 'format')):
+            return
+        svn_client.run(['svnadmin', 'create', self.mirror_dir])
+        # svnsync 需要修改版本属性，镜像仓库必须允许 pre-revprop-change
+        hooks = os.path.join(self.mirror_dir, 'hooks')
+        if sys.platform == 'win32':
+            with open(os.path.join(hooks, 'pre-revprop-change.bat'), 'w') as f:
+                f.write('@exit 0\n')
+        else:
+            hook = os.path.join(hooks, 'pre-revprop-change')
+            with open(hook, 'w') as f:
+                f.write('#!/bin/sh\nexit 0\n')
+            os.chmod(hook, 0o755)
+        svn_client.run(['svnsync', 'initialize', self.url, self.source_url, '--non-interactive'] + self.sync_args)
+
+    def sync(self):
+        """增量同步远程仓库的新版本，返回同步后的最新版本号；同步失败时继续使用已有的内容"""
+        with self._lock:
+            self.ensure()
+            try:
+                svn_client.run(['svnsync', 'synchronize', self.url, '--non-interactive'] + self.sync_args)
+            except subprocess.CalledProcessError:
+                print("同步SVN镜像失败，使用已有的版本")
+            self._youngest = int(svn_client.run(['svnlook', 'youngest', self.mirror_dir]).strip())
+            return self._youngest
+
+    def youngest(self):
+        """镜像中的最新版本号，首次调用时先同步"""
+        if self._youngest is None:
+            return self.sync()
+        return self._youngest
+
+    def require(self, revision):
+        """确保镜像中已有指定版本，没有时先同步"""
+        if revision > self.youngest():
+            self.sync()
+        if revision > self._youngest:
+            raise ValueError(f"SVN镜像中没有版本 r{revision}，最新为 r{self._youngest}")
+
+    def _look(self, subcommand, revision, *args):
+        # 已同步的版本不会再变化，svnlook 的结果可以永久缓存
+        key = svn_cache.make_key(self.url, str(revision), '\n'.join(args), f"svnlook {subcommand}")
+        return svn_client.run(['svnlook', subcommand, '-r', str(revision), self.mirror_dir, *args], key)
+
+    def date(self, revision):
+        """版本的提交时间"""
+        text = svn_client.decode(self._look('date', revision)).strip()
+        return datetime.strptime(text[:25], '%Y-%m-%d %H:%M:%S %z')
+
+    def revision_at(self, date):
+        """与 svn 的 {日期} 相同：返回该时间点时的最新版本"""
+        # 版本时间随版本号递增，二分查找最后一个不晚于date的版本
+        low, high = 0, self.youngest()
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.date(middle) <= date:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def resolve(self, spec):
+        """把版本范围的一端（数字、r数字、HEAD 或 {日期}）转为版本号"""
+        spec = spec.strip().strip('"\'')
+        if spec.upper() == 'HEAD':
+            return self.sync()
+        match = _DATE_SPEC.match(spec)
+        if match:
+            self.sync()
+            date = datetime.fromisoformat(match.group(1))
+            if date.tzinfo is None:
+                date = date.astimezone()
+            return self.revision_at(date)
+        revision = int(spec.lstrip('r'))
+        self.require(revision)
+        return revision
+
+    def log_entry(self, revision, verbose=True, changed_paths=None):
+        """读取单个版本的日志记录，已经取得改动路径时通过changed_paths传入"""
+        # svnlook info 输出依次为: 作者、时间、日志长度、日志内容
+        lines = svn_client.decode(self._look('info', revision)).split('\n')
+        author, date = lines[0], lines[1].split(' (', 1)[0]
+        message = '\n'.join(lines[3:]).strip()
+        if not verbose:
+            changed_paths = []
+        elif changed_paths is None:
+            changed_paths = self.changed(revision)
+        return LogEntry(revision=str(revision), author=author, date=date, message=message,
+                        changed_paths=changed_paths)
+
+    def changed(self, revision) -> List[ChangedPath]:
+        """
+        版本的改动路径，格式与 svn log -v 一致：路径以 / 开头，动作为 A / M / D / R
+
+        svnlook changed 的每行前4个字符为状态，目录以 / 结尾，
+        --copy-info 时复制来源在下一行 "    (from 路径:r版本)"
+        """
+        output = svn_client.decode(self._look('changed', revision, '--copy-info'))
+        result = []
+        for line in output.split('\n'):
+            if not line.strip():
+                continue
+            if line.startswith('    (from ') and result:
+                source, _, rev = line.strip()[6:-1].rpartition(':r')
+                result[-1].copyfrom_path = '/' + source.rstrip('/')
+                result[-1].copyfrom_rev = rev
+                continue
+            status, path = line[:4], line[4:]
+            action = status[0] if status[0] in 'ADR' else 'M'
+            kind = 'dir' if path.endswith('/') else 'file'
+            result.append(ChangedPath(action=action, path='/' + path.rstrip('/'), kind=kind))
+        return result
+
+    def iter_log(self, start, end, prefix='', verbose=True) -> Iterator[LogEntry]:
+        """按 start 到 end 的顺序产出改动了prefix下路径的版本，与 svn log -r start:end 相同"""
+        step = 1 if end >= start else -1
+        for revision in range(start, end + step, step):
+            if revision == 0:
+                continue
+            changed = None
+            if prefix:
+                changed = self.changed(revision)
+                if not any(_under(path.path, prefix) for path in changed):
+                    continue
+            yield self.log_entry(revision, verbose, changed)
+
+    def iter_diff(self, revision, prefix='', path_filter: Optional[Callable[[str], bool]] = None) -> Iterator[str]:
+        """
+        逐行产出版本的diff，格式转换为 svn diff 的 "Index: 路径" 形式，路径相对于prefix，
+        不在prefix下或者 path_filter 返回False的文件跳过
+        """
+        self.require(revision)
+        cmd = ['svnlook', 'diff', '-r', str(revision), self.mirror_dir]
+        key = svn_cache.make_key(self.url, str(revision), '', "svnlook diff")
+        keep = False
+        pending = None
+
+        def select(path):
+            path = '/' + path.rstrip('/')
+            if not _under(path, prefix):
+                return None
+            relative = path[len(prefix) + 1:] if prefix else path.lstrip('/')
+            if path_filter and not path_filter(relative):
+                return None
+            return relative
+
+        for line in svn_client.iter_lines(cmd, key):
+            line = line.rstrip('\r\n')
+            if pending is not None:
+                header, path = pending
+                pending = None
+                if line.startswith('====='):
+                    relative = select(path)
+                    keep = relative is not None
+                    if keep:
+                        yield f"Index: {relative}\n"
+                        yield line + '\n'
+                    continue
+                # 不是文件标题，而是属性改动中的 "Added: 属性名"
+                if keep:
+                    yield header + '\n'
+            match = _DIFF_HEADER.match(line)
+            if match:
+                pending = (line, match.group(2))
+                continue
+            if line.startswith('Property changes on: '):
+                relative = select(line[21:])
+                keep = relative is not None
+                if keep:
+                    yield f"Property changes on: {relative}\n"
+                continue
+            if keep:
+                yield line + '\n'
+        if pending is not None and keep:
+            yield pending[0] + '\n'
+
+    def cat(self, path, revision):
+        """读取文件在指定版本的内容(bytes)，path 为仓库中的完整路径"""
+        self.require(revision)
+        return self._look('cat', revision, path.lstrip('/'))
+
+
+def _under(path, prefix):
+    return not prefix or path == prefix or path.startswith(prefix + '/')
+
+
+class MirrorTarget:
+    """工作副本或仓库URL在镜像中对应的路径，提供与 svn 命令等价的查询"""
+
+    def __init__(self, mirror: SvnMirror, prefix: str):
+        self.mirror = mirror
+        self.prefix = prefix  # 如 /trunk/DR22
+
+    def head(self):
+        """同步后的最新版本号，对应 svn info -r HEAD"""
+        return self.mirror.sync()
+
+    def resolve(self, spec):
+        """把数字、HEAD 或 {日期} 转为版本号"""
+        return self.mirror.resolve(spec)
+
+    def iter_log(self, revision_range, verbose=True):
+        """与 svn log [-v] -r revision_range 相同的记录"""
+        start, _, end = revision_range.strip().strip('"\'').partition(':')
+        start = self.mirror.resolve(start)
+        end = self.mirror.resolve(end) if end else start
+        return self.mirror.iter_log(start, end, self.prefix, verbose)
+
+    def iter_diff(self, revision, path_filter=None):
+        return self.mirror.iter_diff(int(str(revision).lstrip('r')), self.prefix, path_filter)
+
+    def cat(self, file_path, revision):
+        """file_path 相对于工作副本根目录"""
+        return self.mirror.cat(f"{self.prefix}/{file_path}", int(str(revision).lstrip('r')))
+
+
+def _sync_args(extra_args):
+    """把 svn 的 --username/--password 转为 svnsync 的 --source-username/--source-password"""
+    args = []
+    for arg in shlex.split(extra_args, posix=os.name != 'nt'):
+        if arg in ('--username', '--password'):
+            arg = '--source' + arg[1:]
+        args.append(arg)
+    return args
+
+
+_mirrors = {}
+_mirrors_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_mirror(target, extra_args=None) -> Optional[MirrorTarget]:
+    """
+    设置了环境变量 SVN_MIRROR_DIR 时返回target在本地镜像中的对应位置，否则返回None
+
+    镜像的远程地址默认为target所在仓库的根地址，可通过 SVN_MIRROR_URL 指定，
+    svnsync 的认证参数默认由 extra_args 转换，可通过 SVN_MIRROR_SYNC_ARGS 指定
+
+    Args:
+        target (str): 工作副本路径或仓库URL
+        extra_args (str): 执行 svn info 时附加的参数，如认证信息，默认读取环境变量 USER_INFO
+    """
+    mirror_dir = os.getenv("SVN_MIRROR_DIR")
+    if not mirror_dir:
+        return None
+    if extra_args is None:
+        extra_args = os.getenv("USER_INFO", "")
+    output = svn_client.run(svn_client.command('info', '--xml', target, extra_args=extra_args))
+    entry = ET.fromstring(output).find('entry')
+    prefix = entry.findtext('relative-url').lstrip('^').rstrip('/')
+    source_url = os.getenv("SVN_MIRROR_URL") or entry.findtext('repository/root').rstrip('/')
+    sync_args = os.getenv("SVN_MIRROR_SYNC_ARGS")
+    sync_args = sync_args.split() if sync_args is not None else _sync_args(extra_args)
+    with _mirrors_lock:
+        key = (os.path.abspath(mirror_dir), source_url)
+        if key not in _mirrors:
+            _mirrors[key] = SvnMirror(mirror_dir, source_url, sync_args)
+        return MirrorTarget(_mirrors[key], prefix)
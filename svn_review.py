@@ -2,44 +2,130 @@ import argparse
 import subprocess
 import sys
 import os
-from datetime import datetime, timedelta
-from build_notify import call_with_stream, format_svn_log, BuildConfig
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from build_notify import (call_with_stream, format_svn_log, BuildConfig, compact_log_for_ai, summarize_log_chunk,
+                          judge_log)
 from feishu_notifier import FeishuNotifier
+from day_shards import DayShardStore
+import log_summarizer
+import svn_log
+import svn_client
+import svn_mirror
 
 def get_svn_info(svn_url):
     """获取SVN仓库的最新版本号"""
-    cmd = f'svn info {svn_url} --non-interactive --trust-server-cert'
     try:
-        result = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-        try:
-            result = result.decode('utf-8')
-        except UnicodeDecodeError:
-            result = result.decode('gbk')
-        
-        for line in result.split('\n'):
-            if line.startswith('Revision:'):
-                return line.split(':')[1].strip()
+        output = svn_client.run(svn_client.command('info', '--xml', svn_url))
     except subprocess.CalledProcessError as e:
         print(f"获取SVN信息失败: {e}")
-        print(f"错误输出: {e.output}")
         sys.exit(1)
-    return None
+    entry = ET.fromstring(output).find('entry')
+    return entry.get('revision') if entry is not None else None
 
 def get_svn_logs_by_date(svn_url, start_date, end_date):
-    """根据日期范围获取SVN日志"""
-    cmd = f'svn log -v {svn_url} -r "{{{start_date}}}:{{{end_date}}}" --non-interactive --trust-server-cert'
+    """根据日期范围获取SVN日志，返回 svn_log.LogEntry 列表"""
     try:
-        result = subprocess.check_output(cmd, shell=True, stderr=subprocess.STDOUT)
-        try:
-            result = result.decode('utf-8')
-        except UnicodeDecodeError:
-            result = result.decode('gbk')
-        return result
+        return list(svn_log.iter_svn_log(svn_url, f'{{{start_date}}}:{{{end_date}}}'))
     except subprocess.CalledProcessError as e:
         print(f"获取SVN日志失败: {e}")
-        print(f"错误输出: {e.output}")
         sys.exit(1)
 
+@lru_cache(maxsize=None)
+def get_repository_root(svn_url):
+    """仓库根地址，按日期查版本号时使用，根目录在任何版本都存在"""
+    output = svn_client.run(svn_client.command('info', '--xml', svn_url))
+    return ET.fromstring(output).find('entry').findtext('repository/root')
+
+def resolve_day_revision(svn_url, day, store=None):
+    """
+    返回day当天0点时的最新版本号，与 svn 的 {日期} 相同
+
+    已经过去的时间点结果不会再变化，保存在store中，之后不再请求服务器
+    """
+    if store is not None:
+        revision = store.get_revision(day)
+        if revision is not None:
+            return revision
+    spec = f'{{{day.isoformat()}}}'
+    mirror = svn_mirror.get_mirror(svn_url)
+    if mirror is not None:
+        revision = mirror.resolve(spec)
+    else:
+        output = svn_client.run(svn_client.command('info', '--xml', '-r', spec, get_repository_root(svn_url)))
+        revision = int(ET.fromstring(output).find('entry').get('revision'))
+    if store is not None and day <= date.today():
+        store.set_revision(day, revision)
+    return revision
+
+def fetch_day(svn_url, day, store):
+    """获取某天的提交记录，返回包含日志、格式化日志和压缩日志的分片"""
+    start = resolve_day_revision(svn_url, day, store) + 1
+    end = resolve_day_revision(svn_url, day + timedelta(days=1), store)
+    try:
+        entries = list(svn_log.iter_svn_log(svn_url, f"{start}:{end}")) if start <= end else []
+    except subprocess.CalledProcessError as e:
+        print(f"获取SVN日志失败: {e}")
+        sys.exit(1)
+    log = svn_log.format_verbose(entries)
+    return {
+        "date": day.isoformat(),
+        "start_revision": start,
+        "end_revision": end,
+        "log": log,
+        "formatted": format_svn_log(entries),
+        "compacted": compact_log_for_ai(entries) if entries else '',
+    }
+
+def summarize_day(shard, config):
+    """总结一天的压缩日志，没有提交时为空字符串，调用失败时返回None"""
+    if not shard["compacted"]:
+        return ''
+    try:
+        return log_summarizer.summarize_log(
+            shard["compacted"],
+            lambda chunk: summarize_log_chunk(chunk, config),
+            lambda text, summarized: text if summarized else summarize_log_chunk(text, config)
+        )
+    except Exception as e:
+        print(f"总结 {shard['date']} 的提交失败: {e}")
+        return None
+
+def load_days(svn_url, days, config, store, refresh=False):
+    """
+    按天获取日志和AI总结，已经结束的日期优先使用保存的分片，只获取缺少的日期
+
+    Returns:
+        list: 每天的分片，顺序与days一致
+    """
+    today = date.today()
+    shards = []
+    for day in days:
+        shard = None if refresh or day >= today else store.load(day)
+        if shard is not None:
+            print(f"[分片] {day} 使用已保存的日志 r{shard['start_revision']}-r{shard['end_revision']}")
+        else:
+            shard = fetch_day(svn_url, day, store)
+            print(f"[分片] {day} 获取日志 r{shard['start_revision']}-r{shard['end_revision']}")
+        shards.append(shard)
+
+    # 缺少总结或者换了模型的日期并行总结
+    pending = [shard for shard in shards if shard.get("summary") is None or shard.get("model") != config.model_name]
+    if pending:
+        with ThreadPoolExecutor(max_workers=int(os.getenv("LOG_SUMMARY_WORKERS", 4))) as executor:
+            summaries = list(executor.map(lambda shard: summarize_day(shard, config), pending))
+        for shard, summary in zip(pending, summaries):
+            shard["summary"] = summary
+            shard["model"] = config.model_name
+
+    for day, shard in zip(days, shards):
+        # 当天还没有结束，不保存；总结失败的分片总结为None，下次重试
+        if day < today:
+            store.save(day, shard)
+    return shards
+
 def main():
     parser = argparse.ArgumentParser(description='SVN提交记录分析工具')
     parser.add_argument('--svn_url', default='C:\\hanjiajianghu2\\DR22', help='SVN仓库地址')
@@ -48,8 +134,12 @@ def main():
 
 
     parser.add_argument('--days', type=int, default=1, help='要分析的天数（默认7天）')
+    parser.add_argument('--no-ai-cache', action='store_true', help='不使用缓存的AI回答，重新生成')
+    parser.add_argument('--refresh', action='store_true', help='忽略已保存的按天分片，重新获取和总结')
     
     args = parser.parse_args()
+    if args.no_ai_cache:
+        os.environ["LLM_CACHE_BYPASS"] = "true"
     
     # 计算日期范围
     end_date = datetime.now() + timedelta(days=1) # 加一天以包含今天的内容
@@ -61,35 +151,50 @@ def main():
     
     print(f"分析时间范围: {start_date_str} 到 {end_date_str}")
     
-    # 获取SVN日志
-    svn_log = get_svn_logs_by_date(args.svn_url, start_date_str, end_date_str, args.username, args.password)
-    
-    # 格式化日志
-    formatted_log = format_svn_log(svn_log)
-    
     # 创建配置对象
     config = BuildConfig()
     
+    # 按天获取SVN日志，之前的报告已经处理过的日期直接复用
+    days = [start_date.date() + timedelta(days=i) for i in range(args.days)]
+    store = DayShardStore(args.svn_url)
+    
     print("\n=== SVN提交记录分析结果 ===")
     print(f"分析范围: {args.svn_url}")
     print(f"时间段: {start_date_str} 到 {end_date_str}")
-    print("\n=== 原始提交记录 ===")
-    print(formatted_log)
     
     # 调用AI助手进行分析
     print("\n正在分析提交记录...\n")
-    analysis_result = call_with_stream(svn_log, config)
+    if len(days) == 1:
+        # 只有今天时直接点评完整日志
+        shards = [fetch_day(args.svn_url, days[0], store)]
+        analysis_result = call_with_stream(shards[0]["log"], config) if shards[0]["log"] else "该时间段内没有提交"
+    else:
+        shards = load_days(args.svn_url, days, config, store, args.refresh)
+        # 总结失败的日期改用压缩后的日志
+        summaries = [
+            f"{shard['date']}:\n{shard['summary'] if shard['summary'] is not None else shard['compacted']}"
+            for shard in shards if shard["compacted"]
+        ]
+        if summaries:
+            try:
+                analysis_result = judge_log('\n\n'.join(summaries), config, summarized=True)
+            except Exception as e:
+                print(f"AI分析失败: {e}")
+                analysis_result = None
+        else:
+            analysis_result = "该时间段内没有提交"
     
+    print("\n=== 原始提交记录 ===")
+    print('\n'.join(shard["formatted"] for shard in shards if shard["formatted"]))
     
     print("\n=== AI分析结果 ===")
     print(analysis_result)
     notifier = FeishuNotifier()
-    notifier.send_simple_card_message(
-        chat_id=os.getenv("FEISHU_SVN_REVIEW_CHAT_ID"),
-        title=f"今日SVN提交点评 ({start_date_str} to {end_date_str})",
-        content=analysis_result
-    )
+    title = f"今日SVN提交点评 ({start_date_str} to {end_date_str})"
+    # 多个群用逗号分隔
+    chat_ids = FeishuNotifier.parse_chat_ids(os.getenv("FEISHU_SVN_REVIEW_CHAT_ID"))
+    notifier.send_simple_card_to_chats(chat_ids, title, analysis_result)
 
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,53 +1,149 @@
-﻿import subprocess
+﻿import argparse
+import json
+import subprocess
 import os
 import difflib
-import openai
-from openai import OpenAI
 import random
-import re
+import time
+import fnmatch
+from functools import lru_cache
+import xml.etree.ElementTree as ET
 from feishu_notifier import FeishuNotifier
+import svn_cache
+import svn_log
+import svn_client
+import svn_mirror
+from svn_diff import parse_diff
+from review_context import build_review_context
+from rate_limit import RateLimiter
+from llm_gateway import gateway
+import lua_classifier
 from dotenv import load_dotenv
 from string import Template
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # 加载.env文件中的环境变量
 load_dotenv()
 
-def run_command(cmd):
-    """运行命令并返回输出，处理编码问题"""
-    try:
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace', shell=True)
-        return result.stdout
-    except UnicodeDecodeError:
-        # 如果UTF-8解码失败，尝试使用GBK
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='gbk', errors='replace', shell=True)
-        return result.stdout
-
-def get_svn_diff(repo_path, revision):
-    """获取指定SVN修订版本的差异"""
-    cmd = f'svn diff -c {revision} {repo_path} {os.environ["USER_INFO"]}'
-    return run_command(cmd)
-
-def filter_lua_files(diff_content):
-    """过滤出.lua文件的差异"""
-    lines = diff_content.split('\n')
-    lua_diffs = []
-    current_file = None
+# Unity资产类文件，diff中通常是大段YAML或二进制，对代码审查没有意义
+UNITY_ASSET_PATTERNS = [
+    '*.prefab', '*.asset', '*.meta', '*.unity', '*.mat', '*.anim', '*.controller',
+    '*.png', '*.jpg', '*.tga', '*.psd', '*.fbx', '*.bytes', '*.ab',
+]
+
+# 每次svn diff携带的路径数量上限，避免命令行过长
+DIFF_TARGETS_PER_COMMAND = 50
+
+def _match_path(path, include=None, exclude=None):
+    """按通配符判断路径是否需要，include为空表示全部包含"""
+    name = path.rsplit('/', 1)[-1]
+    if include and not any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in include):
+        return False
+    if exclude and any(fnmatch.fnmatch(path, p) or fnmatch.fnmatch(name, p) for p in exclude):
+        return False
+    return True
+
+def _diff_commands(repo_path, revision, include=None, exclude=None):
+    """
+    生成获取diff所需的命令参数及其缓存键，include/exclude为空时是整个提交的diff
+
+    Returns:
+        list: [(参数列表, 缓存键, 目标路径), ...]，目标路径非空时命令只比较这一个文件，
+              输出中的路径需要用 _rename_single_target 改为该路径
+    """
+    if not include and not exclude:
+        args = svn_client.command('diff', '-c', revision, repo_path)
+        return [(args, svn_cache.make_key(repo_path, revision, "", "diff"), None)]
+
+    rev = int(str(revision).lstrip('r'))
+    repo_info = get_repo_info(repo_path)
+    relative_path = repo_info['relative_path']
+    modified = []
+    commands = []
+    for _, changed_paths in get_changed_paths_between(repo_path, rev, rev):
+        for action, path, kind in changed_paths:
+            if kind == 'dir' or not path.startswith(relative_path + '/'):
+                continue
+            target = path[len(relative_path) + 1:]
+            if not _match_path(target, include, exclude):
+                continue
+            if action == 'M':
+                modified.append(target)
+                continue
+            # 新增/替换的文件在上一个版本不存在，删除的文件在该版本不存在，--old/--new 会因找不到一侧而失败，
+            # 改为按该版本的改动比较单个文件，删除的文件以上一个版本作为定位版本
+            peg = rev - 1 if action == 'D' else rev
+            args = svn_client.command('diff', '-c', rev, f'{repo_info["url"]}/{target}@{peg}')
+            commands.append((args, svn_cache.make_key(repo_path, rev, target, "diff -c"), target))
+
+    # --old/--new 形式的diff只比较给出的相对路径，其余文件不会经过网络
+    for i in range(0, len(modified), DIFF_TARGETS_PER_COMMAND):
+        batch = modified[i:i + DIFF_TARGETS_PER_COMMAND]
+        args = svn_client.command('diff', f'--old={repo_info["url"]}@{rev - 1}', f'--new={repo_info["url"]}@{rev}',
+                                  *batch)
+        commands.append((args, svn_cache.make_key(repo_path, rev, '\n'.join(batch), "diff"), None))
+    return commands
+
+def _rename_single_target(lines, target):
+    """
+    比较单个文件URL时svn输出的路径只有文件名，改为相对于仓库路径的target，
+    只替换文件头中的路径，不改动改动块的内容
+    """
+    if target is None:
+        yield from lines
+        return
+    in_header = False
     for line in lines:
-        if line.startswith('Index: ') and line.endswith('.lua'):
-            current_file = line[7:]
-            lua_diffs.append(f"Changes in {current_file}:\n")
-        elif current_file:
-            lua_diffs.append(line)
-    return '\n'.join(lua_diffs)
+        text = line.rstrip('\r\n')
+        newline = line[len(text):]
+        if text.startswith('Index: '):
+            in_header = True
+            line = f"Index: {target}{newline}"
+        elif text.startswith('Property changes on: '):
+            line = f"Property changes on: {target}{newline}"
+        elif in_header and text.startswith(('--- ', '+++ ')):
+            _, tab, rest = text[4:].partition('\t')
+            line = f"{text[:4]}{target}{tab}{rest}{newline}"
+        elif text.startswith('@@'):
+            in_header = False
+        yield line
+
+def iter_svn_diff(repo_path, revision, include=None, exclude=None, max_file_bytes=None):
+    """
+    获取指定SVN修订版本的差异，直接从子进程管道逐行解析，逐个产出 svn_diff.FileDiff，
+    不把整个diff读入内存
+
+    Args:
+        repo_path (str): 仓库路径
+        revision (str): 修订版本号，如 r123
+        include (list): 需要的文件通配符，如 ['*.lua']，为空表示全部
+        exclude (list): 排除的文件通配符，如 UNITY_ASSET_PATTERNS
+        max_file_bytes (int): 单个文件diff的字节上限，超出部分截断
+
+    指定include/exclude时先通过 svn log -v 得到改动路径，只向服务器请求匹配的文件，
+    输出中的路径相对于repo_path。设置了 SVN_MIRROR_DIR 时从本地镜像读取
+    """
+    mirror = svn_mirror.get_mirror(repo_path)
+    if mirror is not None:
+        yield from parse_diff(mirror.iter_diff(revision, lambda path: _match_path(path, include, exclude)),
+                              max_file_bytes)
+        return
+    for args, cache_key, target in _diff_commands(repo_path, revision, include, exclude):
+        yield from parse_diff(_rename_single_target(svn_client.iter_lines(args, cache_key), target), max_file_bytes)
 
 def get_commit_message(repo_path, revision):
     """获取提交日志"""
-    cmd = f'svn log -r {revision} {repo_path} {os.environ["USER_INFO"]}'
-    return run_command(cmd)
+    return svn_log.format_verbose(
+        svn_log.iter_svn_log(repo_path, revision, verbose=False)
+    )
 
+def analyze_with_openai(diff_content, commit_message, current_file, rate_limiter=None):
+    """
+    使用OpenAI API分析差异和提交信息，rate_limiter用于并发审查时的RPM/TPM限流
 
-def analyze_with_openai(diff_content, commit_message, current_file):
-    """使用OpenAI API分析差异和提交信息"""
+    Returns:
+        ChatResult: content 为回答原文，用于保存；marked_content 在来自缓存时注明生成时间，用于输出和发送
+    """
     
     # 从文件加载提示词模板
     prompt_file_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts", "lua_review_prompt.txt")
@@ -84,80 +180,241 @@ def analyze_with_openai(diff_content, commit_message, current_file):
     template = Template(prompt_template)
     prompt = template.safe_substitute(variables)
     
-    client = OpenAI(
-        base_url=os.environ["OPENAI_API_BASE"],
-        api_key=os.environ["OPENAI_API_KEY"],
-    )
-    print(os.environ["OPENAI_API_BASE"])
-    print(os.environ["OPENAI_API_KEY"])
-    print(os.environ["OPENAI_MODEL"])
-    response = client.chat.completions.create(
-        model=os.environ["OPENAI_MODEL"],
+    result = gateway.complete(
         messages=[
             {"role": "system", "content": "You are a code review assistant specialized in Lua programming."},
             {"role": "user", "content": prompt}
         ],
+        model=os.environ["OPENAI_MODEL"],
+        base_url=os.environ["OPENAI_API_BASE"],
+        api_key=os.environ["OPENAI_API_KEY"],
+        rate_limiter=rate_limiter,
         temperature=0.7,
         max_tokens=4096,
         top_p=1.0,
     )
+    return result
 
-    return response.choices[0].message.content
+@lru_cache(maxsize=None)
+def get_repo_info(repo_path):
+    """
+    获取仓库路径对应的URL、仓库根地址和相对路径
 
-def get_revisions_between(repo_path, start_rev, end_rev):
-    """获取两个版本之间的所有提交记录"""
-    cmd = f'svn log -r {start_rev}:{end_rev} {repo_path} {os.environ["USER_INFO"]}'
-    log_content = run_command(cmd)
-    
-    # 使用正则表达式解析日志，提取修订版本号
-    revision_pattern = r'^r(\d+) \|'
-    revisions = re.findall(revision_pattern, log_content, re.MULTILINE)
-    return revisions
+    Returns:
+        dict: {'url': 仓库路径的URL, 'root': 仓库根地址, 'relative_path': 如 /trunk/DR22}
+    """
+    try:
+        entry = ET.fromstring(svn_client.run(svn_client.command('info', '--xml', repo_path))).find('entry')
+    except (subprocess.CalledProcessError, ET.ParseError):
+        entry = None
+    if entry is None or not entry.findtext('relative-url'):
+        raise Exception("无法获取SVN相对路径")
+    return {
+        'url': entry.findtext('url').rstrip('/'),
+        'root': entry.findtext('repository/root', '').rstrip('/'),
+        # relative-url 形如 ^/trunk/DR22，去掉开头的 ^
+        'relative_path': entry.findtext('relative-url').lstrip('^').rstrip('/'),
+    }
+
+def get_repo_relative_path(repo_path):
+    """获取仓库路径相对于仓库根目录的路径，例如 /trunk/DR22"""
+    return get_repo_info(repo_path)['relative_path']
+
+def get_changed_paths_between(repo_path, start_rev, end_rev):
+    """
+    通过一次 svn log -v --xml 获取版本范围内每个提交的改动路径
 
-def has_lua_changes(repo_path, revision):
-    """检查某个提交是否包含lua文件的改动"""
-    diff_content = get_svn_diff(repo_path, revision)
-    lua_diff = filter_lua_files(diff_content)
-    return bool(lua_diff.strip())
+    Returns:
+        list: [(修订版本号, [(动作, 路径, 类型), ...]), ...]
+    """
+    return [
+        (entry.revision, [(path.action, path.path, path.kind) for path in entry.changed_paths])
+        for entry in svn_log.iter_svn_log(repo_path, f"{start_rev}:{end_rev}")
+    ]
+
+def is_lua_path(path, relative_path=''):
+    """判断改动路径是否为仓库路径下的lua文件"""
+    if relative_path and not path.startswith(relative_path + '/'):
+        return False
+    return path.endswith('.lua')
 
 def get_lua_revisions(repo_path, start_rev, end_rev):
     """获取包含lua文件改动的所有提交"""
-    all_revisions = get_revisions_between(repo_path, start_rev, end_rev)
+    # 只发起一次 svn log -v --xml，根据改动路径判断，不再逐个提交拉取完整diff
+    relative_path = get_repo_relative_path(repo_path)
+    changed_paths_by_rev = get_changed_paths_between(repo_path, start_rev, end_rev)
     lua_revisions = []
-    
-    print(f"正在检查 {len(all_revisions)} 个提交...")
-    for rev in all_revisions:
-        if has_lua_changes(repo_path, f"r{rev}"):
+
+    print(f"正在检查 {len(changed_paths_by_rev)} 个提交...")
+    for rev, changed_paths in changed_paths_by_rev:
+        if any(kind != 'dir' and is_lua_path(path, relative_path) for _, path, kind in changed_paths):
             lua_revisions.append(f"r{rev}")
             print(f"发现包含lua改动的提交: r{rev}")
-    
+
     return lua_revisions
 
-def send_feishu_notification(analysis):
+def send_feishu_notification(analysis, title="LuaReview"):
     """发送飞书通知"""
     notifier = FeishuNotifier(
         app_id=os.getenv("FEISHU_APP_ID"),
         app_secret=os.getenv("FEISHU_APP_SECRET")
     )
     
-    success, message = notifier.send_simple_card_message(
-        chat_id=os.getenv("FEISHU_LUA_REVIEW_CHAT_ID"),  # luaReview测试群
-        title="LuaReview",
-        content=analysis
-    )
-    
-    # if success:
-    #     print("消息发送成功")
+    # luaReview测试群，多个群用逗号分隔
+    chat_ids = FeishuNotifier.parse_chat_ids(os.getenv("FEISHU_LUA_REVIEW_CHAT_ID"))
+    notifier.send_simple_card_to_chats(chat_ids, title, analysis)
 
-    # else:
-    #     print(f"消息发送失败: {message}")
+def get_current_file_content(repo_path, file_path, revision=None):
+    """获取指定文件的内容，指定revision时读取该版本而不是HEAD，文件不存在时返回空字符串"""
+    try:
+        if revision is None:
+            return svn_client.run_text(svn_client.command('cat', f'{repo_path}/{file_path}'), quiet=True)
+        rev = str(revision).lstrip('r')
+        mirror = svn_mirror.get_mirror(repo_path)
+        if mirror is not None:
+            return svn_client.decode(mirror.cat(file_path, rev))
+        return svn_client.run_text(*_cat_command(repo_path, file_path, rev), quiet=True)
+    except subprocess.CalledProcessError:
+        return ''
 
-def get_current_file_content(repo_path, file_path):
-    """获取指定文件的当前内容"""
-    cmd = f'svn cat {repo_path}/{file_path} {os.environ["USER_INFO"]}'
-    return run_command(cmd)
-    
-def main(repo_path, start_rev, end_rev, send_to_feishu=False):
+def _cat_command(repo_path, file_path, rev):
+    return (svn_client.command('cat', f'{repo_path}/{file_path}@{rev}'),
+            svn_cache.make_key(repo_path, rev, file_path, "cat"))
+
+def fetch_file_contents(repo_path, files, max_workers=None):
+    """
+    并发获取多个文件在指定版本的内容
+
+    Args:
+        repo_path (str): 仓库路径
+        files (list): [(文件路径, 修订版本号), ...]，同一文件出现在多个版本时只取最新版本
+        max_workers (int): 最大并发数，默认读取环境变量 SVN_FETCH_WORKERS，否则为8
+
+    Returns:
+        dict: {文件路径: 文件内容}，顺序与files中首次出现的顺序一致
+    """
+    latest = {}
+    for file_path, revision in files:
+        rev = int(str(revision).lstrip('r'))
+        if file_path not in latest or rev > latest[file_path]:
+            latest[file_path] = rev
+    if not latest:
+        return {}
+
+    if max_workers is None:
+        max_workers = int(os.getenv("SVN_FETCH_WORKERS", 8))
+
+    start = time.perf_counter()
+    mirror = svn_mirror.get_mirror(repo_path)
+    contents = {}
+    timings = []
+    if mirror is not None:
+        for file_path, rev in latest.items():
+            file_start = time.perf_counter()
+            contents[file_path] = get_current_file_content(repo_path, file_path, rev)
+            timings.append(time.perf_counter() - file_start)
+    else:
+        # 互不依赖的 svn cat 通过 asyncio 子进程池并发执行，文件不存在等失败按空内容处理
+        outputs = svn_client.run_many(
+            [_cat_command(repo_path, file_path, rev) for file_path, rev in latest.items()],
+            max_parallel=max_workers, return_exceptions=True, timings=timings
+        )
+        for file_path, output in zip(latest, outputs):
+            contents[file_path] = '' if isinstance(output, Exception) else svn_client.decode(output)
+    for (file_path, rev), elapsed in zip(latest.items(), timings):
+        print(f"获取文件 {file_path}@r{rev} 耗时 {elapsed:.2f}s")
+    print(f"获取 {len(latest)} 个文件共耗时 {time.perf_counter() - start:.2f}s")
+    return contents
+
+
+def review_revision(repo_path, revision, rate_limiter=None):
+    """
+    审查单个提交
+
+    Returns:
+        tuple: (提交信息, 分析结果ChatResult)，只有格式或注释改动时分析结果为None
+    """
+    # 流式解析SVN差异，只请求lua文件，一次遍历同时得到lua差异文本和修改的文件列表
+    lua_file_diffs = []
+    modified_files = []
+    for file_diff in iter_svn_diff(
+        repo_path, revision,
+        include=['*.lua'],
+        max_file_bytes=int(os.getenv("SVN_DIFF_MAX_FILE_KB", 256)) * 1024
+    ):
+        modified_files.append(file_diff.path)
+        if file_diff.is_lua:
+            lua_file_diffs.append(file_diff)
+    lua_diff = '\n'.join(file_diff.render() for file_diff in lua_file_diffs)
+
+    # 并发获取修改的lua文件在该版本的内容，只把改动所在的函数放入上下文
+    lua_files = [file_path for file_path in modified_files if is_lua_path(file_path)]
+    file_contents = fetch_file_contents(repo_path, [(file_path, revision) for file_path in lua_files])
+    commit_message = get_commit_message(repo_path, revision)
+
+    # 比较改动前后的语法树，只有格式/注释改动的提交不调用模型
+    if os.getenv("REVIEW_SKIP_TRIVIAL", "true").lower() == "true":
+        previous_revision = int(str(revision).lstrip('r')) - 1
+        old_contents = fetch_file_contents(repo_path, [(file_path, previous_revision) for file_path in lua_files])
+        level, labels = lua_classifier.classify_files(old_contents, file_contents, lua_files)
+        skip_llm = level == lua_classifier.COSMETIC
+        lua_classifier.stats.record(level, skip_llm)
+        print(f"{revision} 预分类: {level} {labels}")
+        if skip_llm:
+            print(f"{revision} 只有格式或注释改动，跳过AI审查")
+            return commit_message, None
+
+    current_file = build_review_context(lua_file_diffs, file_contents)
+
+    # 使用OpenAI分析
+    analysis = analyze_with_openai(lua_diff, commit_message, current_file, rate_limiter)
+    return commit_message, analysis
+
+def review_revisions(repo_path, revisions, on_result, max_concurrency=None, rate_limiter=None, on_error=None):
+    """
+    并发审查多个提交，审查结果按版本顺序回调on_result(版本号, 提交信息, 分析结果)
+
+    Args:
+        on_error: 审查失败的提交同样按版本顺序回调on_error(版本号, 异常)
+        max_concurrency (int): 同时进行的审查数，默认读取环境变量 REVIEW_MAX_CONCURRENCY，否则为4
+        rate_limiter (RateLimiter): 默认按环境变量 LLM_RPM / LLM_TPM 限流，0或未设置表示不限制
+    """
+    if max_concurrency is None:
+        max_concurrency = int(os.getenv("REVIEW_MAX_CONCURRENCY", 4))
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(int(os.getenv("LLM_RPM", 0)), int(os.getenv("LLM_TPM", 0)))
+
+    results = {}
+    next_index = 0
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {
+            executor.submit(review_revision, repo_path, revision, rate_limiter): i
+            for i, revision in enumerate(revisions)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"审查提交 {revisions[i]} 失败: {e}")
+                results[i] = e
+            # 按版本顺序输出已经完成的结果，前面的提交未完成时先暂存
+            while next_index in results:
+                result = results.pop(next_index)
+                if not isinstance(result, Exception):
+                    on_result(revisions[next_index], *result)
+                elif on_error is not None:
+                    on_error(revisions[next_index], result)
+                next_index += 1
+
+def main(repo_path, start_rev, end_rev, send_to_feishu=False, review_all=False, max_concurrency=None,
+         on_reviewed=None):
+    """
+    审查版本范围内包含lua改动的提交
+
+    Args:
+        on_reviewed: 审查全部提交时，每个提交处理完后按版本顺序回调on_reviewed(版本号, 是否成功)
+    """
     from memory_client import MemoryClient, memory_client
     memory_client = MemoryClient()
     # 获取所有包含lua改动的提交
@@ -166,73 +423,168 @@ def main(repo_path, start_rev, end_rev, send_to_feishu=False):
     if not lua_revisions:
         print("在指定版本范围内没有找到包含lua文件改动的提交。")
         return
-    
-    # 随机选择一个提交进行分析
-    selected_revision = random.choice(lua_revisions)
-    print(f"\n随机选择提交 {selected_revision} 进行分析...")
-    
-    # 获取SVN差异和提交信息
-    diff_content = get_svn_diff(repo_path, selected_revision)
-
 
-    # 从diff内容中提取修改的文件路径
-    modified_files = []
-    for line in diff_content.split('\n'):
-        if line.startswith('Index: '):
-            file_path = line[7:]  # 去掉"Index: "前缀
-            modified_files.append(file_path)
-
-    # 获取所有修改文件的当前内容
-    current_file = ""
-    for file_path in modified_files:
-        current_file += f"\n=== {file_path} ===\n"
-        current_file += get_current_file_content(repo_path, file_path)
-    lua_diff = filter_lua_files(diff_content)
-    commit_message = get_commit_message(repo_path, selected_revision)
-    
-    # 使用OpenAI分析
-    analysis = analyze_with_openai(lua_diff, commit_message, current_file)
-    
-    if analysis:
+    def handle_result(revision, commit_message, analysis):
+        if analysis is None or not analysis.content:
+            print(f"{revision} 没有分析结果")
+            return
         # 获取提交者ID
         committer = commit_message.split("|")[1].strip()
-        # 保存分析结果到Memory
+        # 保存分析结果到Memory，保存回答原文，不带缓存说明
         success, message = memory_client.add_memory(
-            content=analysis,
+            content=analysis.content,
             user_id=committer,
             output_format="code_review"
         )
         if not success:
             print(f"保存分析结果失败: {message}")
-            
-        print("\n分析结果：")
-        print(analysis)
-        
+
+        print(f"\n{revision} 分析结果：")
+        print(analysis.marked_content)
+
         if send_to_feishu:
-            send_feishu_notification(analysis)
+            send_feishu_notification(analysis.marked_content,
+                                     title=f"LuaReview {revision}" if review_all else "LuaReview")
+
+    if review_all:
+        print(f"\n并发审查全部 {len(lua_revisions)} 个提交...")
+        on_result, on_error = handle_result, None
+        if on_reviewed is not None:
+            def on_result(revision, commit_message, analysis):
+                handle_result(revision, commit_message, analysis)
+                on_reviewed(revision, True)
+
+            def on_error(revision, error):
+                on_reviewed(revision, False)
+        review_revisions(repo_path, lua_revisions, on_result, max_concurrency, on_error=on_error)
     else:
-        print("没有分析结果")
-
-def get_last_svn_revision(repo_path):
-    cmd = f'svn info {repo_path} {os.environ["USER_INFO"]}'
-    output = run_command(cmd)
-    # 使用正则表达式提取版本号
-    revision_match = re.search(r'Revision: (\d+)', output)
-    if revision_match:
-        return int(revision_match.group(1))
+        # 随机选择一个提交进行分析
+        selected_revision = random.choice(lua_revisions)
+        print(f"\n随机选择提交 {selected_revision} 进行分析...")
+        handle_result(selected_revision, *review_revision(repo_path, selected_revision))
+
+    cache_stats = svn_cache.stats()
+    print(f"SVN缓存: 命中 {cache_stats['hits']} 次, 未命中 {cache_stats['misses']} 次")
+    classifier_stats = lua_classifier.stats.summary()
+    print(f"预分类: 共 {classifier_stats['total']} 个提交, 格式/注释 {classifier_stats['cosmetic']}, "
+          f"数据 {classifier_stats['data']}, 逻辑 {classifier_stats['logic']}, "
+          f"节省AI调用 {classifier_stats['llm_calls_saved']} 次")
+    llm_stats = gateway.stats()
+    print(f"AI调用: {llm_stats['calls']} 次, 失败 {llm_stats['failures']} 次, "
+          f"平均耗时 {llm_stats['avg_latency']:.2f}s, token {llm_stats['prompt_tokens']}/{llm_stats['completion_tokens']}")
+
+def get_last_svn_revision(repo_path, revision=None):
+    """获取版本号，revision为HEAD时返回服务器上的最新版本而不是工作副本的版本"""
+    if revision == 'HEAD':
+        mirror = svn_mirror.get_mirror(repo_path)
+        if mirror is not None:
+            return mirror.head()
+    revision_args = ['-r', revision] if revision else []
+    output = svn_client.run(svn_client.command('info', '--xml', *revision_args, repo_path))
+    entry = ET.fromstring(output).find('entry')
+    if entry is not None and entry.get('revision'):
+        return int(entry.get('revision'))
     raise Exception("无法获取SVN版本号")
 
+DEFAULT_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".review_state.json")
+
+class RevisionWatermark:
+    """记录每个仓库已处理的最后一个版本号，保存在本地JSON状态文件中"""
+
+    def __init__(self, repo_path, state_path=DEFAULT_STATE_FILE):
+        self.repo_path = repo_path
+        self.state_path = state_path
+
+    def _read_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            # 状态文件损坏时当作没有记录，下次保存时重新写入
+            print(f"状态文件 {self.state_path} 无法解析，忽略已有记录: {e}")
+            return {}
+
+    def load(self):
+        """返回已处理的最后一个版本号，没有记录时返回None"""
+        return self._read_state().get(self.repo_path)
+
+    def save(self, revision):
+        """保存版本号，先写临时文件再替换，进程中途退出也不会损坏状态文件"""
+        state = self._read_state()
+        state[self.repo_path] = int(revision)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+def watch(repo_path, interval=None, state_path=DEFAULT_STATE_FILE, initial_lookback=20,
+          send_to_feishu=False, max_concurrency=None):
+    """
+    常驻运行，定期检查新提交并审查其中所有包含lua改动的提交
+
+    Args:
+        interval (int): 轮询间隔秒数，默认读取环境变量 REVIEW_POLL_INTERVAL，否则为300
+        state_path (str): 保存已处理版本号的状态文件
+        initial_lookback (int): 没有状态记录时，从最新版本往前审查的提交数
+    """
+    if interval is None:
+        interval = int(os.getenv("REVIEW_POLL_INTERVAL", 300))
+    watermark = RevisionWatermark(repo_path, state_path)
+
+    while True:
+        try:
+            head_rev = get_last_svn_revision(repo_path, "HEAD")
+            last_rev = watermark.load()
+            if last_rev is None:
+                last_rev = head_rev - initial_lookback
+            if head_rev > last_rev:
+                print(f"发现新提交 r{last_rev + 1} - r{head_rev}")
+                failed = []
+
+                def on_reviewed(revision, success):
+                    # 按版本顺序推进已处理的版本号，遇到第一个失败的提交后不再推进，下一轮从它开始重新处理
+                    if not success:
+                        failed.append(revision)
+                    elif not failed:
+                        watermark.save(str(revision).lstrip('r'))
+
+                main(repo_path, str(last_rev + 1), str(head_rev), send_to_feishu=send_to_feishu,
+                     review_all=True, max_concurrency=max_concurrency, on_reviewed=on_reviewed)
+                if failed:
+                    print(f"提交 {', '.join(failed)} 审查失败，下一轮从 {failed[0]} 重新处理")
+                else:
+                    # 范围内剩下的都是没有lua改动的提交
+                    watermark.save(head_rev)
+        except Exception as e:
+            print(f"检查新提交失败: {e}")
+        time.sleep(interval)
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='SVN Lua提交审查工具')
+    parser.add_argument('--all', action='store_true', help='审查范围内所有包含lua改动的提交，而不是随机选择一个')
+    parser.add_argument('--concurrency', type=int, default=None, help='同时进行的审查数（默认4）')
+    parser.add_argument('--watch', action='store_true', help='常驻运行，只审查上次处理之后的新提交')
+    parser.add_argument('--interval', type=int, default=None, help='常驻模式的轮询间隔秒数（默认300）')
+    parser.add_argument('--state-file', default=DEFAULT_STATE_FILE, help='常驻模式保存已处理版本号的文件')
+    parser.add_argument('--no-ai-cache', action='store_true', help='不使用缓存的AI回答，重新生成')
+    args = parser.parse_args()
+    if args.no_ai_cache:
+        os.environ["LLM_CACHE_BYPASS"] = "true"
+
     os.environ["OPENAI_API_KEY"] = os.getenv("AI_API_KEY")
     os.environ["OPENAI_API_BASE"] = os.getenv("AI_API_BASE")
     os.environ["OPENAI_MODEL"] = os.getenv("AI_MODEL")
     os.environ["USER_INFO"] = f" --non-interactive --trust-server-cert"
     os.environ["MEM0_API_KEY"] = os.getenv("MEM0_API_KEY")
     repo_path = "C:/hanjiajianghu2/DR22"
+    if args.watch:
+        watch(repo_path, args.interval, args.state_file, send_to_feishu=True, max_concurrency=args.concurrency)
     # 然后再获取版本号
     end_rev = get_last_svn_revision(repo_path)
     start_rev = end_rev - 20
     # 转string
     start_rev = str(start_rev)
     end_rev = str(end_rev)
-    main(repo_path, start_rev, end_rev, send_to_feishu=True)
\ No newline at end of file
+    main(repo_path, start_rev, end_rev, send_to_feishu=True, review_all=args.all, max_concurrency=args.concurrency)
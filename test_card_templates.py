@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+from card_templates import CardTemplate, CardTemplateRegistry
+
+ALERT_VARIABLES = {
+    "title": "1 级报警 - 数据平台",
+    "time": datetime(2021, 2, 23, 20, 17, 51),
+    "event_id": "336720",
+    "project": "QA 7",
+    "primary_on_duty": "all",
+    "secondary_on_duty": ["ou_1", "ou_2"],
+    "image_key": "img_v2_abc",
+    "description": "支付方式 支付成功率低于 50%：",
+    "button_label": "跟进处理",
+}
+
+
+class CardTemplatesTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = CardTemplateRegistry()
+
+    def test_alert_card(self):
+        card = json.loads(self.registry.render("alert", **ALERT_VARIABLES))
+        fields = [field["text"]["content"] for field in card["elements"][0]["fields"]]
+        self.assertEqual([
+            "**🕐 时间：**\n2021-02-23 20:17:51",
+            "**🔢 事件 ID：**\n336720",
+            "**📋 项目：**\nQA 7",
+            "**👤 一级值班：**\n<at id=all>所有人</at>",
+            "**👤 二级值班：**\n<at id=ou_1></at> <at id=ou_2></at>",
+        ], fields)
+        self.assertEqual("img_v2_abc", card["elements"][1]["img_key"])
+        button = card["elements"][3]["actions"][0]
+        self.assertEqual("跟进处理", button["text"]["content"])
+        self.assertEqual({"key": "follow", "event_id": "336720"}, button["value"])
+
+    def test_values_are_escaped(self):
+        variables = dict(ALERT_VARIABLES, project='引号"和\\反斜杠\n换行', event_id="${title}")
+        card = json.loads(self.registry.render("alert", **variables))
+        self.assertEqual('**📋 项目：**\n引号"和\\反斜杠\n换行', card["elements"][0]["fields"][2]["text"]["content"])
+        self.assertEqual("**🔢 事件 ID：**\n${title}", card["elements"][0]["fields"][1]["text"]["content"])
+
+    def test_render_cache(self):
+        first = self.registry.render("alert", **ALERT_VARIABLES)
+        second = self.registry.render("alert", **dict(ALERT_VARIABLES, time=ALERT_VARIABLES["time"].timestamp()))
+        self.assertIs(first, second)
+        self.assertEqual(1, self.registry.cache_info().hits)
+        third = self.registry.render("alert", **dict(ALERT_VARIABLES, button_label="跟进中"))
+        self.assertNotEqual(first, third)
+
+    def test_variables_are_checked(self):
+        variables = dict(ALERT_VARIABLES)
+        del variables["project"]
+        with self.assertRaises(ValueError):
+            self.registry.render("alert", **variables)
+        with self.assertRaises(ValueError):
+            self.registry.render("alert", extra="x", **ALERT_VARIABLES)
+        with self.assertRaises(TypeError):
+            self.registry.render("alert", **dict(ALERT_VARIABLES, time="昨天"))
+        with self.assertRaises(ValueError):
+            CardTemplate("bad", {"variables": {}, "card": {"text": "${name}"}})
+
+    def test_loads_directory_once(self):
+        tmp = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(tmp, 'hello.json'), 'w', encoding='utf-8') as f:
+                json.dump({"variables": {"name": "text"}, "card": {"text": "你好 ${name}！"}}, f)
+            registry = CardTemplateRegistry(tmp)
+            self.assertEqual('{"text":"你好 小明！"}', registry.render_str("hello", name="小明"))
+            os.remove(os.path.join(tmp, 'hello.json'))
+            self.assertEqual('{"text":"你好 小红！"}', registry.render_str("hello", name="小红"))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date
+
+from day_shards import DayShardStore
+
+
+class DayShardStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_shard_roundtrip(self):
+        store = DayShardStore("svn://example/repo", self.root)
+        day = date(2024, 1, 1)
+        self.assertIsNone(store.load(day))
+        store.save(day, {"date": "2024-01-01", "summary": "提交总结"})
+        self.assertEqual("提交总结", DayShardStore("svn://example/repo", self.root).load(day)["summary"])
+        self.assertFalse(any(name.endswith('.tmp') for name in os.listdir(store.directory)))
+
+    def test_revision_mapping(self):
+        store = DayShardStore("svn://example/repo", self.root)
+        store.set_revision(date(2024, 1, 1), 100)
+        store.set_revision(date(2024, 1, 2), 120)
+        self.assertEqual(100, store.get_revision(date(2024, 1, 1)))
+        self.assertEqual(120, store.get_revision(date(2024, 1, 2)))
+        self.assertIsNone(store.get_revision(date(2024, 1, 3)))
+
+    def test_repositories_are_separate(self):
+        DayShardStore("svn://example/a", self.root).set_revision(date(2024, 1, 1), 1)
+        self.assertIsNone(DayShardStore("svn://example/b", self.root).get_revision(date(2024, 1, 1)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from feishu_notifier import AsyncFeishuNotifier, FeishuNotifier
+from feishu_outbox import FeishuOutbox
+from feishu_transport import AsyncFeishuTransport
+
+
+class FakeFeishu:
+    """httpx.MockTransport 的处理函数，记录同时进行的请求数，fail 中的群返回错误，前 limited 次请求返回429"""
+
+    def __init__(self, fail=(), limited=0):
+        self.fail = set(fail)
+        self.limited = limited
+        self.active = 0
+        self.max_active = 0
+        self.requests = []
+
+    async def __call__(self, request):
+        body = json.loads(request.content)
+        self.requests.append(body)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            self.active -= 1
+        if self.limited > 0:
+            self.limited -= 1
+            return httpx.Response(429, json={"code": 99991400, "msg": "frequency limit"}, headers={"Retry-After": "0"})
+        if body["receive_id"] in self.fail:
+            return httpx.Response(400, json={"code": 230002, "msg": "bot not in chat"})
+        return httpx.Response(200, json={"code": 0, "data": {"message_id": f"om_{body['receive_id']}"}})
+
+
+class AsyncFeishuNotifierTest(unittest.TestCase):
+    def run_notifier(self, feishu, coroutine, **kwargs):
+        async def run():
+            transport = AsyncFeishuTransport(max_retries=2, backoff_factor=0)
+            await transport.client.aclose()
+            transport.client = httpx.AsyncClient(transport=httpx.MockTransport(feishu))
+            async with AsyncFeishuNotifier("test_app", "secret", transport=transport, **kwargs) as notifier:
+                notifier.token_manager.token = "token"
+                notifier.token_manager.expires_at = time.time() + 7200
+                return await coroutine(notifier)
+
+        return asyncio.run(run())
+
+    def test_broadcast_is_bounded_and_aggregated(self):
+        feishu = FakeFeishu(fail=["oc_5"])
+        chat_ids = [f"oc_{i}" for i in range(6)] + ["oc_0"]
+
+        async def broadcast(notifier):
+            # 只计广播本身的耗时，不包括创建客户端加载证书的时间
+            start = time.monotonic()
+            results = await notifier.broadcast(chat_ids, {"type": "template"})
+            return results, time.monotonic() - start
+
+        results, elapsed = self.run_notifier(feishu, broadcast, max_concurrency=3)
+        self.assertEqual([f"oc_{i}" for i in range(6)], list(results))
+        self.assertEqual(5, sum(success for success, _ in results.values()))
+        self.assertFalse(results["oc_5"][0])
+        self.assertIn("230002", results["oc_5"][1])
+        self.assertEqual(3, feishu.max_active)
+        self.assertLess(elapsed, 0.3)
+
+    def test_retries_rate_limited_request(self):
+        feishu = FakeFeishu(limited=2)
+        success, _ = self.run_notifier(feishu, lambda notifier: notifier.send_text_message("oc_1", "hi"))
+        self.assertTrue(success)
+        self.assertEqual(3, len(feishu.requests))
+        self.assertEqual(1, len({body["uuid"] for body in feishu.requests}))
+
+
+class FeishuNotifierBroadcastTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.notifier = FeishuNotifier("test_app", "secret", use_outbox=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_parse_chat_ids(self):
+        self.assertEqual(["oc_1", "oc_2"], FeishuNotifier.parse_chat_ids(" oc_1, ,oc_2,oc_1 "))
+        self.assertEqual([], FeishuNotifier.parse_chat_ids(None))
+
+    def test_broadcast_enqueues_one_message_per_chat(self):
+        self.notifier.outbox = FeishuOutbox(os.path.join(self.tmp, 'outbox.sqlite3'))
+        results = self.notifier.broadcast(["oc_1", "oc_2", "oc_1"], {"type": "template"})
+        self.assertEqual(["oc_1", "oc_2"], list(results))
+        self.assertTrue(all(success for success, _ in results.values()))
+        self.assertEqual({"pending": 2}, self.notifier.outbox.counts())
+
+    def test_build_messages_get_unique_keys(self):
+        self.notifier.outbox = FeishuOutbox(os.path.join(self.tmp, 'outbox.sqlite3'))
+        with patch.dict(os.environ, {"FEISHU_BUILD_NOTIFY_CHAT_ID": "oc_1"}):
+            os.environ.pop("BUILD_TAG", None)
+            os.environ.pop("BUILD_URL", None)
+            first = self.notifier.send_build_message("", "", "成功", "", "log 1", "")
+            second = self.notifier.send_build_message("", "", "成功", "", "log 2", "")
+        self.assertTrue(first[0] and second[0])
+        self.assertNotEqual(first[1], second[1])
+        self.assertEqual({"pending": 2}, self.notifier.outbox.counts())
+
+    def test_broadcast_without_outbox_refuses_running_loop(self):
+        async def run():
+            return self.notifier.broadcast(["oc_1", "oc_2"], {"type": "template"})
+
+        with self.assertRaises(RuntimeError):
+            asyncio.run(run())
+
+
+if __name__ == '__main__':
+    unittest.main()
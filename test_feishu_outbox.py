@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from feishu_outbox import FeishuOutbox, IdempotencyConflict, OutboxDispatcher
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, body=None, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body if body is not None else {"code": 0, "data": {}}
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeFeishu:
+    """记录请求的假发送函数，responses 中的响应依次返回，用完后都返回成功"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, method, path, payload, params):
+        self.calls.append((method, path, payload, time.monotonic()))
+        if self.responses:
+            return self.responses.pop(0)
+        return FakeResponse(body={"code": 0, "data": {"message_id": f"om_{len(self.calls)}"}})
+
+
+def card(chat_id, text):
+    return {"receive_id": chat_id, "msg_type": "text", "content": text}
+
+
+class FeishuOutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.outbox = FeishuOutbox(os.path.join(self.tmp, 'outbox.sqlite3'))
+        self.dispatchers = []
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.stop()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make(self, send, **kwargs):
+        dispatcher = OutboxDispatcher(self.outbox, **kwargs)
+        dispatcher.senders["app"] = send
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def test_enqueue_is_idempotent(self):
+        self.outbox.enqueue_message("app", card("oc_1", "a"), key="build:job:1")
+        self.outbox.enqueue_message("app", card("oc_1", "a"), key="build:job:1")
+        self.assertEqual({"pending": 1}, self.outbox.counts())
+        # 相同的键用于不同的内容时报错，不能当作已经写入
+        with self.assertRaises(IdempotencyConflict):
+            self.outbox.enqueue_message("app", card("oc_1", "b"), key="build:job:1")
+        self.assertEqual({"pending": 1}, self.outbox.counts())
+        feishu = FakeFeishu()
+        self.make(feishu).run_once()
+        self.assertEqual(1, len(feishu.calls))
+        self.assertEqual("a", feishu.calls[0][2]["content"])
+        self.assertIn("uuid", feishu.calls[0][2])
+
+    def test_retries_rate_limited_send(self):
+        key = self.outbox.enqueue_message("app", card("oc_1", "a"))
+        feishu = FakeFeishu(FakeResponse(429, {"code": 99991400, "msg": "frequency limit"}, {"Retry-After": "0"}))
+        dispatcher = self.make(feishu)
+        with patch('feishu_outbox.backoff_delay', return_value=0):
+            dispatcher.run_once()
+            self.assertEqual(1, self.outbox.get(key)["attempts"])
+            dispatcher.run_once()
+        row = self.outbox.get(key)
+        self.assertEqual('sent', row["status"])
+        self.assertEqual("om_2", row["message_id"])
+
+    def test_client_error_is_not_retried(self):
+        key = self.outbox.enqueue_message("app", card("oc_1", "a"))
+        self.make(FakeFeishu(FakeResponse(400, {"code": 230001, "msg": "invalid receive_id"}))).run_once()
+        row = self.outbox.get(key)
+        self.assertEqual('failed', row["status"])
+        self.assertIn("230001", row["last_error"])
+
+    def test_update_waits_for_message_and_keeps_latest(self):
+        key = self.outbox.enqueue_message("app", card("oc_1", "a"))
+        self.outbox.enqueue_update("app", key, {"content": "v1"})
+        latest = self.outbox.enqueue_update("app", key, {"content": "v2"})
+        self.assertEqual({"pending": 2, "superseded": 1}, self.outbox.counts())
+        feishu = FakeFeishu(FakeResponse(500, {}))
+        dispatcher = self.make(feishu)
+        with patch('feishu_outbox.backoff_delay', return_value=0):
+            dispatcher.run_once()  # 消息发送失败，更新需要等待
+            self.assertEqual(1, len(feishu.calls))
+            dispatcher.run_once()
+            dispatcher.run_once()
+        self.assertEqual('sent', self.outbox.get(latest)["status"])
+        self.assertEqual([('POST', '/im/v1/messages'), ('POST', '/im/v1/messages'), ('PATCH', '/im/v1/messages/om_2')],
+                         [call[:2] for call in feishu.calls])
+
+    def test_failed_update_does_not_overwrite_newer_one(self):
+        key = self.outbox.enqueue_message("app", card("oc_1", "a"))
+        dispatcher = self.make(FakeFeishu())
+        dispatcher.run_once()
+        first = self.outbox.enqueue_update("app", key, {"content": "v1"})
+        calls = []
+
+        def send(method, path, payload, params):
+            calls.append(payload["content"])
+            if payload["content"] == "v1":
+                # v1 发送期间写入 v2，随后 v1 返回500
+                self.outbox.enqueue_update("app", key, {"content": "v2"})
+                return FakeResponse(500, {})
+            return FakeResponse()
+
+        dispatcher.senders["app"] = send
+        with patch('feishu_outbox.backoff_delay', return_value=0):
+            for _ in range(3):
+                dispatcher.run_once()
+        self.assertEqual(["v1", "v2"], calls)
+        self.assertEqual('superseded', self.outbox.get(first)["status"])
+
+    def test_bad_rows_fail_without_stopping_dispatch(self):
+        key = self.outbox.enqueue_message("app", card("oc_1", "a"))
+        update = self.outbox.enqueue_update("app", key, {"content": "v1"})
+        broken = self.outbox.enqueue_message("app", card("oc_2", "b"))
+        after = self.outbox.enqueue_message("app", card("oc_3", "c"))
+        with self.outbox._transaction() as conn:
+            conn.execute("UPDATE messages SET payload = 'not json' WHERE idempotency_key = ?", (broken,))
+        # 飞书返回成功但没有消息ID，之后的更新无法发送
+        feishu = FakeFeishu(FakeResponse(body={"code": 0, "data": {}}))
+        dispatcher = self.make(feishu)
+        dispatcher.run_once()
+        dispatcher.run_once()
+        self.assertEqual('failed', self.outbox.get(update)["status"])
+        self.assertEqual('failed', self.outbox.get(broken)["status"])
+        self.assertEqual('sent', self.outbox.get(after)["status"])
+
+    def test_chat_rate_smooths_bursts(self):
+        for i in range(8):
+            self.outbox.enqueue_message("app", card("oc_busy", str(i)))
+        self.outbox.enqueue_message("app", card("oc_quiet", "x"))
+        feishu = FakeFeishu()
+        dispatcher = self.make(feishu, chat_rate=5)
+        start = time.monotonic()
+        while self.outbox.counts().get('pending'):
+            time.sleep(dispatcher.run_once())
+        busy = [call[3] - start for call in feishu.calls if call[2]["receive_id"] == "oc_busy"]
+        quiet = [call[3] - start for call in feishu.calls if call[2]["receive_id"] == "oc_quiet"]
+        self.assertEqual(list(map(str, range(8))),
+                         [call[2]["content"] for call in feishu.calls if call[2]["receive_id"] == "oc_busy"])
+        self.assertGreaterEqual(busy[-1], 0.5)
+        self.assertLess(quiet[0], 0.2)
+
+    def test_only_lease_holder_sends(self):
+        self.outbox.enqueue_message("app", card("oc_1", "a"))
+        first, second = FakeFeishu(), FakeFeishu()
+        self.assertTrue(self.outbox.acquire_lease("app", "other-process"))
+        self.make(second).run_once()
+        self.assertEqual([], second.calls)
+        self.outbox.release_lease("app", "other-process")
+        self.make(first).run_once()
+        self.assertEqual(1, len(first.calls))
+
+    def test_flush_waits_for_dispatcher(self):
+        self.outbox.enqueue_message("app", card("oc_1", "a"))
+        feishu = FakeFeishu()
+        dispatcher = self.make(feishu)
+        dispatcher.senders.clear()
+        dispatcher.register("app", feishu)
+        self.assertTrue(dispatcher.flush(timeout=5))
+        self.assertEqual(1, len(feishu.calls))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from feishu_token import TenantTokenManager
+
+
+class FakeTokenManager(TenantTokenManager):
+    """用计数的假接口代替飞书接口"""
+
+    def __init__(self, *args, expire=7200, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.expire = expire
+        self.issued = 0
+
+    def _fetch(self):
+        time.sleep(0.05)
+        self.issued += 1
+        self.fetches += 1
+        return f"token-{self.app_id}-{self.issued}", time.time() + self.expire
+
+
+class TenantTokenManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp, 'token.json')
+        self.managers = []
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.close()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def make(self, app_id="app", **kwargs):
+        manager = FakeTokenManager(app_id, "secret", cache_file=self.cache_file, refresh_margin=600, **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def test_cached_in_memory(self):
+        manager = self.make()
+        self.assertEqual(manager.get_token(), manager.get_token())
+        self.assertEqual(1, manager.fetches)
+
+    def test_concurrent_refreshes_coalesce(self):
+        manager = self.make()
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.get_token())) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, manager.fetches)
+        self.assertEqual(1, len(set(tokens)))
+
+    def test_shared_across_processes_through_file(self):
+        first = self.make()
+        second = self.make()
+        self.assertEqual(first.get_token(), second.get_token())
+        self.assertEqual(0, second.fetches)
+        if os.name != 'nt':
+            self.assertEqual(0o600, os.stat(self.cache_file).st_mode & 0o777)
+
+    def test_token_inside_margin_is_refreshed(self):
+        manager = self.make(expire=300)
+        first = manager.get_token()
+        self.assertNotEqual(first, manager.get_token())
+        self.assertEqual(2, manager.fetches)
+
+    def test_force_refresh_skips_cached_token(self):
+        first = self.make()
+        token = first.get_token()
+        self.assertNotEqual(token, first.refresh(force=True))
+        self.assertEqual(2, first.fetches)
+
+
+if __name__ == '__main__':
+    unittest.main()
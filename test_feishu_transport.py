@@ -0,0 +1,81 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from feishu_transport import FeishuTransport
+
+
+class FakeFeishuHandler(BaseHTTPRequestHandler):
+    """支持长连接的假飞书接口，前 fail_times 次请求返回429"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        server.bodies.append(json.loads(self.rfile.read(length) or b'{}'))
+        if server.fail_times > 0:
+            server.fail_times -= 1
+            self.reply(429, {"code": 99991400, "msg": "request trigger frequency limit"}, {"Retry-After": "0"})
+        else:
+            self.reply(200, {"code": 0, "data": {"message_id": "om_1"}})
+
+    do_PATCH = do_POST
+
+    def reply(self, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeishuTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeFeishuHandler)
+        self.server.fail_times = 0
+        self.server.bodies = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        base_url = f"http://127.0.0.1:{self.server.server_address[1]}/open-apis"
+        self.transport = FeishuTransport(base_url, pool_size=2, max_retries=3, backoff_factor=0)
+
+    def tearDown(self):
+        self.transport.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_file_upload_uses_multipart_content_type(self):
+        self.assertNotIn("Content-Type", FeishuTransport.headers('t', files=True))
+        self.assertIn("Content-Type", FeishuTransport.headers('t'))
+
+    def test_connection_reused(self):
+        for _ in range(5):
+            response = self.transport.request('POST', '/im/v1/messages', token='t', json={"a": 1})
+            self.assertEqual(200, response.status_code)
+        stats = self.transport.stats()
+        self.assertEqual(5, stats["requests"])
+        self.assertEqual(1, stats["connections"])
+        self.assertEqual(4, stats["reused"])
+
+    def test_retry_on_429(self):
+        self.server.fail_times = 2
+        response = self.transport.request('PATCH', '/im/v1/messages/om_1', json={"content": "x"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(self.server.bodies))
+        self.assertEqual(2, self.transport.stats()["retries"])
+
+    def test_gives_up_after_max_retries(self):
+        self.server.fail_times = 10
+        response = self.transport.request('POST', '/im/v1/messages', json={})
+        self.assertEqual(429, response.status_code)
+        self.assertEqual(4, len(self.server.bodies))
+
+
+if __name__ == '__main__':
+    unittest.main()
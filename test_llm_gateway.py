@@ -0,0 +1,156 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import httpx
+import openai
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_cache import ResponseCache
+from llm_gateway import ChatResult, LLMGateway
+
+
+def connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://llm/chat/completions"))
+
+
+def chunk(text):
+    return SimpleNamespace(usage=None, choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """按顺序返回 responses 中的结果，异常直接抛出，可迭代对象作为流式响应"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def create(self, **kwargs):
+        self.calls.append(kwargs)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def stream_of(*items):
+    """流式响应，items 中的异常在迭代到该位置时抛出"""
+    for item in items:
+        if isinstance(item, Exception):
+            raise item
+        yield chunk(item)
+
+
+class TestLLMGateway(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.gateway = LLMGateway(max_retries=3)
+        self.completions = FakeCompletions()
+        client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        self.gateway._clients[("http://llm", "key")] = client
+        self.patchers = [patch('rate_limit.backoff_delay', return_value=0), patch('builtins.print')]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def stream(self):
+        deltas = []
+        content = self.gateway.stream([{"role": "user", "content": "hi"}], deltas.append, model="m",
+                                      base_url="http://llm", api_key="key")
+        return content, deltas
+
+    def test_stream_retries_before_first_token(self):
+        """收到第一个token之前的错误会重试"""
+        self.completions.responses = [connection_error(), stream_of("你", "好")]
+        content, deltas = self.stream()
+        self.assertEqual("你好", content)
+        self.assertEqual(["你", "你好"], deltas)
+        self.assertEqual(2, len(self.completions.calls))
+        self.assertEqual(2, self.gateway.stats()["attempts"])
+
+    def test_stream_records_usage_from_final_chunk(self):
+        """流式调用请求附带用量，最后一个分块的用量计入统计"""
+        usage = SimpleNamespace(usage=SimpleNamespace(prompt_tokens=12, completion_tokens=34), choices=[])
+        self.completions.responses = [iter([chunk("你"), chunk("好"), usage])]
+        self.stream()
+        self.assertEqual({"include_usage": True}, self.completions.calls[0]["stream_options"])
+        stats = self.gateway.stats()
+        self.assertEqual((12, 34), (stats["prompt_tokens"], stats["completion_tokens"]))
+
+    def test_stream_estimates_usage_when_not_returned(self):
+        """服务端没有返回用量时按文本估算，不记为0"""
+        self.completions.responses = [stream_of("hello world")]
+        self.stream()
+        stats = self.gateway.stats()
+        self.assertGreater(stats["prompt_tokens"], 0)
+        self.assertEqual(3, stats["completion_tokens"])
+
+    def test_stream_does_not_retry_after_first_token(self):
+        """收到token之后中断时直接抛出，不重新请求，避免重复输出"""
+        self.completions.responses = [stream_of("你", connection_error()), stream_of("不应发生")]
+        with self.assertRaises(openai.APIConnectionError):
+            self.stream()
+        self.assertEqual(1, len(self.completions.calls))
+        self.assertEqual(1, self.gateway.stats()["failures"])
+
+
+class TestChatResult(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.cache_dir, ttl=3600)
+        self.gateway = LLMGateway(max_retries=0)
+        message = SimpleNamespace(message=SimpleNamespace(content="回答"))
+        self.completions = FakeCompletions(SimpleNamespace(choices=[message], usage=None))
+        client = SimpleNamespace(chat=SimpleNamespace(completions=self.completions))
+        self.gateway._clients[("http://llm", "key")] = client
+        self.patchers = [patch('llm_cache.get_default_cache', return_value=self.cache), patch('builtins.print')]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def complete(self):
+        return self.gateway.complete([{"role": "user", "content": "hi"}], model="m", base_url="http://llm",
+                                     api_key="key", bypass_cache=False, temperature=0)
+
+    def test_marked_content_equals_content_when_not_cached(self):
+        """新生成的回答不加缓存说明"""
+        result = self.complete()
+        self.assertFalse(result.cached)
+        self.assertEqual("回答", result.content)
+        self.assertEqual(result.content, result.marked_content)
+
+    def test_cached_result_only_differs_in_marked_content(self):
+        """命中缓存时 content 与原回答相同，只有 marked_content 注明生成时间"""
+        first = self.complete()
+        second = self.complete()
+        self.assertEqual(1, len(self.completions.calls))
+        self.assertTrue(second.cached)
+        self.assertEqual(first.content, second.content)
+        self.assertNotEqual(second.content, second.marked_content)
+        self.assertTrue(second.marked_content.startswith(second.content + "\n\n"))
+        created = time.strftime("%Y-%m-%d", time.localtime(second.created))
+        self.assertIn(created, second.marked_content)
+
+    def test_marked_content_format(self):
+        """缓存说明的格式"""
+        result = ChatResult(content="a", cached=True, created=0)
+        self.assertRegex(result.marked_content, r"^a\n\n\(缓存结果，生成于 \d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}\)$")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+
+import svn_log
+from log_compactor import compact_log
+from log_summarizer import chunk_entries, split_log_entries
+from svn_log import SEPARATOR, ChangedPath, LogEntry
+
+LOG = f"""{SEPARATOR}
+r101 | alice | 2024-01-01 10:00:00 +0800 (周一, 01 1月 2024) | 1 line
+Changed paths:
+   M /trunk/DR22/Assets/Lua/ui/login.lua
+   A /trunk/DR22/Assets/Art/icons/a.png
+   A /trunk/DR22/Assets/Art/icons/a.png.meta
+   A /trunk/DR22/Assets/Art/icons/b.png
+   A /trunk/DR22/Assets/Art/icons/b.png.meta
+   A /trunk/DR22/Assets/Art/icons/c.png
+
+新增登录图标
+{SEPARATOR}
+r102 | bob | 2024-01-01 11:00:00 +0800 (周一, 01 1月 2024) | 1 line
+Changed paths:
+   M /trunk/DR22/Assets/Art/icons/a.png.meta
+
+改图片导入设置
+{SEPARATOR}
+"""
+
+
+class LogCompactorTest(unittest.TestCase):
+    def setUp(self):
+        self.result = compact_log(LOG)
+
+    def test_common_prefix_stated_once(self):
+        self.assertTrue(self.result.text.startswith(f"{SEPARATOR}\n以下路径省略公共前缀 /trunk/DR22\nr101 | alice"))
+        self.assertEqual(1, self.result.text.count("以下路径省略公共前缀"))
+        self.assertNotIn("   M /trunk/DR22/", self.result.text)
+
+    def test_prefix_stays_with_first_chunk(self):
+        # 公共前缀的说明属于第一条记录，分块时不会单独成为一条记录
+        entries = split_log_entries(self.result.text)
+        self.assertEqual(2, len(entries))
+        self.assertTrue(entries[0].startswith("以下路径省略公共前缀 /trunk/DR22\nr101 |"))
+        chunks = chunk_entries(entries, 60)
+        self.assertEqual(2, len(chunks))
+        self.assertIn("以下路径省略公共前缀", chunks[0])
+
+    def test_code_paths_keep_detail(self):
+        self.assertIn("   M /Assets/Lua/ui/login.lua", self.result.text)
+
+    def test_assets_collapsed_by_directory(self):
+        self.assertIn("   A /Assets/Art/icons/ (3个文件，其中2个含meta)", self.result.text)
+        self.assertNotIn("b.png", self.result.text)
+
+    def test_missing_meta_flagged(self):
+        self.assertEqual(["r101 /trunk/DR22/Assets/Art/icons/c.png (缺少.meta)"], self.result.missing_meta)
+
+    def test_lone_meta_modification_not_flagged(self):
+        self.assertIn("   M /Assets/Art/icons/a.png.meta", self.result.text)
+        self.assertEqual(1, len(self.result.missing_meta))
+
+    def test_messages_kept_and_tokens_reduced(self):
+        self.assertIn("新增登录图标", self.result.text)
+        self.assertIn("改图片导入设置", self.result.text)
+        self.assertLess(self.result.tokens_after, self.result.tokens_before)
+
+
+class CompactEntriesTest(unittest.TestCase):
+    def test_records_compact_like_text(self):
+        # 直接压缩 svn_log.LogEntry，结果与压缩对应的文本日志相同
+        entries = [
+            LogEntry("101", "alice", "2024-01-01 10:00:00 +0800", "新增登录图标", [
+                ChangedPath("M", "/trunk/DR22/Assets/Lua/ui/login.lua", "file"),
+                ChangedPath("A", "/trunk/DR22/Assets/Art/icons/a.png", "file"),
+                ChangedPath("A", "/trunk/DR22/Assets/Art/icons/b.png", "file"),
+                ChangedPath("A", "/trunk/DR22/Assets/Art/icons/b.png.meta", "file"),
+            ]),
+            LogEntry("102", "bob", "2024-01-01 11:00:00 +0800", "复制配置", [
+                ChangedPath("A", "/trunk/DR22/Assets/Lua/cfg.lua", "file", "/trunk/DR22/Assets/Lua/old.lua", "100"),
+            ]),
+        ]
+        result = compact_log(entries)
+        self.assertEqual(compact_log(svn_log.format_verbose(entries)).text, result.text)
+        self.assertIn("r101 | alice | 2024-01-01 10:00:00 +0800 | 1 line\nChanged paths:\n", result.text)
+        self.assertIn("   A /Assets/Lua/cfg.lua\n", result.text)
+        self.assertEqual(["r101 /trunk/DR22/Assets/Art/icons/a.png (缺少.meta)",
+                          "r102 /trunk/DR22/Assets/Lua/cfg.lua (缺少.meta)"], result.missing_meta)
+
+    def test_no_entries(self):
+        result = compact_log([])
+        self.assertEqual("", result.text)
+        self.assertEqual(0.0, result.saved_ratio)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import threading
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from log_summarizer import chunk_entries, split_log_entries, summarize_log
+
+SEPARATOR = '-' * 72
+
+
+def make_log(count, body_lines=3):
+    """生成count个版本的 svn log -v 文本"""
+    entries = []
+    for rev in range(1, count + 1):
+        body = '\n'.join(f"   M /trunk/Assets/Scripts/file_{rev}_{i}.lua" for i in range(body_lines))
+        entries.append(f"r{rev} | user{rev % 3} | 2024-01-01 10:00:00 +0800 (周一, 01 1月 2024) | 1 line\n"
+                       f"Changed paths:\n{body}\n\n修复问题{rev}\n")
+    return SEPARATOR + '\n' + ('\n' + SEPARATOR + '\n').join(entries) + SEPARATOR + '\n'
+
+
+class TestLogSummarizer(unittest.TestCase):
+    def test_split_entries_on_separator(self):
+        """按分隔线拆分日志记录"""
+        entries = split_log_entries(make_log(3))
+        self.assertEqual(3, len(entries))
+        self.assertTrue(entries[1].startswith("r2 | user2"))
+
+    def test_chunks_respect_revision_boundaries(self):
+        """分块不会拆开同一个版本"""
+        entries = split_log_entries(make_log(20))
+        chunks = chunk_entries(entries, 200)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(20, sum(chunk.count("Changed paths:") for chunk in chunks))
+
+    def test_oversized_entry_is_truncated(self):
+        """单个版本超过预算时截断"""
+        entries = split_log_entries(make_log(1, body_lines=200))
+        chunks = chunk_entries(entries, 100)
+        self.assertEqual(1, len(chunks))
+        self.assertIn("已截断", chunks[0])
+
+    def test_small_log_goes_straight_to_reduce(self):
+        """日志不超过预算时直接点评，不做分块总结"""
+        calls = []
+        result = summarize_log(make_log(2), lambda chunk: calls.append(chunk),
+                               lambda text, summarized: (text, summarized), chunk_tokens=10000)
+        self.assertEqual([], calls)
+        self.assertFalse(result[1])
+
+    def test_large_log_is_mapped_then_reduced(self):
+        """日志超过预算时先并行总结各块，再根据摘要点评"""
+        lock = threading.Lock()
+        mapped = []
+
+        def map_fn(chunk):
+            with lock:
+                mapped.append(chunk)
+            return f"summary of {chunk.count('Changed paths:')} revisions"
+
+        text, summarized = summarize_log(make_log(50), map_fn, lambda text, summarized: (text, summarized),
+                                         chunk_tokens=300, max_workers=3)
+        self.assertTrue(summarized)
+        self.assertGreater(len(mapped), 1)
+        self.assertEqual(50, sum(chunk.count("Changed paths:") for chunk in mapped))
+        self.assertIn("summary of", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from lua_classifier import COSMETIC, DATA, LOGIC, classify_files, classify_source
+
+OLD_SOURCE = """-- 背包模块
+local M = {}
+local TEXT = { title = "背包", [1] = 2, sub = { -1, true } }
+
+function M.add(item, count)
+  return count + 1
+end
+
+return M
+"""
+
+
+class TestLuaClassifier(unittest.TestCase):
+    def test_comment_and_whitespace_are_cosmetic(self):
+        """只改注释和缩进"""
+        new_source = OLD_SOURCE.replace("-- 背包模块", "-- 背包").replace("  return", "    return")
+        self.assertEqual(classify_source(OLD_SOURCE, new_source), COSMETIC)
+
+    def test_literal_and_data_table_changes_are_data(self):
+        """只改字面量和纯数据表"""
+        self.assertEqual(classify_source(OLD_SOURCE, OLD_SOURCE.replace('"背包"', '"道具"')), DATA)
+        self.assertEqual(classify_source(OLD_SOURCE, OLD_SOURCE.replace("sub = {", "extra = 5, sub = {")), DATA)
+
+    def test_logic_changes(self):
+        """改动运算符、引用变量、新增或删除文件"""
+        self.assertEqual(classify_source(OLD_SOURCE, OLD_SOURCE.replace("count + 1", "count - 1")), LOGIC)
+        self.assertEqual(classify_source(OLD_SOURCE, OLD_SOURCE.replace("[1] = 2", "[1] = count")), LOGIC)
+        self.assertEqual(classify_source("", OLD_SOURCE), LOGIC)
+
+    def test_literals_in_conditions_and_arguments_are_logic(self):
+        """条件判断、函数参数和运算中的字面量改动会改变逻辑"""
+        source = 'local limit = 10\nif count == 1 then\n  print("a", -1)\nend\n'
+        self.assertEqual(classify_source(source, source.replace("== 1", "== 2")), LOGIC)
+        self.assertEqual(classify_source(source, source.replace('"a"', '"b"')), LOGIC)
+        self.assertEqual(classify_source(source, source.replace("-1", "-2")), LOGIC)
+        self.assertEqual(classify_source(source, source.replace("= 10", "= 20")), DATA)
+
+    def test_returned_config_table_is_data(self):
+        """配置文件顶层 return 的数据表只改数据"""
+        source = 'return { speed = 1, names = { "a", "b" } }\n'
+        self.assertEqual(classify_source(source, source.replace('"b"', '"c", "d"')), DATA)
+        self.assertEqual(classify_source(source, source.replace("speed = 1", "speed = 2")), DATA)
+
+    def test_revision_level_is_highest_file_level(self):
+        """提交级别取所有文件中最高的级别"""
+        old = {"a.lua": OLD_SOURCE, "b.lua": OLD_SOURCE}
+        new = {"a.lua": OLD_SOURCE.replace("-- 背包模块", ""), "b.lua": OLD_SOURCE.replace('"背包"', '"道具"')}
+        level, labels = classify_files(old, new, ["a.lua", "b.lua"])
+        self.assertEqual(level, DATA)
+        self.assertEqual(labels, {"a.lua": COSMETIC, "b.lua": DATA})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import rate_limit
+from rate_limit import RateLimiter, TokenBucket, retry_with_backoff
+
+
+class FakeTime:
+    """替换 rate_limit 中的 time 模块，sleep 只推进时钟并记录等待的秒数"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.clock = FakeTime()
+        self.patcher = patch.object(rate_limit, 'time', self.clock)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_try_acquire_returns_wait_until_refilled(self):
+        """令牌用完后返回还需等待的秒数，时间过去后按速率补充"""
+        bucket = TokenBucket(rate=2, capacity=2)
+        self.assertEqual(0, bucket.try_acquire())
+        self.assertEqual(0, bucket.try_acquire())
+        self.assertAlmostEqual(0.5, bucket.try_acquire())
+        self.clock.now += 0.5
+        self.assertEqual(0, bucket.try_acquire())
+
+    def test_refill_is_capped_at_capacity(self):
+        """空闲再久也只能攒满容量"""
+        bucket = TokenBucket(rate=1, capacity=3)
+        bucket.try_acquire(3)
+        self.clock.now += 100
+        self.assertEqual(0, bucket.try_acquire(3))
+        self.assertAlmostEqual(1.0, bucket.try_acquire())
+
+    def test_acquire_sleeps_and_oversized_request_uses_capacity(self):
+        """acquire 阻塞到令牌足够，超过容量的请求按容量等待而不是永远等待"""
+        bucket = TokenBucket(rate=10, capacity=5)
+        bucket.acquire(5)
+        bucket.acquire(50)
+        self.assertEqual([0.5], self.clock.sleeps)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.clock = FakeTime()
+        self.patcher = patch.object(rate_limit, 'time', self.clock)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def test_rpm_and_tpm_both_apply(self):
+        """请求数和token数分别限流，等待时间取决于先用完的那一个"""
+        limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+        limiter.acquire(tokens=600)
+        self.assertEqual([], self.clock.sleeps)
+        # 请求数还有余量，token已经用完，需要等token补充
+        limiter.acquire(tokens=300)
+        self.assertEqual([30.0], self.clock.sleeps)
+
+        limiter = RateLimiter(requests_per_minute=2, tokens_per_minute=600)
+        self.clock.sleeps.clear()
+        limiter.acquire(tokens=1)
+        limiter.acquire(tokens=1)
+        # token还有余量，请求数已经用完，需要等请求数补充
+        limiter.acquire(tokens=1)
+        self.assertEqual([30.0], self.clock.sleeps)
+
+    def test_zero_means_unlimited(self):
+        """RPM和TPM为0时不限制"""
+        limiter = RateLimiter()
+        for _ in range(100):
+            limiter.acquire(tokens=10000)
+        self.assertEqual([], self.clock.sleeps)
+
+
+class TestRetryWithBackoff(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.clock = FakeTime()
+        self.patcher = patch.object(rate_limit, 'time', self.clock)
+        self.patcher.start()
+        self.calls = 0
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def failing(self, *errors):
+        """依次抛出errors中的异常，之后返回成功"""
+        def func():
+            self.calls += 1
+            if self.calls <= len(errors):
+                raise errors[self.calls - 1]
+            return "ok"
+        return func
+
+    def test_retries_listed_exceptions_until_success(self):
+        """retry_on 中的异常按退避重试，直到成功"""
+        func = self.failing(TimeoutError("timeout"), ConnectionError("reset"))
+        with patch('builtins.print'):
+            result = retry_with_backoff(func, retries=3, retry_on=(TimeoutError, ConnectionError))
+        self.assertEqual("ok", result)
+        self.assertEqual(3, self.calls)
+        self.assertEqual(2, len(self.clock.sleeps))
+
+    def test_other_exceptions_are_not_retried(self):
+        """不在 retry_on 中的异常直接抛出"""
+        func = self.failing(ValueError("bad request"))
+        with self.assertRaises(ValueError):
+            retry_with_backoff(func, retries=3, retry_on=(TimeoutError,))
+        self.assertEqual(1, self.calls)
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_raises_last_error_when_retries_exhausted(self):
+        """重试用尽后抛出最后一次的异常"""
+        func = self.failing(*[TimeoutError(f"timeout {i}") for i in range(5)])
+        with patch('builtins.print'), self.assertRaises(TimeoutError) as context:
+            retry_with_backoff(func, retries=2, retry_on=(TimeoutError,))
+        self.assertEqual("timeout 2", str(context.exception))
+        self.assertEqual(3, self.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
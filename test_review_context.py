@@ -0,0 +1,125 @@
+import os
+import sys
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from parse_lua import LuaASTParser
+from review_context import FunctionIndex, build_review_context, find_spans
+from svn_diff import FileDiff, Hunk
+
+# 函数 a 在2-4行，b 紧接着在5-10行并包含局部函数 inner，c 在12-14行
+SOURCE = """local x = 1
+local function a()
+  return 1
+end
+function b()
+  local function inner()
+    return 2
+  end
+  return inner()
+end
+
+function c()
+  return 3
+end
+"""
+
+
+def make_diff(path, *new_ranges):
+    """按新文件的 (起始行, 行数) 构造改动块"""
+    hunks = [Hunk(start, count, start, count, f"@@ -{start},{count} +{start},{count} @@")
+             for start, count in new_ranges]
+    return FileDiff(path=path, hunks=hunks)
+
+
+class TestFindSpans(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.lines = SOURCE.split('\n')
+        self.index = FunctionIndex(LuaASTParser().parse_source(SOURCE, "a.lua"))
+
+    def spans(self, *new_ranges, context_lines=0):
+        diff = make_diff("a.lua", *new_ranges)
+        return [(span.start_line, span.end_line, span.functions)
+                for span in find_spans(diff, self.index, len(self.lines), context_lines)]
+
+    def test_change_in_nested_function_maps_to_top_level_function(self):
+        """局部函数中的改动取外层的整个顶层函数"""
+        self.assertEqual([(5, 10, ["b"])], self.spans((7, 1)))
+
+    def test_adjacent_functions_are_merged(self):
+        """相邻函数中的改动合并为一段，函数名按行号排列"""
+        self.assertEqual([(2, 10, ["a", "b"])], self.spans((9, 1), (3, 1)))
+
+    def test_separate_functions_merge_only_when_context_touches(self):
+        """不相邻的函数只有前后额外行连在一起时才合并"""
+        self.assertEqual([(5, 10, ["b"]), (12, 14, ["c"])], self.spans((7, 1), (13, 1)))
+        self.assertEqual([(4, 15, ["b", "c"])], self.spans((7, 1), (13, 1), context_lines=1))
+
+    def test_top_level_and_deletion_hunks(self):
+        """顶层代码的改动只取前后几行，纯删除的改动块取删除位置所在的行"""
+        self.assertEqual([(1, 2, [])], self.spans((1, 1), context_lines=1))
+        self.assertEqual([(12, 14, ["c"])], self.spans((13, 0)))
+
+
+# 模块写法的函数: M.foo 在3-5行，M:bar 在7-9行
+MODULE_SOURCE = """local M = {}
+
+function M.foo(a)
+  return a
+end
+
+function M:bar()
+  return self
+end
+
+return M
+"""
+
+
+class TestModuleFunctions(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.lines = MODULE_SOURCE.split('\n')
+        self.index = FunctionIndex(LuaASTParser().parse_source(MODULE_SOURCE, "m.lua"))
+
+    def test_dot_and_method_functions_are_indexed(self):
+        """function M.foo 和 function M:bar 也能识别为函数"""
+        self.assertEqual([("M.foo", 3, 5), ("M:bar", 7, 9)],
+                         [(chunk.function_name, chunk.start_line, chunk.end_line) for chunk in self.index.chunks])
+
+    def test_change_in_module_function_maps_to_whole_function(self):
+        """模块函数中的改动取整个函数，而不是只取改动前后几行"""
+        diff = make_diff("m.lua", (4, 1), (8, 1))
+        spans = find_spans(diff, self.index, len(self.lines), 0)
+        self.assertEqual([(3, 5, ["M.foo"]), (7, 9, ["M:bar"])],
+                         [(span.start_line, span.end_line, span.functions) for span in spans])
+
+
+class TestBuildReviewContext(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.contents = {"a.lua": SOURCE, "b.lua": SOURCE}
+        self.diffs = [make_diff("a.lua", (3, 1), (13, 1)), make_diff("b.lua", (7, 1))]
+
+    def test_within_budget_keeps_context_lines(self):
+        """预算足够时保留函数前后的额外行"""
+        context = build_review_context(self.diffs, self.contents, context_lines=1, token_budget=10000)
+        self.assertIn("-- a.lua 第1-5行 (a)", context)
+        self.assertIn("-- b.lua 第4-11行 (b)", context)
+
+    def test_truncation_is_deterministic(self):
+        """超出预算时按文件和行号顺序截断，相同输入得到相同结果"""
+        first = build_review_context(self.diffs, self.contents, context_lines=1, token_budget=25)
+        second = build_review_context(self.diffs, dict(self.contents), context_lines=1, token_budget=25)
+        self.assertEqual(first, second)
+        # 先去掉额外行，第一段完整保留，第二段按行截断，之后的只列出位置
+        self.assertTrue(first.startswith("-- a.lua 第2-4行 (a)\nlocal function a()\n  return 1\nend\n\n"))
+        self.assertIn("-- a.lua 第12-14行 (c)\n-- ...[超出token预算，已截断]", first)
+        self.assertTrue(first.endswith("-- 省略: b.lua 第5-10行"))
+
+
+if __name__ == '__main__':
+    unittest.main()
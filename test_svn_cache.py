@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_cache import ResponseCache
+from svn_cache import SvnCache, make_key
+
+
+class TestSvnCache(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.cache = SvnCache(tempfile.mkdtemp(), max_bytes=25)
+
+    def test_make_key_only_for_fixed_revisions(self):
+        """只有固定版本号才生成缓存键"""
+        self.assertIsNotNone(make_key("http://svn/repo", "r123", "", "diff"))
+        self.assertIsNotNone(make_key("http://svn/repo", "100:120", "", "log -v"))
+        self.assertIsNone(make_key("http://svn/repo", "HEAD", "", "diff"))
+        self.assertIsNone(make_key("http://svn/repo", "{2024-01-01}:{2024-01-02}", "", "log"))
+
+    def test_get_put_counts_hits_and_misses(self):
+        """命中和未命中计数"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", b"data")
+        self.assertEqual(self.cache.get("a"), b"data")
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "evictions": 0})
+
+    def test_lru_eviction(self):
+        """超过容量时淘汰最久未访问的缓存项"""
+        self.cache.put("a", b"0123456789")
+        time.sleep(0.02)
+        self.cache.put("b", b"0123456789")
+        time.sleep(0.02)
+        self.cache.get("a")
+        time.sleep(0.02)
+        self.cache.put("c", b"0123456789")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), b"0123456789")
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_size_is_tracked_without_walking(self):
+        """总大小在打开时统计一次，之后增量更新，未超过容量时不遍历目录"""
+        self.cache.put("a", b"0123456789")
+        reopened = SvnCache(self.cache.cache_dir, max_bytes=25)
+        self.assertEqual(reopened._size, 10)
+        with patch('svn_cache.os.walk') as walk:
+            reopened.put("a", b"01234")
+            reopened.put("b", b"0123456789")
+            reopened.delete("b")
+            walk.assert_not_called()
+        self.assertEqual(reopened._size, 5)
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.cache = ResponseCache(tempfile.mkdtemp(), max_bytes=1024, ttl=60)
+
+    def test_expired_entry_is_removed_on_read(self):
+        """读取到过期的回答时视为未命中并删除缓存项"""
+        self.cache.put_response("a", "answer")
+        self.assertEqual(self.cache.get_response("a")[0], "answer")
+        path = self.cache._entry_path("a")
+        self.cache.ttl = 0.01
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get_response("a"))
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1, "evictions": 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+import time
+import unittest
+from unittest.mock import patch
+
+import svn_client
+
+
+def python(code):
+    return [sys.executable, '-c', code]
+
+
+class SvnClientTest(unittest.TestCase):
+    def setUp(self):
+        self.env = patch.dict(os.environ, {"SVN_CACHE_DISABLED": "true", "SVN_OUTPUT_ENCODING": "gbk",
+                                           "USER_INFO": "--username 'build bot' --non-interactive"})
+        self.env.start()
+
+    def tearDown(self):
+        self.env.stop()
+
+    def test_decode_detects_encoding_once(self):
+        self.assertEqual('中文', svn_client.decode('中文'.encode('utf-8')))
+        self.assertEqual('中文', svn_client.decode('中文'.encode('gbk')))
+
+    @unittest.skipIf(os.name == 'nt', "Windows下不按posix规则拆分参数")
+    def test_command_without_shell(self):
+        args = svn_client.command('cat', '/path with space/a.lua@12')
+        self.assertEqual(['svn', 'cat', '/path with space/a.lua@12', '--trust-server-cert',
+                          '--username', 'build bot', '--non-interactive'], args)
+
+    def test_iter_lines_switches_encoding_at_first_invalid_line(self):
+        code = ("import sys; out = sys.stdout.buffer; out.write('ascii\\n'.encode()); "
+                "out.write('提交\\n'.encode('gbk')); out.write('日志\\n'.encode('gbk'))")
+        self.assertEqual(['ascii\n', '提交\n', '日志\n'], list(svn_client.iter_lines(python(code))))
+
+    def test_run_raises_with_stderr(self):
+        with self.assertRaises(subprocess.CalledProcessError) as context:
+            svn_client.run(python("import sys; sys.stderr.write('boom'); sys.exit(3)"))
+        self.assertEqual(3, context.exception.returncode)
+        self.assertEqual(b'boom', context.exception.stderr)
+
+    def test_run_many_keeps_order_and_runs_concurrently(self):
+        commands = [(python(f"import time; time.sleep(0.3); print({i})"), None) for i in range(4)]
+        start = time.perf_counter()
+        outputs = svn_client.run_many(commands, max_parallel=4)
+        self.assertLess(time.perf_counter() - start, 1.0)
+        self.assertEqual([b'0', b'1', b'2', b'3'], [output.strip() for output in outputs])
+
+    def test_run_many_return_exceptions(self):
+        outputs = svn_client.run_many([(python("print(1)"), None), (python("import sys; sys.exit(1)"), None)],
+                                      return_exceptions=True)
+        self.assertEqual(b'1', outputs[0].strip())
+        self.assertIsInstance(outputs[1], subprocess.CalledProcessError)
+
+    def test_run_many_reports_each_command_latency(self):
+        timings = []
+        with patch('builtins.print') as printed:
+            outputs = svn_client.run_many([(python("import time; time.sleep(0.3)"), None),
+                                           (python("import sys; sys.exit(1)"), None)],
+                                          return_exceptions=True, timings=timings)
+        self.assertIsInstance(outputs[1], subprocess.CalledProcessError)
+        self.assertEqual(2, len(timings))
+        self.assertGreaterEqual(timings[0], 0.3)
+        self.assertLess(timings[1], timings[0])
+        # 调用方处理失败的命令时不输出错误信息
+        printed.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from svn_diff import parse_diff
+
+TEST_DIFF = """Index: data/a.lua
+===================================================================
+--- data/a.lua	(revision 4)
++++ data/a.lua	(revision 5)
+@@ -1,3 +1,4 @@
+ local a = 1
+-local b = 2
++local b = 3
++local c = 4
+ return a
+Index: data/b.prefab
+===================================================================
+--- data/b.prefab	(revision 4)
++++ data/b.prefab	(revision 5)
+@@ -10 +10 @@
+-x
++y
+
+Property changes on: data/b.prefab
+___________________________________________________________________
+Added: svn:eol-style
+## -0,0 +1 ##
++native
+"""
+
+
+class TestParseDiff(unittest.TestCase):
+    def test_structured_hunks(self):
+        """解析出文件、改动块和行号范围"""
+        files = list(parse_diff(TEST_DIFF.split('\n')))
+        self.assertEqual([f.path for f in files], ["data/a.lua", "data/b.prefab"])
+        self.assertTrue(files[0].is_lua)
+        self.assertEqual(files[0].old_ranges, [(1, 3)])
+        self.assertEqual(files[0].new_ranges, [(1, 4)])
+        self.assertEqual(files[0].hunks[0].lines[1:3], ["-local b = 2", "+local b = 3"])
+        self.assertEqual(files[1].new_ranges, [(10, 10)])
+
+    def test_property_changes(self):
+        """解析属性改动"""
+        prefab = list(parse_diff(TEST_DIFF.split('\n')))[1]
+        self.assertEqual(len(prefab.property_changes), 1)
+        self.assertEqual(prefab.property_changes[0].action, "Added")
+        self.assertEqual(prefab.property_changes[0].name, "svn:eol-style")
+
+    def test_render_matches_lua_section(self):
+        """render 还原出与原始文本一致的lua改动"""
+        lua = next(parse_diff(TEST_DIFF.split('\n')))
+        expected = "Changes in data/a.lua:\n\n" + TEST_DIFF[TEST_DIFF.index("====="):TEST_DIFF.index("Index: data/b")].rstrip('\n')
+        self.assertEqual(lua.render(), expected)
+
+    def test_max_file_bytes(self):
+        """超出字节上限的部分被截断并计数"""
+        lua = next(parse_diff(TEST_DIFF.split('\n'), max_file_bytes=100))
+        self.assertGreater(lua.truncated_bytes, 0)
+        self.assertIn("diff已截断", lua.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
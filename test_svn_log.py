@@ -0,0 +1,53 @@
+import unittest
+
+from svn_log import format_simple, format_verbose, iter_log_entries, parse_log
+
+LOG_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<log>
+<logentry revision="123">
+<author>user1</author>
+<date>2023-12-20T02:00:00.123456Z</date>
+<paths>
+<path action="M" kind="file" prop-mods="false" text-mods="true">/trunk/src/file1.cpp</path>
+<path action="A" kind="file" copyfrom-path="/trunk/src/old.cpp" copyfrom-rev="120">/trunk/src/file2.cpp</path>
+</paths>
+<msg>r2 的问题修复
+readme 更新</msg>
+</logentry>
+<logentry revision="124">
+<date>2023-12-21T03:00:00.000000Z</date>
+<msg>匿名提交</msg>
+</logentry>
+</log>
+"""
+
+
+class SvnLogTest(unittest.TestCase):
+    def test_parse_structured_records(self):
+        entries = parse_log(LOG_XML)
+        self.assertEqual(["123", "124"], [entry.revision for entry in entries])
+        first = entries[0].to_dict()
+        self.assertEqual("user1", first["author"])
+        self.assertEqual([{"action": "M", "path": "/trunk/src/file1.cpp"},
+                          {"action": "A", "path": "/trunk/src/file2.cpp"}], first["changed_paths"])
+        # 以 r 开头的日志行不会被误认为新的版本
+        self.assertEqual("r2 的问题修复\nreadme 更新", first["message"])
+        self.assertEqual("", entries[1].author)
+        self.assertRegex(entries[0].date, r"^2023-12-20 \d\d:00:00 [+-]\d{4}$")
+
+    def test_incremental_parse_from_small_chunks(self):
+        data = LOG_XML.encode('utf-8')
+        chunks = (data[i:i + 7] for i in range(0, len(data), 7))
+        self.assertEqual(["123", "124"], [entry.revision for entry in iter_log_entries(chunks)])
+
+    def test_renderers(self):
+        entries = parse_log(LOG_XML)
+        self.assertEqual("123 user1 r2 的问题修复\nreadme 更新\n124  匿名提交", format_simple(entries))
+        verbose = format_verbose(entries)
+        self.assertIn("r123 | user1 | ", verbose)
+        self.assertIn("   A /trunk/src/file2.cpp (from /trunk/src/old.cpp:120)", verbose)
+        self.assertIn("| 2 lines\n", verbose)
+
+
+if __name__ == '__main__':
+    unittest.main()
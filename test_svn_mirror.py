@@ -0,0 +1,86 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+import svn_log
+import svn_mirror
+from svn_diff import parse_diff
+
+HAS_SVN = all(shutil.which(tool) for tool in ('svn', 'svnadmin', 'svnlook', 'svnsync'))
+
+
+def svn(*args, cwd=None):
+    return subprocess.check_output(['svn', *args, '--non-interactive'], cwd=cwd)
+
+
+@unittest.skipUnless(HAS_SVN, "需要安装 svn、svnadmin、svnlook 和 svnsync")
+class SvnMirrorTest(unittest.TestCase):
+    """用 svnadmin 创建的 file:// 仓库作为远程仓库，验证镜像与直接访问的结果一致"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        source = os.path.join(self.tmp, 'source')
+        subprocess.check_call(['svnadmin', 'create', source])
+        self.source_url = Path(source).as_uri()
+
+        wc = os.path.join(self.tmp, 'wc')
+        svn('checkout', self.source_url, wc)
+        lua_dir = os.path.join(wc, 'trunk', 'DR22', 'Lua')
+        os.makedirs(lua_dir)
+        os.makedirs(os.path.join(wc, 'trunk', 'Other'))
+        with open(os.path.join(lua_dir, 'a.lua'), 'w') as f:
+            f.write('local a = 1\nreturn a\n')
+        svn('add', 'trunk', cwd=wc)
+        svn('commit', '-m', '新增a.lua', cwd=wc)
+        with open(os.path.join(lua_dir, 'a.lua'), 'w') as f:
+            f.write('local a = 2\nreturn a\n')
+        svn('commit', '-m', 'r2 修改a的值', cwd=wc)
+        with open(os.path.join(wc, 'trunk', 'Other', 'b.txt'), 'w') as f:
+            f.write('b\n')
+        svn('add', os.path.join('trunk', 'Other', 'b.txt'), cwd=wc)
+        svn('commit', '-m', '其他目录的提交', cwd=wc)
+
+        self.target = self.source_url + '/trunk/DR22'
+        env = {"SVN_MIRROR_DIR": os.path.join(self.tmp, 'mirror'), "SVN_CACHE_DISABLED": "true"}
+        self.env = patch.dict(os.environ, env)
+        self.env.start()
+        svn_mirror.get_mirror.cache_clear()
+        svn_mirror._mirrors.clear()
+
+    def tearDown(self):
+        self.env.stop()
+        svn_mirror.get_mirror.cache_clear()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_log_matches_remote(self):
+        mirrored = [entry.to_dict() for entry in svn_log.iter_svn_log(self.target, '1:HEAD')]
+        with patch.dict(os.environ, {"SVN_MIRROR_DIR": ""}):
+            svn_mirror.get_mirror.cache_clear()
+            remote = [entry.to_dict() for entry in svn_log.iter_svn_log(self.target, '1:HEAD')]
+        self.assertEqual(remote, mirrored)
+        self.assertEqual(['1', '2'], [entry['revision'] for entry in mirrored])
+        self.assertEqual('r2 修改a的值', mirrored[1]['message'])
+
+    def test_diff_and_cat(self):
+        mirror = svn_mirror.get_mirror(self.target)
+        file_diffs = list(parse_diff(mirror.iter_diff('r2')))
+        self.assertEqual(['Lua/a.lua'], [file_diff.path for file_diff in file_diffs])
+        self.assertEqual([(1, 1)], file_diffs[0].new_ranges)
+        self.assertEqual(b'local a = 1\nreturn a\n', mirror.cat('Lua/a.lua', 1))
+
+    def test_incremental_sync(self):
+        mirror = svn_mirror.get_mirror(self.target)
+        self.assertEqual(3, mirror.head())
+        wc = os.path.join(self.tmp, 'wc')
+        with open(os.path.join(wc, 'trunk', 'DR22', 'Lua', 'a.lua'), 'w') as f:
+            f.write('local a = 3\nreturn a\n')
+        svn('commit', '-m', '再次修改', cwd=wc)
+        self.assertEqual(['4'], [entry.revision for entry in svn_log.iter_svn_log(self.target, '4:4')])
+
+
+if __name__ == '__main__':
+    unittest.main()
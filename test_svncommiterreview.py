@@ -0,0 +1,355 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+# 添加项目根目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import svncommiterreview
+from svncommiterreview import (RevisionWatermark, _diff_commands, _rename_single_target, get_lua_revisions,
+                               iter_svn_diff, watch)
+
+URL = "https://svn.example.com/repo/trunk/DR22"
+REPO_INFO = {"url": URL, "root": "https://svn.example.com/repo", "relative_path": "/trunk/DR22"}
+
+LOG_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<log>
+<logentry revision="10">
+<author>user1</author>
+<date>2024-01-01T00:00:00.000000Z</date>
+<paths>
+<path action="M" kind="file">/trunk/DR22/a.lua</path>
+<path action="A" kind="file">/trunk/DR22/sub/new.lua</path>
+<path action="D" kind="file">/trunk/DR22/sub/old.lua</path>
+<path action="R" kind="file">/trunk/DR22/rep.lua</path>
+<path action="A" kind="dir">/trunk/DR22/sub</path>
+<path action="M" kind="file">/trunk/DR22/ui.prefab</path>
+<path action="M" kind="file">/trunk/Other/x.lua</path>
+</paths>
+<msg>test</msg>
+</logentry>
+</log>
+"""
+
+# 比较单个文件URL时svn输出的路径只有文件名
+ADDED_DIFF = """Index: new.lua
+===================================================================
+--- new.lua\t(nonexistent)
++++ new.lua\t(revision 10)
+@@ -0,0 +1,2 @@
++local a = 1
++return a
+
+Property changes on: new.lua
+___________________________________________________________________
+Added: svn:eol-style
+## -0,0 +1 ##
++native
+"""
+
+MODIFIED_DIFF = """Index: a.lua
+===================================================================
+--- a.lua\t(revision 9)
++++ a.lua\t(revision 10)
+@@ -1,3 +1,3 @@
+ local x = 1
+-local y = 2
++local y = 3
+ return x
+"""
+
+
+class FakeSvn:
+    """替换 svn_client.stream，log 返回 LOG_XML，diff 按参数中的目标路径返回 diffs 中的内容"""
+
+    def __init__(self, diffs=None):
+        self.diffs = diffs or {}
+        self.calls = []
+
+    def __call__(self, args, cache_key=None):
+        self.calls.append(list(args))
+        if args[1] == 'log':
+            return iter([LOG_XML])
+        text = next((self.diffs[arg] for arg in args if arg in self.diffs), '')
+        return iter([line.encode('utf-8') for line in text.splitlines(True)])
+
+
+class TestDiffCommands(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.svn = FakeSvn()
+        self.patchers = [
+            patch.dict(os.environ, {"USER_INFO": ""}),
+            patch.object(svncommiterreview, 'get_repo_info', return_value=REPO_INFO),
+            patch('svn_mirror.get_mirror', return_value=None),
+            patch('svn_client.stream', self.svn),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_whole_revision_without_filters(self):
+        """不指定过滤条件时只有一条整个提交的diff命令，不需要查询日志"""
+        commands = _diff_commands("/work/DR22", "r10")
+        self.assertEqual(1, len(commands))
+        args, _, target = commands[0]
+        self.assertEqual(['svn', 'diff', '-c', 'r10', '/work/DR22'], args[:5])
+        self.assertIsNone(target)
+        self.assertEqual([], self.svn.calls)
+
+    def test_peg_revision_per_action(self):
+        """新增和替换的文件以该版本定位，删除的文件以上一个版本定位，修改的文件合并为一条 --old/--new 命令"""
+        commands = _diff_commands("/work/DR22", "r10", include=['*.lua'])
+        single = [(args[2:5], target) for args, _, target in commands if target is not None]
+        self.assertEqual([
+            (['-c', '10', f'{URL}/sub/new.lua@10'], 'sub/new.lua'),
+            (['-c', '10', f'{URL}/sub/old.lua@9'], 'sub/old.lua'),
+            (['-c', '10', f'{URL}/rep.lua@10'], 'rep.lua'),
+        ], single)
+        batch = [args for args, _, target in commands if target is None]
+        self.assertEqual(1, len(batch))
+        self.assertEqual([f'--old={URL}@9', f'--new={URL}@10', 'a.lua'], batch[0][2:5])
+
+    def test_excluded_directory_and_outside_paths_are_skipped(self):
+        """目录、仓库路径之外的文件和被排除的文件都不生成命令"""
+        commands = _diff_commands("/work/DR22", "r10", exclude=['*.prefab', '*.lua'])
+        self.assertEqual([], commands)
+        commands = _diff_commands("/work/DR22", "r10", exclude=['*.lua'])
+        self.assertEqual(['ui.prefab'], [args[4] for args, _, _ in commands])
+
+    def test_single_file_paths_are_rewritten_when_parsing(self):
+        """iter_svn_diff 把单个文件diff中的文件名改为相对路径"""
+        self.svn.diffs = {f'{URL}/sub/new.lua@10': ADDED_DIFF, 'a.lua': MODIFIED_DIFF}
+        file_diffs = list(iter_svn_diff("/work/DR22", "r10", include=['*.lua']))
+        self.assertEqual(['sub/new.lua', 'a.lua'], [file_diff.path for file_diff in file_diffs])
+        self.assertEqual([(1, 2)], file_diffs[0].new_ranges)
+
+    def test_max_file_bytes_truncates_each_file(self):
+        """超过单个文件字节上限的部分截断并记录省略的字节数，其他文件不受影响"""
+        self.svn.diffs = {f'{URL}/sub/new.lua@10': ADDED_DIFF, 'a.lua': MODIFIED_DIFF}
+        full = {d.path: d for d in iter_svn_diff("/work/DR22", "r10", include=['*.lua'])}
+        truncated = {d.path: d for d in iter_svn_diff("/work/DR22", "r10", include=['*.lua'], max_file_bytes=80)}
+        self.assertEqual(['sub/new.lua', 'a.lua'], list(truncated))
+        for path, file_diff in truncated.items():
+            kept = sum(len(line.encode('utf-8')) + 1 for line in file_diff.lines)
+            self.assertLessEqual(kept, 80)
+            self.assertGreater(file_diff.truncated_bytes, 0)
+            # 保留的行按原顺序取自完整diff
+            remaining = iter(full[path].lines)
+            self.assertTrue(all(line in remaining for line in file_diff.lines))
+            self.assertIn("diff已截断", file_diff.render())
+
+
+class TestRenameSingleTarget(unittest.TestCase):
+    def rename(self, text, target):
+        return ''.join(_rename_single_target(text.splitlines(True), target))
+
+    def test_headers_are_rewritten(self):
+        """Index、---/+++ 和属性改动的文件头改为target，保留制表符后的版本说明"""
+        renamed = self.rename(ADDED_DIFF, 'sub/new.lua')
+        self.assertIn("Index: sub/new.lua\n", renamed)
+        self.assertIn("--- sub/new.lua\t(nonexistent)\n", renamed)
+        self.assertIn("+++ sub/new.lua\t(revision 10)\n", renamed)
+        self.assertIn("Property changes on: sub/new.lua\n", renamed)
+
+    def test_hunk_content_is_not_rewritten(self):
+        """改动块中以 --- 或 +++ 开头的内容不是文件头，不替换"""
+        text = ADDED_DIFF.replace("+local a = 1\n", "+++ a\n").replace("+return a\n", "--- b\n")
+        renamed = self.rename(text, 'sub/new.lua')
+        self.assertIn("\n+++ a\n--- b\n", renamed)
+
+    def test_crlf_line_endings_are_kept(self):
+        """保留原来的换行符"""
+        renamed = self.rename(ADDED_DIFF.replace('\n', '\r\n'), 'sub/new.lua')
+        self.assertTrue(renamed.startswith("Index: sub/new.lua\r\n"))
+
+    def test_no_target_returns_lines_unchanged(self):
+        """target为空时原样返回"""
+        self.assertEqual(MODIFIED_DIFF, self.rename(MODIFIED_DIFF, None))
+
+
+# 91: 修改lua；92: 只删除lua；93: 只有目录和非lua文件；94: 名为 .lua 的目录；
+# 95: 仓库路径之外的lua；96: 旧版本服务器没有 kind 的lua；97: 复制而来的lua
+RANGE_ENTRIES = [
+    (91, '<path action="M" kind="file">/trunk/DR22/a.lua</path>'
+         '<path action="M" kind="file">/trunk/DR22/ui.prefab</path>'),
+    (92, '<path action="D" kind="file">/trunk/DR22/old.lua</path>'),
+    (93, '<path action="A" kind="dir">/trunk/DR22/sub</path>'
+         '<path action="M" kind="file">/trunk/DR22/readme.txt</path>'),
+    (94, '<path action="A" kind="dir">/trunk/DR22/plugin.lua</path>'),
+    (95, '<path action="M" kind="file">/trunk/Other/x.lua</path>'
+         '<path action="M" kind="file">/trunk/DR22Tools/y.lua</path>'),
+    (96, '<path action="M">/trunk/DR22/b.lua</path>'),
+    (97, '<path action="A" kind="file" copyfrom-path="/trunk/Other/x.lua" copyfrom-rev="90">/trunk/DR22/x.lua</path>'),
+]
+
+
+def log_xml(entries):
+    """按给出的顺序生成 svn log -v --xml 的输出"""
+    body = ''.join(f'<logentry revision="{rev}">\n<paths>\n{paths}\n</paths>\n<msg>r{rev}</msg>\n</logentry>\n'
+                   for rev, paths in entries)
+    return f'<?xml version="1.0" encoding="UTF-8"?>\n<log>\n{body}</log>\n'.encode('utf-8')
+
+
+class TestGetLuaRevisions(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.calls = []
+        self.log_xml = log_xml(RANGE_ENTRIES)
+        self.patchers = [
+            patch('builtins.print'),
+            patch.dict(os.environ, {"USER_INFO": ""}),
+            patch.object(svncommiterreview, 'get_repo_info', return_value=REPO_INFO),
+            patch('svn_mirror.get_mirror', return_value=None),
+            patch('svn_client.stream', self.fake_stream),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def fake_stream(self, args, cache_key=None):
+        self.calls.append(list(args))
+        # 分成小块返回，模拟逐行读取子进程输出
+        return iter(self.log_xml[i:i + 50] for i in range(0, len(self.log_xml), 50))
+
+    def test_selects_revisions_with_lua_files(self):
+        """修改、删除、复制的lua文件都算，目录、仓库路径之外的文件和非lua文件不算"""
+        self.assertEqual(["r91", "r92", "r96", "r97"], get_lua_revisions("/work/DR22", "91", "97"))
+
+    def test_single_log_command_for_range(self):
+        """整个范围只执行一次 svn log -v --xml -r start:end，不逐个提交获取diff"""
+        get_lua_revisions("/work/DR22", "91", "97")
+        self.assertEqual(1, len(self.calls))
+        self.assertEqual(['svn', 'log', '-v', '--xml', '-r', '91:97', '/work/DR22'], self.calls[0][:7])
+
+    def test_keeps_log_order(self):
+        """结果按日志输出的顺序排列，倒序范围得到倒序的版本"""
+        self.log_xml = log_xml(reversed(RANGE_ENTRIES))
+        self.assertEqual(["r97", "r96", "r92", "r91"], get_lua_revisions("/work/DR22", "97", "91"))
+        self.assertEqual('97:91', self.calls[0][5])
+
+    def test_empty_range(self):
+        """范围内没有提交时返回空列表"""
+        self.log_xml = log_xml([])
+        self.assertEqual([], get_lua_revisions("/work/DR22", "98", "97"))
+
+
+class StopWatch(Exception):
+    """让 watch 在一轮轮询后退出"""
+
+
+class TestRevisionWatermark(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.temp_dir, "state.json")
+        self.patcher = patch('builtins.print')
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_save_and_load_round_trip(self):
+        """保存后重新读取得到相同的版本号，不同仓库的记录互不影响"""
+        RevisionWatermark("/repo/a", self.state_path).save("120")
+        RevisionWatermark("/repo/b", self.state_path).save(7)
+        self.assertEqual(120, RevisionWatermark("/repo/a", self.state_path).load())
+        self.assertEqual(7, RevisionWatermark("/repo/b", self.state_path).load())
+        self.assertFalse(os.path.exists(self.state_path + ".tmp"))
+
+    def test_missing_or_corrupt_file_has_no_record(self):
+        """状态文件不存在或损坏时没有记录，之后可以正常保存"""
+        watermark = RevisionWatermark("/repo/a", self.state_path)
+        self.assertIsNone(watermark.load())
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            f.write('{"/repo/a": 1')
+        self.assertIsNone(watermark.load())
+        watermark.save(5)
+        self.assertEqual(5, watermark.load())
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self):
+        """测试前的设置"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.temp_dir, "state.json")
+        self.watermark = RevisionWatermark("/repo", self.state_path)
+        self.main_calls = []
+        self.saved = []
+        self.results = {}
+        self.patchers = [
+            patch('builtins.print'),
+            patch.object(svncommiterreview, 'get_last_svn_revision', return_value=110),
+            patch.object(svncommiterreview, 'main', self.fake_main),
+            patch.object(svncommiterreview.time, 'sleep', side_effect=StopWatch),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def fake_main(self, repo_path, start_rev, end_rev, on_reviewed=None, **kwargs):
+        """按版本顺序回调 results 中每个提交的审查结果，并记录每次回调后保存的版本号"""
+        self.main_calls.append((start_rev, end_rev))
+        for revision, success in self.results.items():
+            on_reviewed(revision, success)
+            self.saved.append(self.watermark.load())
+
+    def poll(self):
+        """运行一轮轮询"""
+        with self.assertRaises(StopWatch):
+            watch("/repo", interval=1, state_path=self.state_path, initial_lookback=20)
+
+    def test_first_run_starts_from_lookback(self):
+        """没有记录时从最新版本往前 initial_lookback 个提交开始，结束后记录最新版本"""
+        self.poll()
+        self.assertEqual([("91", "110")], self.main_calls)
+        self.assertEqual(110, self.watermark.load())
+
+    def test_watermark_advances_after_each_reviewed_revision(self):
+        """每审查完一个提交就推进已处理的版本号"""
+        self.watermark.save(100)
+        self.results = {"r103": True, "r106": True}
+        self.poll()
+        self.assertEqual([("101", "110")], self.main_calls)
+        self.assertEqual([103, 106], self.saved)
+        self.assertEqual(110, self.watermark.load())
+
+    def test_stops_at_first_failed_revision(self):
+        """遇到第一个失败的提交后不再推进，之后成功的提交也不记录"""
+        self.watermark.save(100)
+        self.results = {"r103": True, "r105": False, "r106": True}
+        self.poll()
+        self.assertEqual([103, 103, 103], self.saved)
+        self.assertEqual(103, self.watermark.load())
+
+    def test_no_new_revisions(self):
+        """没有新提交时不审查"""
+        self.watermark.save(110)
+        self.poll()
+        self.assertEqual([], self.main_calls)
+
+    def test_corrupt_state_file_starts_from_lookback(self):
+        """状态文件损坏时按没有记录处理，不会每轮都失败"""
+        with open(self.state_path, 'w', encoding='utf-8') as f:
+            f.write("not json")
+        self.poll()
+        self.assertEqual([("91", "110")], self.main_calls)
+        self.assertEqual(110, self.watermark.load())
+
+
+if __name__ == '__main__':
+    unittest.main()